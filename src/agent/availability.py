@@ -0,0 +1,414 @@
+"""Technician calendars behind `tools.get_availability` and
+`tools.create_appointment`.
+
+Every technician keeps their bookings as two parallel sorted arrays of
+start/end minutes, so checking whether a candidate visit fits is two
+bisections, whatever the number of bookings. Technicians are indexed by
+(branch, service) once at load time. A lookup walks the candidate start
+times of the requested window in order and stops as soon as it has enough
+options; booking inserts into the technician's arrays.
+
+Times are naive local datetimes, as elsewhere in the agent.
+"""
+from __future__ import annotations
+
+import bisect
+import datetime as dt
+import json
+import re
+from collections import defaultdict
+from collections.abc import Callable, Iterator
+from dataclasses import dataclass, field
+from importlib import resources
+from pathlib import Path
+from typing import Any
+
+from agent.catalogue import ServiceCatalogue, get_catalogue
+
+DAY = 24 * 60
+
+_WEEKDAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+_MONTHS = ["jan", "feb", "mar", "apr", "may", "jun",
+           "jul", "aug", "sep", "oct", "nov", "dec"]
+_ISO_DATE = re.compile(r"\b(\d{4})-(\d{2})-(\d{2})\b")
+_US_DATE = re.compile(r"\b(\d{1,2})/(\d{1,2})(?:/(\d{2,4}))?\b")
+# full names and their usual abbreviations only: "month" is not Monday,
+# "sunny" not Sunday, "wedding" not Wednesday
+_WEEKDAY_NAME = (r"mon(?:day)?|tue(?:s(?:day)?)?|wed(?:nesday)?|thu(?:r(?:s(?:day)?)?)?|"
+                 r"fri(?:day)?|sat(?:urday)?|sun(?:day)?")
+_MONTH_NAME = (r"jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|"
+               r"aug(?:ust)?|sep(?:t(?:ember)?)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?")
+_WEEKDAY = re.compile(rf"\b(?:(next|this|coming)\s+)?({_WEEKDAY_NAME})\b")
+_MONTH_DAY = re.compile(rf"\b({_MONTH_NAME})\.?\s+(\d{{1,2}})(?:st|nd|rd|th)?\b")
+_DAY_MONTH = re.compile(rf"\b(\d{{1,2}})(?:st|nd|rd|th)?\s+(?:of\s+)?({_MONTH_NAME})\b")
+_CLOCK = re.compile(r"\b(\d{1,2})(?::(\d{2}))?\s*([ap])\.?m\b")
+
+
+def to_minutes(value: dt.datetime) -> int:
+    return value.toordinal() * DAY + value.hour * 60 + value.minute
+
+
+def from_minutes(minutes: int) -> dt.datetime:
+    day, rest = divmod(minutes, DAY)
+    return dt.datetime.fromordinal(day) + dt.timedelta(minutes=rest)
+
+
+def _clock(text: str) -> int:
+    hours, minutes = text.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def _future_date(today: dt.date, month: int, day: int) -> dt.date | None:
+    # "Oct 20" means the next Oct 20
+    for year in (today.year, today.year + 1):
+        try:
+            date = dt.date(year, month, day)
+        except ValueError:
+            return None
+        if date >= today:
+            return date
+    return None
+
+
+def parse_date_range(text: str | None, today: dt.date,
+                     default_days: int = 7) -> tuple[dt.date, dt.date]:
+    """First and last day (inclusive) meant by `text`, e.g. "tomorrow",
+    "next friday", "this week", "10/24" or "2025-10-24". Text without a
+    recognisable date means the next `default_days` days."""
+    default = (today, today + dt.timedelta(days=default_days - 1))
+    if not text:
+        return default
+    lower = text.lower()
+    if (relative := _relative_range(lower, today)) is not None:
+        return relative
+    named, day = _calendar_day(lower, today)
+    if named:
+        return (day, day) if day else default
+    if m := _WEEKDAY.search(lower):
+        ahead = (_WEEKDAYS.index(m[2][:3]) - today.weekday()) % 7
+        if m[1] == "next" and ahead == 0:
+            ahead = 7
+        day = today + dt.timedelta(days=ahead)
+        return day, day
+    return default
+
+
+def _relative_range(lower: str, today: dt.date) -> tuple[dt.date, dt.date] | None:
+    # "tomorrow", "this weekend", "next week", ...
+    if "day after tomorrow" in lower:
+        day = today + dt.timedelta(days=2)
+        return day, day
+    if "tomorrow" in lower:
+        day = today + dt.timedelta(days=1)
+        return day, day
+    if "today" in lower or "tonight" in lower:
+        return today, today
+    monday = today - dt.timedelta(days=today.weekday())
+    if "next weekend" in lower:
+        saturday = monday + dt.timedelta(days=12)
+        return saturday, saturday + dt.timedelta(days=1)
+    if "weekend" in lower:
+        saturday = max(today, monday + dt.timedelta(days=5))
+        return saturday, monday + dt.timedelta(days=6)
+    if "next week" in lower:
+        return monday + dt.timedelta(days=7), monday + dt.timedelta(days=13)
+    if "this week" in lower:
+        return today, monday + dt.timedelta(days=6)
+    return None
+
+
+def _calendar_day(lower: str, today: dt.date) -> tuple[bool, dt.date | None]:
+    # whether `lower` names a calendar date, and that date if it exists
+    if m := _ISO_DATE.search(lower):
+        try:
+            return True, dt.date(int(m[1]), int(m[2]), int(m[3]))
+        except ValueError:
+            return True, None
+    if m := _US_DATE.search(lower):
+        if not m[3]:
+            return True, _future_date(today, int(m[1]), int(m[2]))
+        year = int(m[3]) + (2000 if len(m[3]) == 2 else 0)
+        try:
+            return True, dt.date(year, int(m[1]), int(m[2]))
+        except ValueError:
+            return True, None
+    if m := _MONTH_DAY.search(lower):
+        return True, _future_date(today, _MONTHS.index(m[1][:3]) + 1, int(m[2]))
+    if m := _DAY_MONTH.search(lower):
+        return True, _future_date(today, _MONTHS.index(m[2][:3]) + 1, int(m[1]))
+    return False, None
+
+
+def parse_time_preference(text: str | None) -> tuple[int, int]:
+    """Window of start times (minutes after midnight, end exclusive) for
+    "AM", "PM", "morning", "evening", "10am", ... Anything else is the
+    whole day."""
+    lower = (text or "").lower()
+    if m := _CLOCK.search(lower):
+        hour = int(m[1]) % 12 + (12 if m[3] == "p" else 0)
+        at = hour * 60 + int(m[2] or 0)
+        # around the time asked for
+        return at - 60, at + 61
+    if "evening" in lower or "after work" in lower:
+        return 16 * 60, DAY
+    # "AM"/"PM" on their own are the slot value, also after a date ("tomorrow
+    # AM"); "I am free" and "am I free" are the verb
+    if re.search(r"\bp\.?m\b|\b(?:afternoon|after lunch)\b", lower):
+        return 12 * 60, DAY
+    if re.search(r"(?<!\bi )\ba\.?m\b(?!\s+i\b)|\b(?:morning|before noon)\b", lower):
+        return 0, 12 * 60
+    return 0, DAY
+
+
+class Calendar:
+    """Bookings of one technician: non-overlapping [start, end) intervals in
+    minutes, kept as parallel sorted arrays."""
+
+    __slots__ = ("starts", "ends")
+
+    def __init__(self) -> None:
+        self.starts: list[int] = []
+        self.ends: list[int] = []
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def is_free(self, start: int, end: int) -> bool:
+        i = bisect.bisect_right(self.starts, start)
+        # the booking before must be over, the one after not yet started
+        if i and self.ends[i - 1] > start:
+            return False
+        return i == len(self.starts) or self.starts[i] >= end
+
+    def book(self, start: int, end: int) -> bool:
+        if not self.is_free(start, end):
+            return False
+        i = bisect.bisect_right(self.starts, start)
+        self.starts.insert(i, start)
+        self.ends.insert(i, end)
+        return True
+
+    def release(self, start: int) -> bool:
+        i = bisect.bisect_left(self.starts, start)
+        if i == len(self.starts) or self.starts[i] != start:
+            return False
+        del self.starts[i], self.ends[i]
+        return True
+
+
+@dataclass(frozen=True, slots=True)
+class Shift:
+    # working hours, minutes after midnight, and weekdays (Monday is 0)
+    start: int = 8 * 60
+    end: int = 17 * 60
+    days: frozenset[int] = frozenset(range(6))
+
+    def covers(self, minutes: int, duration: int) -> bool:
+        day, at = divmod(minutes, DAY)
+        # ordinal 1 (0001-01-01) was a Monday
+        return ((day - 1) % 7 in self.days and at >= self.start
+                and at + duration <= self.end)
+
+
+@dataclass(eq=False)
+class Technician:
+    id: str
+    branch: str
+    skills: frozenset[str]
+    shift: Shift = Shift()
+    name: str = ""
+    calendar: Calendar = field(default_factory=Calendar, repr=False)
+
+
+class AvailabilityEngine:
+    """Open visit times per service and branch, and booking of them.
+
+    Offered times are on a `step`-minute grid and at least `lead` minutes
+    from now. A slot is a service, branch and start time; booking it
+    assigns whichever qualified technician is still free then.
+    """
+
+    def __init__(self, technicians: list[Technician], catalogue: ServiceCatalogue,
+                 step: int = 60, lead: int = 120,
+                 now: Callable[[], dt.datetime] = dt.datetime.now):
+        self.technicians = technicians
+        self.catalogue = catalogue
+        self.step = step
+        self.lead = lead
+        self.now = now
+        # (branch, service id) -> shift -> technicians who can do it there,
+        # so working hours are checked once per shift, not per technician
+        self._index: defaultdict[tuple[str, str], dict[Shift, list[Technician]]] = \
+            defaultdict(dict)
+        for tech in technicians:
+            for service_id in tech.skills:
+                self._index[tech.branch, service_id].setdefault(tech.shift, []).append(tech)
+        self.branches = sorted({t.branch for t in technicians})
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any], catalogue: ServiceCatalogue | None = None,
+                  copies: int = 1, **kwargs: Any) -> AvailabilityEngine:
+        """`copies` > 1 repeats the roster, e.g. to load-test a bigger team."""
+        shift = data.get("shift", {})
+        technicians = [
+            Technician(
+                id=t["id"] if copies == 1 else f"{t['id']}_{n}",
+                branch=t["branch"], skills=frozenset(t["skills"]),
+                shift=Shift(
+                    start=_clock(t.get("start", shift.get("start", "08:00"))),
+                    end=_clock(t.get("end", shift.get("end", "17:00"))),
+                    days=frozenset(t.get("days", shift.get("days", range(6))))),
+                name=t.get("name", ""))
+            for n in range(copies) for t in data["technicians"]
+        ]
+        return cls(technicians, catalogue or get_catalogue(), **kwargs)
+
+    @classmethod
+    def load(cls, path: str | Path | None = None, **kwargs: Any) -> AvailabilityEngine:
+        """Read a technician roster, by default the one shipped with the package."""
+        if path is None:
+            raw = resources.files("agent").joinpath("data/technicians.json").read_text()
+        else:
+            raw = Path(path).read_text()
+        return cls.from_dict(json.loads(raw), **kwargs)
+
+    def _duration(self, service_id: str) -> int:
+        service = self.catalogue.get(service_id)
+        return service.duration if service else 60
+
+    def _branches(self, service_id: str, branch: str | None) -> list[str]:
+        service = self.catalogue.get(service_id)
+        branches = [branch] if branch else self.branches
+        return [b for b in branches if service is None or service.offered_at(b)]
+
+    def _free(self, service_id: str, branch: str, start: int,
+              duration: int) -> Iterator[Technician]:
+        for shift, technicians in self._index.get((branch, service_id), {}).items():
+            if shift.covers(start, duration):
+                for tech in technicians:
+                    if tech.calendar.is_free(start, start + duration):
+                        yield tech
+
+    def find_slots(self, service_id: str, date_range: str | None = None,
+                   time_preference: str | None = None, branch: str | None = None,
+                   limit: int = 6, per_day: int = 2) -> list[dict[str, Any]]:
+        """Earliest open visits in the requested window, at most `per_day`
+        per day so the options spread over several days."""
+        now = self.now()
+        first, last = parse_date_range(date_range, now.date())
+        window_start, window_end = parse_time_preference(time_preference)
+        duration = self._duration(service_id)
+        branches = self._branches(service_id, branch)
+        shifts = [shift for b in branches for shift in self._index.get((b, service_id), {})]
+        if not shifts:
+            return []
+        # only start times someone could work
+        window_start = max(window_start, min(shift.start for shift in shifts))
+        window_start += -window_start % self.step
+        window_end = min(window_end, max(shift.end for shift in shifts) - duration + 1)
+        earliest = to_minutes(now) + self.lead
+        slots: list[dict[str, Any]] = []
+        for day in range(first.toordinal(), last.toordinal() + 1):
+            today: list[dict[str, Any]] = []
+            base = day * DAY
+            start = window_start
+            while start < window_end and len(today) < per_day:
+                at = base + start
+                start += self.step
+                if at < earliest:
+                    continue
+                for b in branches:
+                    if next(self._free(service_id, b, at, duration), None) is not None:
+                        today.append(self._slot(service_id, b, at, duration))
+                        break
+            slots.extend(today)
+            if len(slots) >= limit:
+                break
+        return slots[:limit]
+
+    @staticmethod
+    def make_slot_id(service_id: str, branch: str, start: int) -> str:
+        return f"{service_id}@{branch}@{from_minutes(start):%Y%m%dT%H%M}"
+
+    def _slot(self, service_id: str, branch: str, start: int,
+              duration: int) -> dict[str, Any]:
+        begins = from_minutes(start)
+        return {
+            "slot_id": self.make_slot_id(service_id, branch, start),
+            "start_iso": begins.isoformat(),
+            "end_iso": from_minutes(start + duration).isoformat(),
+            "branch": branch,
+            "location": self.catalogue.branches.get(branch, branch),
+        }
+
+    @staticmethod
+    def parse_slot_id(slot_id: str) -> tuple[str, str, int]:
+        service_id, branch, when = slot_id.split("@")
+        return service_id, branch, to_minutes(dt.datetime.strptime(when, "%Y%m%dT%H%M"))
+
+    def describe(self, slot_id: str) -> dict[str, Any]:
+        """The slot in the shape `find_slots` returns it."""
+        service_id, branch, start = self.parse_slot_id(slot_id)
+        return self._slot(service_id, branch, start, self._duration(service_id))
+
+    def candidates(self, slot_id: str) -> tuple[int, int, list[Technician]]:
+        """(start, end, technicians on shift) for a slot, whatever their
+        calendars say. Raises ValueError for a malformed slot id."""
+        service_id, branch, start = self.parse_slot_id(slot_id)
+        duration = self._duration(service_id)
+        technicians = [tech for shift, techs in self._index.get((branch, service_id), {}).items()
+                       if shift.covers(start, duration) for tech in techs]
+        return start, start + duration, technicians
+
+    def book(self, slot_id: str) -> Technician | None:
+        """Book the slot with a technician who is free then, None if the slot
+        is taken (or isn't one of ours)."""
+        try:
+            service_id, branch, start = self.parse_slot_id(slot_id)
+        except ValueError:
+            return None
+        duration = self._duration(service_id)
+        for tech in self._free(service_id, branch, start, duration):
+            tech.calendar.book(start, start + duration)
+            return tech
+        return None
+
+    def _technician(self, service_id: str, branch: str,
+                    technician_id: str) -> Technician | None:
+        for technicians in self._index.get((branch, service_id), {}).values():
+            for tech in technicians:
+                if tech.id == technician_id:
+                    return tech
+        return None
+
+    def claim(self, slot_id: str, technician_id: str) -> bool:
+        """Book the slot with this technician, e.g. as booked by another
+        process; False if they aren't free then."""
+        service_id, branch, start = self.parse_slot_id(slot_id)
+        tech = self._technician(service_id, branch, technician_id)
+        return tech is not None and tech.calendar.book(
+            start, start + self._duration(service_id))
+
+    def release(self, slot_id: str, technician_id: str) -> bool:
+        """Undo `book`, e.g. when an appointment is cancelled."""
+        service_id, branch, start = self.parse_slot_id(slot_id)
+        tech = self._technician(service_id, branch, technician_id)
+        return tech is not None and tech.calendar.release(start)
+
+
+_engine: AvailabilityEngine | None = None
+
+
+def get_engine() -> AvailabilityEngine:
+    """The engine used by `agent.tools`: the packaged roster, loaded and
+    indexed on first use, unless `set_engine` installed another."""
+    global _engine
+    if _engine is None:
+        _engine = AvailabilityEngine.load()
+    return _engine
+
+
+def set_engine(engine: AvailabilityEngine | None) -> None:
+    """Install the engine behind `agent.tools` (None: the packaged one)."""
+    global _engine
+    _engine = engine
@@ -0,0 +1,381 @@
+"""Model backends behind `LlmClient`.
+
+`ChatOpenAIBackend` talks to an OpenAI-compatible server through LangChain.
+`ReplayBackend` answers offline, deterministically, with configurable
+latency, so the state machine can be benchmarked without a model server.
+
+Backends are created by name with `create_backend`; the module behind a
+name, and the SDK it needs, is imported on first use, so importing the
+agent stays fast. `LlmBackend.warmup` loads the rest ahead of traffic.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import importlib
+import json
+import random
+import re
+import time
+from abc import ABC, abstractmethod
+from collections.abc import AsyncIterator, Callable
+from typing import TYPE_CHECKING, Any
+
+from agent.prompts import (
+    ANYTHING_ELSE_PROMPT,
+    END_CONVERSATION_PROMPT,
+    GREETING_PROMPT,
+    LISTEN_AND_ROUTE_PROMPT,
+    QUESTION_TEMPLATES,
+    REQUEST_INFO_PROMPT,
+    ROUTE_AND_ASK_PROMPT,
+    SUMMARIZE_PROMPT,
+)
+
+if TYPE_CHECKING:
+    from agent.structured import Schema
+
+Prompt = list[dict[str, str] | tuple[str, str]] | str
+
+# how ChatOpenAIBackend asks the server for JSON that fits a schema
+STRUCTURED_OUTPUT = ("json_object", "json_schema", "guided_json")
+
+
+class LlmBackend(ABC):
+    @abstractmethod
+    def invoke(self, messages: Prompt) -> str:
+        ...
+
+    @abstractmethod
+    async def ainvoke(self, messages: Prompt) -> str:
+        ...
+
+    @abstractmethod
+    def astream(self, messages: Prompt) -> AsyncIterator[str]:
+        ...
+
+    async def abatch(self, prompts: list[Prompt]) -> list[str | Exception]:
+        """Completions of several prompts, in order; a prompt that failed
+        gets its exception. By default the requests are sent concurrently;
+        backends whose server has a batch API send them as one request."""
+        return await asyncio.gather(*(self.ainvoke(p) for p in prompts),
+                                    return_exceptions=True)
+
+    def with_schema(self, schema: Schema) -> LlmBackend:
+        """A backend whose answers are constrained to `schema`, if the
+        server can do that; otherwise this one."""
+        return self
+
+    async def warmup(self) -> None:
+        """Do ahead of traffic what the first call would otherwise wait
+        for: load the SDK, build clients, open connections."""
+        return None
+
+
+class ChatOpenAIBackend(LlmBackend):
+    """`structured_output` is how the server is asked for JSON answers:
+    "json_object" (JSON mode), "json_schema" (OpenAI structured outputs),
+    "guided_json" (vLLM guided decoding) or None when it supports none.
+    Other keyword arguments go to `ChatOpenAI`, e.g. a shared `http_client`
+    / `http_async_client` or `max_retries`."""
+
+    def __init__(self, model_name: str, base_url: str, api_key: str,
+                 temperature: float = 0.0,
+                 structured_output: str | None = None,
+                 **client_kwargs: Any):
+        if structured_output not in (None, *STRUCTURED_OUTPUT):
+            raise ValueError(f"structured_output must be one of {STRUCTURED_OUTPUT}")
+        self._client_kwargs = dict(
+            model_name=model_name,
+            base_url=base_url,
+            api_key=api_key,
+            temperature=temperature,
+            **client_kwargs,
+        )
+        self._client: Any = None
+        self.structured_output = structured_output
+        # schema name -> backend bound to it
+        self._bound: dict[str, ChatOpenAIBackend] = {}
+
+    @property
+    def client(self) -> Any:
+        # LangChain and the OpenAI SDK take a second to import: not before
+        # the first call (or warmup)
+        if self._client is None:
+            from langchain_openai import ChatOpenAI
+            self._client = ChatOpenAI(**self._client_kwargs)
+        return self._client
+
+    async def warmup(self) -> None:
+        # listing the models also opens a keep-alive connection
+        await self.client.root_async_client.models.list()
+
+    def with_schema(self, schema: Schema) -> LlmBackend:
+        if self.structured_output is None:
+            return self
+        bound = self._bound.get(schema.name)
+        if bound is None:
+            if self.structured_output == "json_object":
+                kwargs: dict[str, Any] = {"response_format": {"type": "json_object"}}
+            elif self.structured_output == "json_schema":
+                kwargs = {"response_format": {"type": "json_schema", "json_schema": {
+                    "name": schema.name, "schema": schema.json_schema}}}
+            else:
+                kwargs = {"extra_body": {"guided_json": schema.json_schema}}
+            bound = ChatOpenAIBackend.__new__(ChatOpenAIBackend)
+            bound._client = self.client.bind(**kwargs)
+            bound.structured_output = None
+            bound._bound = {}
+            self._bound[schema.name] = bound
+        return bound
+
+    def invoke(self, messages: Prompt) -> str:
+        return self.client.invoke(messages).content
+
+    async def ainvoke(self, messages: Prompt) -> str:
+        return (await self.client.ainvoke(messages)).content
+
+    async def astream(self, messages: Prompt) -> AsyncIterator[str]:
+        async for chunk in self.client.astream(messages):
+            if chunk.content:
+                yield chunk.content
+
+    async def abatch(self, prompts: list[Prompt]) -> list[str | Exception]:
+        # chat completions have no batch endpoint: LangChain multiplexes
+        # the requests over the client's connection pool
+        results = await self.client.abatch(prompts, return_exceptions=True)
+        return [r if isinstance(r, Exception) else r.content for r in results]
+
+
+class Latency:
+    """Latency distribution in seconds, sampled with the backend's RNG."""
+
+    def __init__(self, sample: Callable[[random.Random], float]):
+        self._sample = sample
+
+    def __call__(self, rng: random.Random) -> float:
+        return max(0.0, self._sample(rng))
+
+    @classmethod
+    def fixed(cls, seconds: float) -> Latency:
+        return cls(lambda rng: seconds)
+
+    @classmethod
+    def uniform(cls, low: float, high: float) -> Latency:
+        return cls(lambda rng: rng.uniform(low, high))
+
+    @classmethod
+    def normal(cls, mean: float, stddev: float) -> Latency:
+        return cls(lambda rng: rng.gauss(mean, stddev))
+
+    @classmethod
+    def lognormal(cls, median: float, sigma: float) -> Latency:
+        # long right tail, like real completion times
+        return cls(lambda rng: median * rng.lognormvariate(0.0, sigma))
+
+
+def _text(messages: Prompt) -> str:
+    if isinstance(messages, str):
+        return messages
+    parts = []
+    for m in messages:
+        parts.append(m["content"] if isinstance(m, dict) else m[1])
+    return "\n".join(parts)
+
+
+def prompt_key(messages: Prompt) -> str:
+    """Stable fingerprint of a prompt, used to record and replay completions."""
+    if isinstance(messages, str):
+        data = messages
+    else:
+        data = json.dumps([[m["role"], m["content"]] if isinstance(m, dict) else list(m)
+                           for m in messages])
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+_NO = re.compile(r"\b(no|nope|nah|that's all|that is all)\b", re.I)
+_YES = re.compile(r"\b(yes|yeah|yep|sure)\b", re.I)
+
+
+class ReplayBackend(LlmBackend):
+    """Deterministic offline backend.
+
+    Completions are looked up in order:
+
+    1. `recorded`: exact prompts (by `prompt_key`), e.g. saved by
+       `RecordingBackend` from a real server;
+    2. `routes`: the JSON to return for a user utterance on
+       `LISTEN_AND_ROUTE_PROMPT` (unknown utterances route to "other"); on
+       `ROUTE_AND_ASK_PROMPT` the next question comes from
+       `QUESTION_TEMPLATES`;
+    3. canned answers for the other prompts in `agent.prompts`, with a
+       keyword yes/no for `ANYTHING_ELSE_PROMPT`.
+
+    Each call waits `latency` + `jitter` before answering, plus
+    `chunk_delay` per streamed word. All randomness comes from `seed`.
+    """
+
+    GREETING = "Hello! Thank you for calling Jacobs Plumbing. How can I help you today?"
+    GOODBYE = "Thank you for calling Jacobs Plumbing. Have a great day, goodbye!"
+    ANSWER = "Happy to help! One of our plumbers can look into that for you."
+    SUMMARY = "The caller is booking a residential plumbing appointment."
+
+    def __init__(self, routes: dict[str, dict[str, Any]] | None = None,
+                 recorded: dict[str, str] | None = None,
+                 latency: Latency | float = 0.0,
+                 jitter: Latency | float = 0.0,
+                 chunk_delay: float = 0.0,
+                 seed: int = 0):
+        self.routes = routes or {}
+        self.recorded = recorded or {}
+        self.latency = latency if isinstance(latency, Latency) else Latency.fixed(latency)
+        self.jitter = jitter if isinstance(jitter, Latency) else Latency.fixed(jitter)
+        self.chunk_delay = chunk_delay
+        self.rng = random.Random(seed)
+        self.calls = 0
+
+    @classmethod
+    def load(cls, path: str, **kwargs: Any) -> ReplayBackend:
+        with open(path) as f:
+            return cls(recorded=json.load(f), **kwargs)
+
+    def respond(self, messages: Prompt) -> str:
+        key = prompt_key(messages)
+        if key in self.recorded:
+            return self.recorded[key]
+        task = messages if isinstance(messages, str) else _text(messages[-1:])
+        utterance = task.rpartition("[User utterance]\n")[2].strip()
+        if LISTEN_AND_ROUTE_PROMPT.strip() in task:
+            return json.dumps(self.routes.get(utterance, {"intent": "other", "slots": {}}))
+        if ROUTE_AND_ASK_PROMPT.strip() in task:
+            return json.dumps(self._route_and_ask(task, utterance))
+        if ANYTHING_ELSE_PROMPT.strip() in task:
+            answer = "no" if _NO.search(utterance) else "yes" if _YES.search(utterance) else "other"
+            return json.dumps({"answer": answer})
+        if REQUEST_INFO_PROMPT.strip() in task:
+            about = task.partition(REQUEST_INFO_PROMPT.strip())[2].strip()
+            return f"Thanks! Could you tell me your {about}"
+        if GREETING_PROMPT.strip() in task:
+            return self.GREETING
+        if END_CONVERSATION_PROMPT.strip() in task:
+            return self.GOODBYE
+        if SUMMARIZE_PROMPT.strip() in task:
+            return self.SUMMARY
+        # HANDOFF_TO_COMPLETION_PROMPT and anything unknown
+        return self.ANSWER
+
+    def _route_and_ask(self, task: str, utterance: str) -> dict[str, Any]:
+        route = dict(self.routes.get(utterance, {"intent": "other", "slots": {}}))
+        given = {k for k, v in route.get("slots", {}).items() if v}
+        if given & {"preferred_date", "preferred_time"}:
+            given.add("preferred_date_or_time")
+        missing = task.partition("[Missing information]\n")[2].partition("\n\n")[0].split()
+        next_slot = next((m for m in missing if m not in given), "")
+        if route.get("intent") != "book":
+            next_slot = ""
+        route["next_slot"] = next_slot
+        route["next_question"] = QUESTION_TEMPLATES.get(next_slot, "")
+        return route
+
+    def _first_token_delay(self) -> float:
+        return self.latency(self.rng) + self.jitter(self.rng)
+
+    def invoke(self, messages: Prompt) -> str:
+        self.calls += 1
+        text = self.respond(messages)
+        time.sleep(self._first_token_delay() + self.chunk_delay * len(text.split()))
+        return text
+
+    async def ainvoke(self, messages: Prompt) -> str:
+        self.calls += 1
+        text = self.respond(messages)
+        await asyncio.sleep(self._first_token_delay() + self.chunk_delay * len(text.split()))
+        return text
+
+    async def abatch(self, prompts: list[Prompt]) -> list[str | Exception]:
+        # like a server batch endpoint: one request, as slow as its longest answer
+        self.calls += 1
+        texts = [self.respond(p) for p in prompts]
+        words = max((len(t.split()) for t in texts), default=0)
+        await asyncio.sleep(self._first_token_delay() + self.chunk_delay * words)
+        return texts
+
+    async def astream(self, messages: Prompt) -> AsyncIterator[str]:
+        self.calls += 1
+        text = self.respond(messages)
+        await asyncio.sleep(self._first_token_delay())
+        words = text.split(" ")
+        for i, word in enumerate(words):
+            if self.chunk_delay:
+                await asyncio.sleep(self.chunk_delay)
+            yield word if i == len(words) - 1 else word + " "
+
+
+class RecordingBackend(LlmBackend):
+    """Passes calls through to `backend` and keeps every completion by
+    `prompt_key`; `save` writes them for `ReplayBackend.load`."""
+
+    def __init__(self, backend: LlmBackend):
+        self.backend = backend
+        self.recorded: dict[str, str] = {}
+
+    def with_schema(self, schema: Schema) -> LlmBackend:
+        bound = RecordingBackend(self.backend.with_schema(schema))
+        bound.recorded = self.recorded
+        return bound
+
+    async def warmup(self) -> None:
+        await self.backend.warmup()
+
+    def invoke(self, messages: Prompt) -> str:
+        text = self.backend.invoke(messages)
+        self.recorded[prompt_key(messages)] = text
+        return text
+
+    async def ainvoke(self, messages: Prompt) -> str:
+        text = await self.backend.ainvoke(messages)
+        self.recorded[prompt_key(messages)] = text
+        return text
+
+    async def astream(self, messages: Prompt) -> AsyncIterator[str]:
+        parts = []
+        async for chunk in self.backend.astream(messages):
+            parts.append(chunk)
+            yield chunk
+        self.recorded[prompt_key(messages)] = "".join(parts)
+
+    async def abatch(self, prompts: list[Prompt]) -> list[str | Exception]:
+        results = await self.backend.abatch(prompts)
+        for messages, result in zip(prompts, results, strict=True):
+            if not isinstance(result, Exception):
+                self.recorded[prompt_key(messages)] = result
+        return results
+
+    def save(self, path: str) -> None:
+        with open(path, "w") as f:
+            json.dump(self.recorded, f, indent=1)
+
+
+# backend name -> "module:attribute" of its class or factory
+BACKENDS: dict[str, str] = {
+    "openai": "agent.backends:ChatOpenAIBackend",
+    "pool": "agent.pool:PoolBackend.from_urls",
+    "replay": "agent.backends:ReplayBackend",
+}
+
+
+def register_backend(name: str, target: str) -> None:
+    """Make `create_backend(name)` call `target` ("module:attribute"); the
+    module is imported when the first such backend is created."""
+    BACKENDS[name] = target
+
+
+def create_backend(name: str, **kwargs: Any) -> LlmBackend:
+    try:
+        module, _, path = BACKENDS[name].partition(":")
+    except KeyError:
+        raise ValueError(f"unknown backend {name!r}, one of {sorted(BACKENDS)}") from None
+    factory: Any = importlib.import_module(module)
+    for attribute in path.split("."):
+        factory = getattr(factory, attribute)
+    return factory(**kwargs)
@@ -0,0 +1,97 @@
+"""Micro-batching of small classification calls across sessions.
+
+Under load many sessions send a routing or yes/no prompt at nearly the same
+moment. `MicroBatcher` collects these requests for `window` seconds, or
+until `max_batch` are waiting, and sends them with `LlmClient.abatch`: in
+one request where the server has a batch API, concurrently over the
+client's connections where it doesn't. Each waiting coroutine gets its own
+completion back. The extra latency is bounded by `window`.
+
+    router = MicroBatcher(llm, window=0.01)
+    handler = StateHandler(llm, router=router)
+"""
+from __future__ import annotations
+
+import asyncio
+import contextvars
+from typing import Any
+
+from agent.llm import LlmClient
+from agent.structured import Schema
+
+
+class MicroBatcher:
+    def __init__(self, llm: LlmClient, window: float = 0.01, max_batch: int = 32):
+        self.llm = llm
+        self.window = window
+        self.max_batch = max_batch
+        # (prompt, schema, future) waiting for the next batch
+        self._pending: list[tuple[Any, Schema | None, asyncio.Future]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        # batches in flight: the loop keeps only weak references to tasks
+        self._tasks: set[asyncio.Task] = set()
+        self.requests = 0
+        self.batches = 0
+
+    async def submit(self, messages: Any, schema: Schema | None = None) -> str:
+        """The completion of `messages`, sent with the next batch. Cancelling
+        the caller drops the prompt if its batch hasn't gone out yet."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((messages, schema, future))
+        self.requests += 1
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            # the batch belongs to no session: don't inherit the caller's
+            # context (tracing span, counters)
+            self._timer = loop.call_later(self.window, self._flush,
+                                          context=contextvars.Context())
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        # prompts can be batched only with prompts for the same schema
+        groups: dict[str | None, list[tuple[Any, Schema | None, asyncio.Future]]] = {}
+        for request in batch:
+            if not request[2].done():
+                groups.setdefault(request[1].name if request[1] else None, []).append(request)
+        loop = asyncio.get_running_loop()
+        for group in groups.values():
+            self.batches += 1
+            task = loop.create_task(self._send(group), context=contextvars.Context())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, group: list[tuple[Any, Schema | None, asyncio.Future]]) -> None:
+        try:
+            try:
+                results = await self.llm.abatch([messages for messages, _, _ in group],
+                                                schema=group[0][1])
+                if len(results) != len(group):
+                    raise RuntimeError(f"batch of {len(group)} prompts "
+                                       f"returned {len(results)} results")
+            except Exception as e:
+                results = [e] * len(group)
+            for (_, _, future), result in zip(group, results, strict=True):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+        finally:
+            # cancelled with the loop: nobody may be left waiting
+            for _, _, future in group:
+                if not future.done():
+                    future.set_exception(RuntimeError("batch was not sent"))
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "mean_batch": round(self.requests / self.batches, 2) if self.batches else 0.0,
+        }
@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import random
+import re
+import time
+from collections import OrderedDict
+from typing import Any
+
+_SPACES = re.compile(r"\s+")
+
+
+def normalize(text: str) -> str:
+    # case, spacing and trailing punctuation don't change what we'd answer
+    return _SPACES.sub(" ", text).strip().strip(".!?").casefold()
+
+
+class ResponseCache:
+    """LRU + TTL cache of completions for static prompts (greeting, goodbye,
+    FAQ answers), keyed on the normalized prompt and the model parameters.
+
+    Each key holds a pool of up to `variants` completions. Until `variants`
+    completions have been stored a lookup is a miss, so the caller generates
+    another one; after that a random variant is returned, which keeps
+    repeated replies varied.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float | None = 3600.0,
+                 variants: int = 1, seed: int | None = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.variants = variants
+        self.rng = random.Random(seed)
+        # key -> (expires, distinct variants, completions stored)
+        self._entries: OrderedDict[str, tuple[float, list[str], int]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def key(messages: Any, **params: Any) -> str:
+        if isinstance(messages, str):
+            messages = [("user", messages)]
+        data = [[m["role"], normalize(m["content"])] if isinstance(m, dict)
+                else [m[0], normalize(m[1])] for m in messages]
+        raw = json.dumps([data, sorted(params.items())], default=str)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def _entry(self, key: str) -> tuple[list[str], int]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return [], 0
+        expires, pool, stored = entry
+        if expires < time.monotonic():
+            del self._entries[key]
+            return [], 0
+        return pool, stored
+
+    def get(self, key: str, partial: bool = False) -> str | None:
+        """A cached variant, or None if the caller should generate one.
+        `partial` accepts a pool that isn't full yet."""
+        pool, stored = self._entry(key)
+        if not pool or (stored < self.variants and not partial):
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return self.rng.choice(pool)
+
+    def put(self, key: str, text: str) -> None:
+        pool, stored = self._entry(key)
+        if text not in pool:
+            pool = [*pool, text][-self.variants:]
+        expires = time.monotonic() + self.ttl if self.ttl else float("inf")
+        self._entries[key] = (expires, pool, stored + 1)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,258 @@
+"""Service catalogue behind `tools.check_service`.
+
+Services are loaded once from `agent/data/services.json` and indexed by
+every name, key and synonym:
+
+- a normalized phrase -> service map answers exact mentions in O(1);
+- an inverted index from word stems to aliases finds candidates for free
+  text ("my kitchen drain is clogged"), scored by IDF-weighted overlap;
+- words the index doesn't know are corrected to the closest vocabulary
+  word, found through a character-trigram index and ranked by edit
+  distance ("plumbng", "hydro jeting");
+- a query about another trade's work ("roof repair") matches nothing,
+  even when it shares a generic word such as "repair" with a service.
+"""
+from __future__ import annotations
+
+import heapq
+import json
+import math
+import re
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from functools import lru_cache
+from importlib import resources
+from pathlib import Path
+from typing import Any
+
+_WORDS = re.compile(r"[a-z0-9]+(?:-[a-z0-9]+)*")
+# words that say nothing about which service is meant
+_STOPWORDS = frozenset(
+    "a an the i im my me we our need want would like to for of on in at and or "
+    "some please service services appointment book booking schedule get have has is "
+    "it its with".split())
+_SUFFIXES = ("ing", "ers", "ed", "er", "s")
+# what to do rather than what to do it to: on their own they don't make a
+# query about plumbing
+_ACTIONS = ("repair fix install installation replace replacement clean unclog "
+            "inspection visit")
+# things other trades work on
+OTHER_TRADES = (
+    "roof gutter chimney window door floor tile drywall paint fence garage "
+    "electrical electric electrician wiring outlet light lamp furnace hvac "
+    "car engine brake tire computer laptop phone tv lawn oven stove")
+
+
+def _stem(word: str) -> str:
+    for suffix in _SUFFIXES:
+        # "water" and "pipes" keep enough of the word to stay distinct
+        keep = 4 if suffix.startswith("er") else 3
+        if word.endswith(suffix) and len(word) - len(suffix) >= keep:
+            word = word[:-len(suffix)]
+            if len(word) > 3 and word[-1] == word[-2] and word[-1] not in "lsz":
+                word = word[:-1]  # "clogg" -> "clog", "jett" -> "jet"
+            break
+    return word
+
+
+def terms(text: str) -> list[str]:
+    """Stems of the meaningful words of `text`; hyphens are dropped so that
+    "re-pipe" and "repipe" agree."""
+    words = _WORDS.findall(text.lower().replace("'", ""))
+    return [_stem(w.replace("-", "")) for w in words if w not in _STOPWORDS]
+
+
+def _trigrams(word: str) -> set[str]:
+    padded = f"#{word}#"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Levenshtein distance, or `limit + 1` once it is known to exceed `limit`."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1,
+                               previous[j - 1] + (ca != cb)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+@dataclass(frozen=True, slots=True)
+class Service:
+    id: str
+    key: str
+    name: str
+    synonyms: tuple[str, ...] = ()
+    # branches offering the service, empty for all of them
+    branches: tuple[str, ...] = ()
+    # length of a visit, minutes
+    duration: int = 60
+
+    def offered_at(self, branch: str | None) -> bool:
+        return branch is None or not self.branches or branch in self.branches
+
+
+class ServiceCatalogue:
+    """Indexed, typo-tolerant service lookup.
+
+    `threshold` is the score (0..1) a match needs to count as the service
+    the caller asked for; weaker matches are only suggested. A query naming
+    one of the `foreign` words (see `OTHER_TRADES`) only matches through a
+    plumbing term: "leaking pipe in the garage" does, "roof repair" doesn't.
+    """
+
+    def __init__(self, services: list[Service], branches: dict[str, str] | None = None,
+                 threshold: float = 0.5, margin: float = 0.05,
+                 foreign: str = OTHER_TRADES):
+        self.services = services
+        self.branches = branches or {}
+        self.threshold = threshold
+        # a best match this close to the runner-up is ambiguous ("toilet")
+        self.margin = margin
+        self._foreign = frozenset(terms(foreign))
+        self._actions = frozenset(terms(_ACTIONS))
+        self._by_id = {s.id: s for s in services}
+        # normalized alias -> service index
+        self._phrases: dict[str, int] = {}
+        # alias index -> (service index, alias terms)
+        self._aliases: list[tuple[int, frozenset[str]]] = []
+        postings: defaultdict[str, list[int]] = defaultdict(list)
+        for i, service in enumerate(services):
+            for alias in (service.key, service.name, *service.synonyms):
+                alias_terms = terms(alias)
+                if not alias_terms:
+                    continue
+                self._phrases.setdefault(" ".join(alias_terms), i)
+                for term in set(alias_terms):
+                    postings[term].append(len(self._aliases))
+                self._aliases.append((i, frozenset(alias_terms)))
+        self._postings = dict(postings)
+        # rare terms say more about the service than common ones
+        n = len(self._aliases)
+        self._idf = {t: math.log(1 + n / len(p)) for t, p in self._postings.items()}
+        self._mean_idf = sum(self._idf.values()) / len(self._idf) if self._idf else 1.0
+        self._alias_weight = [sum(self._idf[t] for t in alias_terms)
+                              for _, alias_terms in self._aliases]
+        trigram_index: defaultdict[str, list[str]] = defaultdict(list)
+        for term in self._postings:
+            for gram in _trigrams(term):
+                trigram_index[gram].append(term)
+        self._trigram_index = dict(trigram_index)
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any], **kwargs: Any) -> ServiceCatalogue:
+        services = [Service(id=s["id"], key=s["key"], name=s["name"],
+                            synonyms=tuple(s.get("synonyms", ())),
+                            branches=tuple(s.get("branches", ())),
+                            duration=s.get("duration", 60))
+                    for s in data["services"]]
+        return cls(services, data.get("branches"), **kwargs)
+
+    @classmethod
+    def load(cls, path: str | Path | None = None, **kwargs: Any) -> ServiceCatalogue:
+        """Read a catalogue file, by default the one shipped with the package."""
+        if path is None:
+            raw = resources.files("agent").joinpath("data/services.json").read_text()
+        else:
+            raw = Path(path).read_text()
+        return cls.from_dict(json.loads(raw), **kwargs)
+
+    def get(self, service_id: str) -> Service | None:
+        return self._by_id.get(service_id)
+
+    def _correct(self, term: str) -> tuple[str, float] | None:
+        # closest indexed term and how much to trust it
+        limit = 1 if len(term) <= 5 else 2
+        shared = Counter(t for gram in _trigrams(term)
+                         for t in self._trigram_index.get(gram, ()))
+        best: tuple[int, str] | None = None
+        for candidate, _ in shared.most_common(10):
+            distance = edit_distance(term, candidate, limit)
+            if distance <= limit and (best is None or distance < best[0]):
+                best = (distance, candidate)
+        if best is None:
+            return None
+        return best[1], 1 - best[0] / max(len(term), len(best[1]))
+
+    def match(self, query: str, branch: str | None = None,
+              limit: int = 3) -> list[tuple[Service, float]]:
+        """Up to `limit` services for `query`, best first, with scores in 0..1."""
+        query_terms = terms(query)
+        if not query_terms:
+            return []
+        exact = self._phrases.get(" ".join(query_terms))
+        if exact is not None and self.services[exact].offered_at(branch):
+            return [(self.services[exact], 1.0)]
+        weighted = self._weights(query_terms)
+        if weighted is None:
+            return []
+        weights, missed = weighted
+        scores = self._scores(weights, missed, branch)
+        best = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+        return [(self.services[i], round(score, 4)) for i, score in best]
+
+    def _weights(self, query_terms: list[str]) -> tuple[dict[str, float], int] | None:
+        # indexed term -> weight (lower for corrected typos), and the number
+        # of words that matched nothing; None for another trade's work
+        weights: dict[str, float] = {}
+        missed = 0
+        foreign = False
+        for term in dict.fromkeys(query_terms):
+            if term in self._foreign:
+                foreign, missed = True, missed + 1
+            elif term in self._postings:
+                weights[term] = 1.0
+            elif corrected := self._correct(term):
+                weights[corrected[0]] = max(weights.get(corrected[0], 0.0), corrected[1])
+            else:
+                missed += 1
+        if foreign and weights.keys() <= self._actions:
+            return None
+        return weights, missed
+
+    def _scores(self, weights: dict[str, float], missed: int,
+                branch: str | None) -> dict[int, float]:
+        # weighted Jaccard between query and alias terms, accumulated over
+        # the postings so only aliases sharing a term are touched
+        matched: defaultdict[int, float] = defaultdict(float)
+        shared: defaultdict[int, float] = defaultdict(float)
+        for term, weight in weights.items():
+            idf = self._idf[term]
+            for a in self._postings[term]:
+                matched[a] += idf * weight
+                shared[a] += idf
+        # unknown words count half as much as an average term:
+        # "my kitchen drain" is still a drain
+        query_weight = sum(self._idf[t] for t in weights) + 0.5 * self._mean_idf * missed
+        scores: dict[int, float] = {}
+        for a, value in matched.items():
+            i = self._aliases[a][0]
+            score = value / (self._alias_weight[a] + query_weight - shared[a])
+            if score > scores.get(i, 0.0) and self.services[i].offered_at(branch):
+                scores[i] = score
+        return scores
+
+    def check(self, query: str, branch: str | None = None) -> dict[str, Any]:
+        """Result in the shape of `tools.check_service`."""
+        matches = self.match(query, branch)
+        if (matches and matches[0][1] >= self.threshold
+                and (len(matches) == 1 or matches[0][1] - matches[1][1] >= self.margin)):
+            service = matches[0][0]
+            return {"exists": True, "service_id": service.id, "service": service.key,
+                    "suggestions": []}
+        suggested = [s for s, _ in matches] or [
+            s for s in self.services if s.offered_at(branch)]
+        return {"exists": False, "service_id": None, "service": None,
+                "suggestions": [s.name for s in suggested]}
+
+
+@lru_cache(maxsize=1)
+def get_catalogue() -> ServiceCatalogue:
+    """The packaged catalogue, loaded and indexed on first use."""
+    return ServiceCatalogue.load()
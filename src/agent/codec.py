@@ -0,0 +1,125 @@
+"""Compact serialization of sessions for `agent.store`.
+
+A session is encoded as a positional JSON array (no field names, slots as a
+fixed-order list, speakers as small ints), prefixed with one format byte.
+Payloads above `COMPRESS_THRESHOLD` bytes are zlib-compressed. A
+`TurnDelta` is encoded the same way, with only the slots it changed.
+"""
+from __future__ import annotations
+
+import json
+import zlib
+from collections.abc import Iterable
+from dataclasses import fields
+from typing import Any
+
+from agent.data_model import SessionContext, Slots, StateName, TurnDelta
+
+FORMAT_JSON = b"\x01"
+FORMAT_ZLIB = b"\x02"
+COMPRESS_THRESHOLD = 512
+
+_SLOT_FIELDS = tuple(f.name for f in fields(Slots))
+_SPEAKERS = ("user", "assistant")
+
+
+def encode_state(state: StateName) -> str:
+    return state.value
+
+
+def decode_state(data: str) -> StateName:
+    return StateName(data)
+
+
+def encode_slots(slots: Slots) -> list[Any]:
+    values = [getattr(slots, name) for name in _SLOT_FIELDS]
+    while values and values[-1] is None:
+        values.pop()
+    return values
+
+
+def decode_slots(data: list[Any]) -> Slots:
+    # trailing unset slots are left out, see encode_slots
+    return Slots(**dict(zip(_SLOT_FIELDS, data, strict=False)))
+
+
+def _encode_speaker(who: str) -> int | str:
+    return _SPEAKERS.index(who) if who in _SPEAKERS else who
+
+
+def _decode_speaker(who: int | str) -> str:
+    return _SPEAKERS[who] if isinstance(who, int) else who
+
+
+def _encode_transcript(transcript: Iterable[tuple[str, str]]) -> list[list[Any]]:
+    return [[_encode_speaker(who), text] for who, text in transcript]
+
+
+def _decode_transcript(data: list[list[Any]]) -> list[tuple[str, str]]:
+    return [(_decode_speaker(who), text) for who, text in data]
+
+
+def _pack(payload: list[Any]) -> bytes:
+    raw = json.dumps(payload, separators=(",", ":"),
+                     ensure_ascii=False).encode()
+    if len(raw) > COMPRESS_THRESHOLD:
+        return FORMAT_ZLIB + zlib.compress(raw)
+    return FORMAT_JSON + raw
+
+
+def _unpack(data: bytes) -> Any:
+    fmt, body = data[:1], data[1:]
+    if fmt == FORMAT_ZLIB:
+        body = zlib.decompress(body)
+    elif fmt != FORMAT_JSON:
+        raise ValueError(f"unknown session format {fmt!r}")
+    return json.loads(body)
+
+
+def encode_session(ctx: SessionContext) -> bytes:
+    # the rendered-history cache is derived from the transcript and not stored
+    return _pack([
+        ctx.call_id,
+        encode_state(ctx.state),
+        encode_slots(ctx.slots),
+        _encode_transcript(ctx.transcript),
+        ctx.metadata,
+        ctx.summary,
+        ctx.summary_upto,
+    ])
+
+
+def decode_session(data: bytes) -> SessionContext:
+    call_id, state, slots, transcript, metadata, summary, summary_upto = _unpack(data)
+    return SessionContext(
+        call_id=call_id,
+        slots=decode_slots(slots),
+        state=decode_state(state),
+        transcript=_decode_transcript(transcript),
+        metadata=metadata,
+        summary=summary,
+        summary_upto=summary_upto,
+    )
+
+
+def encode_delta(delta: TurnDelta) -> bytes:
+    return _pack([
+        encode_state(delta.state) if delta.state is not None else None,
+        delta.slots,
+        delta.metadata,
+        delta.removed,
+        _encode_transcript(delta.transcript),
+        delta.summary,
+    ])
+
+
+def decode_delta(data: bytes) -> TurnDelta:
+    state, slots, metadata, removed, transcript, summary = _unpack(data)
+    return TurnDelta(
+        state=decode_state(state) if state is not None else None,
+        slots=slots,
+        metadata=metadata,
+        removed=removed,
+        transcript=_decode_transcript(transcript),
+        summary=tuple(summary) if summary is not None else None,
+    )
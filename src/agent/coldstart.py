@@ -0,0 +1,100 @@
+"""Cold-start benchmark: how long a fresh process takes to import the agent
+and build one, and which heavy SDKs that pulled in.
+
+    python -m agent.coldstart --repeat 7 --budget-ms 250
+
+Each run is a new interpreter with `-X importtime`. The report has the
+median import and build times, import time by package and the heavy
+modules that were loaded. With `--budget-ms`, the exit status is 1
+when the median import exceeds the budget or a `--forbid` module was
+loaded, so CI catches startup regressions.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+# SDKs that must not be imported before the first LLM call (see
+# backends.create_backend and Agent.warmup)
+HEAVY = ("langchain", "langchain_core", "langchain_openai", "openai", "httpx",
+         "numpy", "tiktoken", "pydantic")
+
+_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import {module}
+imported = time.perf_counter()
+from agent.core import Agent
+from agent.llm import LlmClient
+Agent(LlmClient())
+built = time.perf_counter()
+print(json.dumps({{
+    "import_ms": (imported - started) * 1000,
+    "build_ms": (built - imported) * 1000,
+    "loaded": [m for m in {heavy!r} if m in sys.modules],
+}}))
+"""
+
+
+def _self_time_by_package(importtime: str) -> dict[str, float]:
+    # "import time: self [us] | cumulative | imported package"
+    out: defaultdict[str, float] = defaultdict(float)
+    for line in importtime.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        own, _, name = line[len("import time:"):].split("|")
+        if own.strip().isdigit():
+            out[name.strip().split(".")[0]] += int(own) / 1000
+    return out
+
+
+def measure(module: str = "agent.core", repeat: int = 5) -> dict:
+    runs, packages = [], defaultdict(list)
+    for _ in range(repeat):
+        done = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", _PROBE.format(module=module, heavy=HEAVY)],
+            capture_output=True, text=True, check=True)
+        runs.append(json.loads(done.stdout))
+        for name, ms in _self_time_by_package(done.stderr).items():
+            packages[name].append(ms)
+    slowest = sorted(((statistics.median(ms), name) for name, ms in packages.items()), reverse=True)
+    return {
+        "module": module,
+        "runs": repeat,
+        "import_ms": round(statistics.median(r["import_ms"] for r in runs), 1),
+        "build_ms": round(statistics.median(r["build_ms"] for r in runs), 1),
+        "loaded": sorted({m for r in runs for m in r["loaded"]}),
+        # where the import time goes, by top-level package
+        "packages_ms": {name: round(ms, 1) for ms, name in slowest[:10]},
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", action="append",
+                        help="module to import (repeatable, default: agent.core)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=0.0,
+                        help="fail when the median import takes longer (0: no budget)")
+    parser.add_argument("--forbid", action="append",
+                        help=f"fail when this module is loaded (default with a budget: {', '.join(HEAVY)})")
+    args = parser.parse_args()
+
+    forbidden = set(args.forbid or (HEAVY if args.budget_ms else ()))
+    reports = [measure(module, args.repeat) for module in args.module or ["agent.core"]]
+    failures = []
+    for report in reports:
+        if args.budget_ms and report["import_ms"] > args.budget_ms:
+            failures.append(f"{report['module']}: {report['import_ms']}ms > {args.budget_ms}ms")
+        if loaded := forbidden.intersection(report["loaded"]):
+            failures.append(f"{report['module']} loads {', '.join(sorted(loaded))}")
+    print(json.dumps({"reports": reports, "failures": failures}, indent=2))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,36 +1,262 @@
 from __future__ import annotations
 
 import asyncio
-import json
-from copy import deepcopy
-from typing import Any, Callable, Optional
-
-from agent.data_model import SessionContext, StateName
-from agent.llm import LlmClient
-from agent.prompts import *
-from agent.tools import check_service, create_appointment, get_availability
-from agent.utils import parse_json_strict
+import re
+from collections import Counter
+from collections.abc import AsyncIterator, Awaitable, Callable
+from contextlib import aclosing
+from contextvars import ContextVar
+from dataclasses import dataclass, replace
+from typing import TYPE_CHECKING, Any
+
+from agent.availability import get_engine
+from agent.batching import MicroBatcher
+from agent.catalogue import get_catalogue
+from agent.data_model import SessionContext, Slots, StateName
+from agent.extract import RuleExtractor
+from agent.history import HistoryPolicy
+from agent.llm import DEFAULT_TIMEOUT, LlmClient
+from agent.prompts import (
+    ANYTHING_ELSE_PROMPT,
+    ANYTHING_ELSE_SCHEMA,
+    END_CONVERSATION_PROMPT,
+    GREETING_PROMPT,
+    HANDOFF_TO_COMPLETION_PROMPT,
+    LISTEN_AND_ROUTE_PROMPT,
+    QUESTION_TEMPLATES,
+    REQUEST_INFO_PROMPT,
+    ROUTE_AND_ASK_PROMPT,
+    ROUTE_AND_ASK_SCHEMA,
+    ROUTE_SCHEMA,
+    Messages,
+    PromptBuilder,
+)
+from agent.store import MemorySessionStore, SessionStore
+from agent.structured import JsonStream, Schema, SchemaError
+from agent.tools import (
+    check_service,
+    create_appointment,
+    create_waitlist_entry,
+    get_availability,
+    hold_slots,
+    release_holds,
+)
+from agent.tracing import Tracer, get_tracer
+
+if TYPE_CHECKING:
+    # numpy, only loaded by processes that use the cache
+    from agent.semantic_cache import SemanticCache
+
+
+class _ReplySink:
+    # receives reply chunks of the running turn when it is driven by process_stream
+    def __init__(self, queue: asyncio.Queue):
+        self.queue = queue
+        self.count = 0
+
+    def emit(self, chunk: str) -> None:
+        self.count += 1
+        self.queue.put_nowait(chunk)
+
+
+_reply_sink: ContextVar[_ReplySink | None] = ContextVar("reply_sink", default=None)
+
+# "llm": a dedicated LLM call phrases each slot question (two calls per turn)
+# "combined": the routing call also returns the next question (one call)
+# "template": fixed QUESTION_TEMPLATES, no LLM
+QUESTION_MODES = ("llm", "combined", "template")
+
+ROUTE = Schema("route", ROUTE_SCHEMA)
+ROUTE_AND_ASK = Schema("route_and_ask", ROUTE_AND_ASK_SCHEMA)
+ANYTHING_ELSE = Schema("anything_else", ANYTHING_ELSE_SCHEMA)
+
+
+def _retrieve(task: asyncio.Task) -> None:
+    # speculative results may never be awaited; don't log their errors as unhandled
+    if not task.cancelled():
+        task.exception()
+
+
+class ToolPrefetch:
+    """Tool calls of one session, started ahead of the state that needs them.
+
+    Once the slots are enough for a lookup (`Slots.minimal_filled`), `update`
+    starts check_service and then get_availability as background tasks, so
+    they run while the remaining slots are being collected. The handlers
+    await these tasks instead of calling the tools; tasks for slot values
+    that changed are cancelled.
+
+    Each `SessionContext.fork` gets its own `fork()`: it reuses the tasks
+    started so far but only ever cancels the ones it started itself, so a
+    speculative turn on other slot values can't cancel the call's lookups.
+    Inherited tasks it no longer needs are forgotten and left to finish.
+    """
+
+    def __init__(self) -> None:
+        self._tasks: dict[tuple, asyncio.Task] = {}
+        # the tasks this prefetch started, which it may cancel
+        self._owned: set[asyncio.Task] = set()
+
+    def fork(self) -> ToolPrefetch:
+        fork = ToolPrefetch()
+        fork._tasks = dict(self._tasks)
+        return fork
+
+    def _task(self, key: tuple, factory: Callable[[], Any]) -> tuple[asyncio.Task, bool]:
+        # (task, whether it was already running or done)
+        task = self._tasks.get(key)
+        # a failed lookup is retried rather than failing every later turn
+        if task is not None and not task.cancelled() and not (
+                task.done() and task.exception() is not None):
+            return task, True
+        task = asyncio.ensure_future(factory())
+        task.add_done_callback(_retrieve)
+        task.add_done_callback(self._owned.discard)
+        self._tasks[key] = task
+        self._owned.add(task)
+        return task, False
+
+    def _drop(self, key: tuple) -> None:
+        task = self._tasks.pop(key)
+        if task in self._owned:
+            task.cancel()
+
+    def service(self, name: str) -> tuple[asyncio.Task, bool]:
+        return self._task(("service", name), lambda: check_service(name))
+
+    def availability(self, name: str, date_range: str | None,
+                     time_preference: str) -> tuple[asyncio.Task, bool]:
+        async def run() -> dict[str, Any]:
+            check = await asyncio.shield(self.service(name)[0])
+            if not check.get("exists"):
+                return {"slots": []}
+            return await get_availability(check["service_id"], date_range,
+                                          time_preference=time_preference)
+        return self._task(("availability", name, date_range, time_preference), run)
+
+    def update(self, slots: Slots) -> None:
+        if not slots.minimal_filled():
+            return
+        name, date_range = slots.service_requested, slots.preferred_date
+        time_preference = slots.preferred_time or ""
+        current = {("service", name), ("availability", name, date_range, time_preference)}
+        for key in [k for k in self._tasks if k not in current]:
+            self._drop(key)
+        self.service(name)
+        self.availability(name, date_range, time_preference)
+
+    def discard(self, kind: str) -> None:
+        # forget results that are known to be stale, e.g. "availability"
+        for key in [k for k in self._tasks if k[0] == kind]:
+            self._drop(key)
+
+    def cancel(self) -> None:
+        for key in list(self._tasks):
+            self._drop(key)
 
 
 class StateHandler:
-    def __init__(self, llm_client: LlmClient):
+    def __init__(self, llm_client: LlmClient,
+                 prompts: PromptBuilder | None = None,
+                 history: HistoryPolicy | None = None,
+                 extractor: RuleExtractor | None = None,
+                 question_mode: str = "llm",
+                 faq_cache: SemanticCache | None = None,
+                 prefetch: bool = True,
+                 tracer: Tracer | None = None,
+                 router: MicroBatcher | None = None):
+        if question_mode not in QUESTION_MODES:
+            raise ValueError(f"question_mode must be one of {QUESTION_MODES}")
         self.llm = llm_client
+        self.prompts = prompts or PromptBuilder()
+        self.history = history or HistoryPolicy()
+        # how collect_info phrases slot questions, see QUESTION_MODES
+        self.question_mode = question_mode
+        # rules answer trivial turns without the LLM, see agent.extract
+        self.extractor = extractor or RuleExtractor()
+        # answers to generic questions, looked up by meaning before the LLM
+        self.faq_cache = faq_cache
+        # start tool calls as soon as the slots allow, see ToolPrefetch
+        self.prefetch = prefetch
+        # how often each decision was made by "rules" vs "llm",
+        # keyed by e.g. "listen_and_route.rules"
+        self.stats: Counter[str] = Counter()
+        self._tracer = tracer
+        # batches routing and yes/no prompts with other sessions', see agent.batching
+        self.router = router
+
+    @property
+    def tracer(self) -> Tracer:
+        return self._tracer or get_tracer()
+
+    @staticmethod
+    def _merge_slots(target: Slots, slots: dict[str, Any]) -> None:
+        # extracted values never overwrite what the caller already gave us
+        for k, v in slots.items():
+            if hasattr(target, k) and v:
+                if not getattr(target, k):
+                    setattr(target, k, v)
+
+    def _tools(self, ctx: SessionContext) -> ToolPrefetch:
+        if ctx.prefetch is None:
+            ctx.prefetch = ToolPrefetch()
+        return ctx.prefetch
+
+    def _slots_changed(self, ctx: SessionContext) -> None:
+        if self.prefetch:
+            self._tools(ctx).update(ctx.slots)
+
+    async def _await_tool(self, name: str, started: tuple[asyncio.Task, bool]) -> dict[str, Any]:
+        task, prefetched = started
+        self.stats[f"{name}.{'prefetched' if prefetched else 'direct'}"] += 1
+        # how long the state waited, not how long the tool took
+        with self.tracer.span(f"tool_wait.{name}", prefetched=prefetched):
+            # shielded: the task is shared with later turns of the call
+            return await asyncio.shield(task)
+
+    async def _prompt(self, task: str, ctx: SessionContext | None = None,
+                      user_text: str | None = None) -> Messages:
+        with self.tracer.span("prompt"):
+            if ctx is not None:
+                await self.history.fit(ctx, self.llm, self.prompts)
+            return self.prompts.build(task, ctx, user_text)
+
+    async def _generate(self, prompt: Messages, cache: bool = False) -> str:
+        # user-facing completion, streamed to the caller if a sink is installed;
+        # `cache` for prompts that don't depend on the conversation
+        sink = _reply_sink.get()
+        if sink is None:
+            return await self.llm.arun(prompt, cache=cache)
+        parts = []
+        async for chunk in self.llm.astream(prompt, cache=cache):
+            parts.append(chunk)
+            sink.emit(chunk)
+        return "".join(parts)
 
     async def greeting(self, ctx: SessionContext, user_text: str = '') -> tuple[StateName, str]:
-        prompt = f"{SYSTEM_PROMPT}{GREETING_PROMPT}"
+        prompt = await self._prompt(GREETING_PROMPT)
 
-        resp = self.llm.run(prompt.strip())
+        resp = await self._generate(prompt, cache=True)
         return (StateName.LISTEN, resp)
 
     async def listen_and_route(self, ctx: SessionContext, user_text: str) -> tuple[StateName, str]:
-        prompt = f"{SYSTEM_PROMPT}{LISTEN_AND_ROUTE_PROMPT}"
-        prompt += "\n[Conversation history]\n{hist}\n".format(hist="\n".join([
-            ': '.join(d) for d in ctx.transcript
-        ]))
-        prompt += f"\n[User utterance]\n{user_text}\n"
+        # answer to the slot question collect_info just asked: no LLM needed
+        asked = ctx.metadata.get("asked_slot")
+        if asked and (slots := self.extractor.answer_slot(user_text, asked)):
+            self.stats["listen_and_route.rules"] += 1
+            self._merge_slots(ctx.slots, slots)
+            self._slots_changed(ctx)
+            return StateName.COLLECT_INFO, ""
+        self.stats["listen_and_route.llm"] += 1
 
-        raw = self.llm.run(prompt)
-        parsed = parse_json_strict(raw)
+        combined = self.question_mode == "combined"
+        if combined:
+            missing = "\n".join(ctx.slots.missing_slots())
+            task = f"{ROUTE_AND_ASK_PROMPT.strip()}\n\n[Missing information]\n{missing}"
+        else:
+            task = LISTEN_AND_ROUTE_PROMPT
+        prompt = await self._prompt(task, ctx, user_text)
+        parsed = await self._route(ctx, prompt, ROUTE_AND_ASK if combined else ROUTE)
 
         if not parsed:
             # fallback simplistic heuristics (very rough)
@@ -44,38 +270,96 @@ class StateHandler:
             intent = parsed.get("intent", "other")
             slots = parsed.get("slots", {}) or {}
         # merge extracted slots into context
-        # print("user_text", user_text)
-        # print("intent", intent)
-        # print("slots", slots)
-        # print()
-
-        for k, v in slots.items():
-            if hasattr(ctx.slots, k) and v:
-                if not getattr(ctx.slots, k):
-                    setattr(ctx.slots, k, v)
+        self._merge_slots(ctx.slots, slots)
+        self._slots_changed(ctx)
+        if combined and parsed and parsed.get("next_question"):
+            ctx.metadata["next_question"] = {
+                "slot": parsed.get("next_slot"), "text": parsed["next_question"]}
 
         if intent == "book":
             return StateName.COLLECT_INFO, ""
         else:
             return StateName.HANDOFF_TO_COMPLETION, ""
 
+    async def _route(self, ctx: SessionContext, prompt: Messages,
+                     schema: Schema) -> dict[str, Any] | None:
+        """Stream the routing answer. The session's slots only take what the
+        whole answer validates to (see listen_and_route), but each streamed
+        slot value is a prefetch hint as soon as it is complete, so tool
+        lookups start before the answer ends; an intent other than "book"
+        ends the turn's routing right away."""
+        routed_away = False
+        # the session's slots plus the values streamed so far
+        hints = replace(ctx.slots)
+
+        def on_value(path: tuple, value: Any) -> None:
+            nonlocal routed_away
+            if path == ("intent",):
+                routed_away = isinstance(value, str) and value.strip().lower() == "other"
+            elif (self.prefetch and len(path) == 2 and path[0] == "slots"
+                  and isinstance(value, (str, int, float)) and not isinstance(value, bool)):
+                self._merge_slots(hints, {path[1]: str(value)})
+                self._tools(ctx).update(hints)
+
+        stream = JsonStream(on_value)
+        if self.router is not None:
+            # sent with other sessions' prompts, so not streamed
+            stream.feed(await self.router.submit(prompt, schema))
+        else:
+            async with aclosing(self.llm.astream(prompt, schema=schema)) as chunks:
+                async for chunk in chunks:
+                    stream.feed(chunk)
+                    if stream.done or routed_away:
+                        break
+        if routed_away and not stream.done:
+            # the slots of a question aren't worth waiting for
+            self.stats["listen_and_route.early"] += 1
+        with self.tracer.span("parse") as span:
+            value = stream.finish()
+            try:
+                parsed = schema.validate(value) if value is not None else None
+            except SchemaError:
+                parsed = None
+            span.set("ok", parsed is not None)
+        return parsed
+
     async def handoff_to_completion(self, ctx: SessionContext, user_text: str) -> tuple[StateName, str]:
+        if self.faq_cache is not None:
+            with self.tracer.span("faq_cache") as span:
+                hit = await self.faq_cache.lookup(user_text)
+                span.set("hit", hit is not None)
+            if hit:
+                self.stats["handoff_to_completion.semantic"] += 1
+                return StateName.END, hit[0]
+        self.stats["handoff_to_completion.llm"] += 1
         # Use LLM to answer generic queries
-        prompt = f"{HANDOFF_TO_COMPLETION_PROMPT}: {user_text}"
-        resp = self.llm.run(prompt)
+        prompt = await self._prompt(HANDOFF_TO_COMPLETION_PROMPT, user_text=user_text)
+        resp = await self._generate(prompt, cache=True)
+        if self.faq_cache is not None:
+            await self.faq_cache.learn(user_text, resp)
         return StateName.END, resp
 
-    async def collect_info(self, ctx: SessionContext) -> tuple[StateName, str]:
+    async def collect_info(self, ctx: SessionContext, user_text: str = '') -> tuple[StateName, str]:
+        pending = ctx.metadata.pop("next_question", None)
         missing = ctx.slots.missing_slots()
         if not missing:
+            ctx.metadata.pop("asked_slot", None)
             return StateName.CALL_API_CHECK_SERVICE, ""
         # Ask for the first missing slot
         to_ask = missing[0]
-        prompt = SYSTEM_PROMPT + "\n[Conversation history]\n{hist}\n".format(hist="\n".join([
-            ': '.join(d) for d in ctx.transcript
-        ])) + REQUEST_INFO_PROMPT
-        prompt += f"{to_ask.replace('_', ' ')}?"
-        resp = self.llm.run(prompt)
+        ctx.metadata["asked_slot"] = to_ask
+        if self.question_mode == "llm":
+            self.stats["collect_info.llm"] += 1
+            prompt = await self._prompt(
+                f"{REQUEST_INFO_PROMPT.strip()} {to_ask.replace('_', ' ')}?", ctx)
+            resp = await self._generate(prompt)
+        elif pending and pending.get("slot") == to_ask:
+            # phrased by the routing call in "combined" mode
+            self.stats["collect_info.combined"] += 1
+            resp = pending["text"]
+        else:
+            self.stats["collect_info.template"] += 1
+            resp = QUESTION_TEMPLATES[to_ask]
         # if to_ask in ["service_requested", "problem_description"]:
         #     q = "Which service would you like to book?"
         # elif to_ask == "preferred_date_or_time":
@@ -84,9 +368,9 @@ class StateHandler:
         #     q = f"Could you provide {to_ask.replace('_', ' ')}?"
         return StateName.LISTEN, resp
 
-    async def call_api_check_service(self, ctx: SessionContext) -> tuple[StateName, str]:
+    async def call_api_check_service(self, ctx: SessionContext, user_text: str = '') -> tuple[StateName, str]:
         serv = ctx.slots.service_requested or ""
-        api_resp = await check_service(serv)
+        api_resp = await self._await_tool("check_service", self._tools(ctx).service(serv))
         ctx.metadata.setdefault("service_check", api_resp)
         if api_resp.get("exists"):
             ctx.metadata["service_id"] = api_resp.get("service_id")
@@ -94,7 +378,10 @@ class StateHandler:
         else:
             return StateName.SERVICE_NOT_FOUND_SUGGEST, ""
 
-    async def service_not_found_suggest(self, ctx: SessionContext) -> tuple[StateName, str]:
+    async def service_not_found_suggest(self, ctx: SessionContext, user_text: str = '') -> tuple[StateName, str]:
+        # the next answer names the service again, and may replace the one we couldn't find
+        ctx.slots.service_requested = None
+        ctx.metadata["asked_slot"] = "service_requested"
         suggestions = ctx.metadata.get(
             "service_check", {}).get("suggestions", [])
         if not suggestions:
@@ -102,19 +389,38 @@ class StateHandler:
         opts = ", ".join(suggestions[:3])
         return StateName.LISTEN, f"I couldn't find that exact service. Did you mean: {opts}?"
 
-    async def get_availability(self, ctx: SessionContext) -> tuple[StateName, str]:
-        service_id = ctx.metadata.get("service_id")
-        date_range = ctx.slots.preferred_date
-        res = await get_availability(service_id, date_range,
-                                     time_preference=ctx.slots.preferred_time)
+    async def get_availability(self, ctx: SessionContext, user_text: str = '') -> tuple[StateName, str]:
+        if ctx.metadata.get("widen_search"):
+            # the caller accepted alternatives outside their preferred window
+            date_range, time_preference = None, ""
+        else:
+            date_range = ctx.slots.preferred_date
+            time_preference = ctx.slots.preferred_time or ""
+        res = await self._await_tool("get_availability", self._tools(ctx).availability(
+            ctx.slots.service_requested or "", date_range, time_preference))
         ctx.metadata["availability"] = res
         if res.get("slots"):
             return StateName.OFFER_SLOTS, ""
         else:
             return StateName.NO_AVAILABILITY_HANDLE, ""
 
-    async def offer_slots(self, ctx: SessionContext) -> tuple[StateName, str]:
-        slots = ctx.metadata.get("availability", {}).get("slots", [])[:3]
+    async def offer_slots(self, ctx: SessionContext, user_text: str = '') -> tuple[StateName, str]:
+        available = ctx.metadata.get("availability", {}).get("slots", [])
+        # options we read out are held for us until the caller picks one
+        await self._release_offer(ctx)
+        slots = await self._hold(ctx, available, 3)
+        if len(slots) < min(3, len(available)):
+            # the lookup was stale (prefetched turns ago, or others booked
+            # since): look again before telling the caller nothing is free
+            self.stats["offer_slots.requery"] += 1
+            if ctx.prefetch is not None:
+                ctx.prefetch.discard("availability")
+            await self.get_availability(ctx)
+            held = {s["slot_id"] for s in slots}
+            fresh = [s for s in ctx.metadata["availability"].get("slots", [])
+                     if s["slot_id"] not in held]
+            slots += await self._hold(ctx, fresh, 3 - len(slots))
+            slots.sort(key=lambda s: s.get("start_iso", ""))
         if not slots:
             return StateName.NO_AVAILABILITY_HANDLE, ""
         # craft a user-facing message
@@ -125,15 +431,95 @@ class StateHandler:
             options.append(f"Option {i}: {dt_parsed}")
         text = ("We have the following available slots: " +
                 "; ".join(options) + ". Which option would you like?")
+        if note := ctx.metadata.pop("offer_note", None):
+            text = f"{note} {text}"
         # Save presented options so we can map user choice
         ctx.metadata["presented_slots"] = slots
         return StateName.CONFIRM_SCHEDULE, text
 
-    async def no_availability_handle(self, ctx: SessionContext) -> tuple[StateName, str]:
-        return (StateName.LISTEN,
+    @staticmethod
+    async def _hold(ctx: SessionContext, available: list[dict], want: int) -> list[dict]:
+        # the first `want` of `available` that could be held, with their hold ids
+        if not available:
+            return []
+        held = (await hold_slots(ctx.call_id, [s["slot_id"] for s in available], want=want))["holds"]
+        return [{**s, "hold_id": held[s["slot_id"]]} for s in available if s["slot_id"] in held]
+
+    @staticmethod
+    async def _release_offer(ctx: SessionContext, keep: dict | None = None) -> None:
+        presented = ctx.metadata.pop("presented_slots", [])
+        hold_ids = [s["hold_id"] for s in presented if s is not keep and s.get("hold_id")]
+        if hold_ids:
+            await release_holds(hold_ids)
+
+    async def no_availability_handle(self, ctx: SessionContext, user_text: str = '') -> tuple[StateName, str]:
+        if ctx.metadata.get("widen_search"):
+            return (StateName.SUGGEST_ALTERNATIVES,
+                    "Sorry, we don't have any openings for that service at the moment. Would you like me to put you on the waitlist?")
+        return (StateName.SUGGEST_ALTERNATIVES,
                 "Sorry, there are no available slots in your requested window. Would you like me to offer alternatives or join a waitlist?")
 
-    async def confirm_schedule(self, ctx: SessionContext, user_text: Optional[str] = None) -> tuple[StateName, str]:
+    async def suggest_alternatives(self, ctx: SessionContext, user_text: str = '') -> tuple[StateName, str]:
+        choice = self.extractor.alternative_choice(user_text)
+        if choice == "waitlist":
+            return StateName.WAITLIST_CREATION, ""
+        if choice == "widen":
+            if ctx.metadata.get("widen_search"):
+                # nothing left to widen, we only offered the waitlist
+                return StateName.WAITLIST_CREATION, ""
+            ctx.metadata["widen_search"] = True
+            return StateName.GET_AVAILABILITY, ""
+        if choice == "no":
+            return StateName.ANYTHING_ELSE, "No problem. Can I help you with anything else?"
+        return (StateName.SUGGEST_ALTERNATIVES,
+                "Sorry, should I look for other times, or add you to the waitlist?")
+
+    async def waitlist_creation(self, ctx: SessionContext, user_text: str = '') -> tuple[StateName, str]:
+        customer = {
+            "name": ctx.slots.customer_name,
+            "contact": ctx.slots.contact_number,
+        }
+        # after widening the search any time will do
+        window = None if ctx.metadata.get("widen_search") else " ".join(
+            filter(None, [ctx.slots.preferred_date, ctx.slots.preferred_time]))
+        resp = await create_waitlist_entry(customer, ctx.metadata.get("service_id"),
+                                           preferred_window=window or None)
+        if not resp.get("success"):
+            return (StateName.ANYTHING_ELSE,
+                    "Sorry, I couldn't add you to the waitlist right now. Can I help you with anything else?")
+        ctx.metadata["waitlist_id"] = resp.get("waitlist_id")
+        ctx.metadata.pop("widen_search", None)
+        return (StateName.ANYTHING_ELSE,
+                f"You're on the waitlist, reference {resp.get('waitlist_id')}. We'll call you at "
+                f"{ctx.slots.contact_number} as soon as a slot opens. Can I help you with anything else?")
+
+    async def confirm_schedule(self, ctx: SessionContext, user_text: str = '') -> tuple[StateName, str]:
+        selected = self._selected_slot(ctx, user_text)
+        if not selected:
+            return StateName.CONFIRM_SCHEDULE, "I didn't catch which slot you preferred. Please say the option number or the date and time."
+        # Create appointment
+        customer = {
+            "name": ctx.slots.customer_name,
+            "contact": ctx.slots.contact_number,
+        }
+        service_id = ctx.metadata.get("service_id")
+        resp = await create_appointment(customer, service_id, selected.get("slot_id"), ctx.slots.contact_number,
+                                        hold_id=selected.get("hold_id"), call_id=ctx.call_id)
+        if resp.get("success"):
+            # the options not taken go back to other callers
+            await self._release_offer(ctx, keep=selected)
+            details = resp.get("details", {})
+            ctx.metadata["appointment_id"] = resp.get("appointment_id")
+            ctx.metadata.pop("widen_search", None)
+            msg = (f"Your appointment is confirmed for {selected.get('start_iso')}. Reference {resp.get('appointment_id')}. "
+                   f"We'll contact you at {ctx.slots.contact_number} if anything changes. Can I help you with anything else?")
+            return StateName.ANYTHING_ELSE, msg
+        if resp.get("error") == "slot_unavailable":
+            return await self._slot_taken(ctx)
+        return StateName.CONFIRM_SCHEDULE, "Sorry, I couldn't create the appointment — would you like me to try a different slot?"
+
+    @staticmethod
+    def _selected_slot(ctx: SessionContext, user_text: str) -> dict | None:
         # map user selection (e.g., "Option 1" or a datetime) to a slot
         selected = None
         if user_text:
@@ -153,33 +539,31 @@ class StateHandler:
                 for s in ctx.metadata.get("presented_slots", []):
                     if s.get("start_iso", "") in user_text:
                         selected = s
-        if not selected:
-            return StateName.CONFIRM_SCHEDULE, "I didn't catch which slot you preferred. Please say the option number or the date and time."
-        # Create appointment
-        customer = {
-            "name": ctx.slots.customer_name,
-            "contact": ctx.slots.contact_number,
-        }
-        service_id = ctx.metadata.get("service_id")
-        resp = await create_appointment(customer, service_id, selected.get("slot_id"), ctx.slots.contact_number)
-        if resp.get("success"):
-            details = resp.get("details", {})
-            ctx.metadata["appointment_id"] = resp.get("appointment_id")
-            msg = (f"Your appointment is confirmed for {selected.get('start_iso')}. Reference {resp.get('appointment_id')}. "
-                   f"We'll contact you at {ctx.slots.contact_number} if anything changes. Can I help you with anything else?")
-            return StateName.ANYTHING_ELSE, msg
+        return selected
+
+    async def _slot_taken(self, ctx: SessionContext) -> tuple[StateName, str]:
+        # our hold ran out and someone else took the slot: offer fresh options
+        await self._release_offer(ctx)
+        ctx.metadata["offer_note"] = "Sorry, that time has just been taken."
+        if ctx.prefetch is not None:
+            ctx.prefetch.discard("availability")
+        return StateName.GET_AVAILABILITY, ""
+
+    async def anything_else(self, ctx: SessionContext, user_text: str = '') -> tuple[StateName, str]:
+        if answer := self.extractor.yes_no(user_text):
+            self.stats["anything_else.rules"] += 1
+            return self._anything_else_route(answer)
+        self.stats["anything_else.llm"] += 1
+
+        prompt = await self._prompt(ANYTHING_ELSE_PROMPT, ctx, user_text)
+
+        if self.router is not None:
+            raw = await self.router.submit(prompt, ANYTHING_ELSE)
         else:
-            return StateName.CONFIRM_SCHEDULE, "Sorry, I couldn't create the appointment — would you like me to try a different slot?"
-
-    async def anything_else(self, ctx: SessionContext, user_text: Optional[str] = None) -> tuple[StateName, str]:
-        prompt = f"{SYSTEM_PROMPT}{ANYTHING_ELSE_PROMPT}"
-        prompt += "\n[Conversation history]\n{hist}\n".format(hist="\n".join([
-            ': '.join(d) for d in ctx.transcript
-        ]))
-        prompt += f"\n[User utterance]\n{user_text}\n"
-
-        raw = self.llm.run(prompt.strip())
-        parsed = parse_json_strict(raw)
+            raw = await self.llm.arun(prompt, schema=ANYTHING_ELSE)
+        with self.tracer.span("parse") as span:
+            parsed = ANYTHING_ELSE.parse(raw)
+            span.set("ok", parsed is not None)
 
         if not parsed:
             # fallback simplistic heuristics (very rough)
@@ -192,90 +576,348 @@ class StateHandler:
                 answer = "other"
         else:
             answer = parsed.get("answer", "other")
+        return self._anything_else_route(answer)
 
+    @staticmethod
+    def _anything_else_route(answer: str) -> tuple[StateName, str]:
         if answer == "no":
             return StateName.END_CONVERSATION, ""
         else:
             return StateName.LISTEN, "Sure! What else can I do for you?"
 
-    async def end_conversation(self, ctx: SessionContext, user_text: Optional[str] = None) -> tuple[StateName, str]:
-        prompt = f"{SYSTEM_PROMPT}{END_CONVERSATION_PROMPT}"
-        resp = self.llm.run(prompt.strip())
+    async def end_conversation(self, ctx: SessionContext, user_text: str = '') -> tuple[StateName, str]:
+        prompt = await self._prompt(END_CONVERSATION_PROMPT)
+        resp = await self._generate(prompt, cache=True)
         return StateName.END, resp
 
 
+@dataclass(frozen=True, slots=True)
+class Transition:
+    # StateHandler method run in this state, called as handler(ctx, user_text)
+    handler: str | None = None
+    # the handler reads the user's utterance; a turn that starts here records it
+    needs_input: bool = False
+    # states the handler may move to
+    next: frozenset[StateName] = frozenset()
+    # the turn stops on reaching this state
+    terminal: bool = False
+    # the handler changes more than the session (holds, bookings, shared
+    # caches); speculative turns stop before it, see Agent.process_partial
+    side_effects: bool = False
+
+
+def _t(handler: str, *next: StateName, needs_input: bool = False,
+       side_effects: bool = False) -> Transition:
+    return Transition(handler, needs_input, frozenset(next), side_effects=side_effects)
+
+
+S = StateName
+# A turn runs handlers from the current state until one returns a reply
+# (which is sent to the user) or a terminal state is reached.
+TRANSITIONS: dict[StateName, Transition] = {
+    S.START: _t("greeting", S.LISTEN),
+    S.LISTEN: _t("listen_and_route", S.COLLECT_INFO, S.HANDOFF_TO_COMPLETION, needs_input=True),
+    S.HANDOFF_TO_COMPLETION: _t("handoff_to_completion", S.END, needs_input=True,
+                                side_effects=True),
+    S.COLLECT_INFO: _t("collect_info", S.CALL_API_CHECK_SERVICE, S.LISTEN),
+    S.CALL_API_CHECK_SERVICE: _t("call_api_check_service", S.GET_AVAILABILITY, S.SERVICE_NOT_FOUND_SUGGEST),
+    S.SERVICE_NOT_FOUND_SUGGEST: _t("service_not_found_suggest", S.LISTEN),
+    S.GET_AVAILABILITY: _t("get_availability", S.OFFER_SLOTS, S.NO_AVAILABILITY_HANDLE),
+    S.OFFER_SLOTS: _t("offer_slots", S.CONFIRM_SCHEDULE, S.NO_AVAILABILITY_HANDLE,
+                      side_effects=True),
+    S.NO_AVAILABILITY_HANDLE: _t("no_availability_handle", S.SUGGEST_ALTERNATIVES),
+    S.SUGGEST_ALTERNATIVES: _t("suggest_alternatives", S.GET_AVAILABILITY, S.WAITLIST_CREATION,
+                               S.ANYTHING_ELSE, S.SUGGEST_ALTERNATIVES, needs_input=True),
+    S.WAITLIST_CREATION: _t("waitlist_creation", S.ANYTHING_ELSE, side_effects=True),
+    S.CONFIRM_SCHEDULE: _t("confirm_schedule", S.ANYTHING_ELSE, S.CONFIRM_SCHEDULE, S.GET_AVAILABILITY,
+                           needs_input=True, side_effects=True),
+    S.ANYTHING_ELSE: _t("anything_else", S.END_CONVERSATION, S.LISTEN, needs_input=True),
+    S.END_CONVERSATION: _t("end_conversation", S.END),
+    S.END: Transition(terminal=True),
+}
+
+
+class ReplyStream:
+    """Async iterator over the reply chunks of one turn. Once exhausted,
+    `context` and `reply` hold the committed result, as returned by
+    `Agent.process`."""
+
+    def __init__(self, agent: Agent, user_message: str,
+                 context: SessionContext | None = None):
+        self._agent = agent
+        self._user_message = user_message
+        self._context = context
+        self.context: SessionContext | None = None
+        self.reply: str | None = None
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        return self._iterate()
+
+    async def _iterate(self) -> AsyncIterator[str]:
+        queue: asyncio.Queue = asyncio.Queue()
+        # the turn task copies the current context, sink included
+        token = _reply_sink.set(_ReplySink(queue))
+        try:
+            task = asyncio.ensure_future(
+                self._agent.process(self._user_message, self._context))
+        finally:
+            _reply_sink.reset(token)
+        task.add_done_callback(lambda _: queue.put_nowait(None))
+        try:
+            while (chunk := await queue.get()) is not None:
+                yield chunk
+            self.context, self.reply = task.result()
+        finally:
+            if not task.done():
+                task.cancel()
+
+
+_WORD = re.compile(r"[\w'-]+")
+
+
+def _words(text: str) -> list[str]:
+    # ASR partials and finals differ in case and punctuation, not in words
+    return _WORD.findall(text.lower())
+
+
+def _stable_prefix(previous: str, current: str) -> str:
+    # words two consecutive hypotheses agree on; the last word of a
+    # hypothesis is often still being revised
+    stable = []
+    for a, b in zip(previous.split(), current.split(), strict=False):
+        if a != b:
+            break
+        stable.append(b)
+    return " ".join(stable)
+
+
+class _Speculation:
+    # a turn run ahead on the interim transcripts of one utterance,
+    # see Agent.process_partial
+    def __init__(self, base: SessionContext):
+        # the session it started from: the state and transcript position
+        # identify it across store round trips
+        self.state = base.state
+        self.position = len(base.transcript)
+        self.hypothesis = ""
+        self.text = ""
+        self.task: asyncio.Task | None = None
+
+    def matches(self, ctx: SessionContext) -> bool:
+        return ctx.state == self.state and len(ctx.transcript) == self.position
+
+    def restart(self, text: str, turn: Awaitable[tuple[SessionContext, str, int]]) -> None:
+        self.cancel()
+        self.text = text
+        self.task = asyncio.ensure_future(turn)
+        self.task.add_done_callback(_retrieve)
+
+    def cancel(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+
+
 class Agent:
-    def __init__(self, llm_client: LlmClient):
+    def __init__(self, llm_client: LlmClient,
+                 handler: StateHandler | None = None,
+                 store: SessionStore | None = None,
+                 transitions: dict[StateName, Transition] | None = None,
+                 max_steps: int = 16,
+                 tracer: Tracer | None = None):
         self.llm = llm_client
-        self.handler = StateHandler(self.llm)
+        self.handler = handler or StateHandler(self.llm)
+        self.store = store if store is not None else MemorySessionStore()
+        self.transitions = transitions or TRANSITIONS
+        # handler runs per turn before it is aborted, guards against cycles
+        self.max_steps = max_steps
+        for state, spec in self.transitions.items():
+            if unknown := spec.next - self.transitions.keys():
+                raise ValueError(f"{state.value} leads to states without a transition: "
+                                 f"{sorted(s.value for s in unknown)}")
+        # state -> bound handler, resolved once
+        self._dispatch: dict[StateName, Callable[..., Any]] = {
+            state: getattr(self.handler, spec.handler)
+            for state, spec in self.transitions.items() if spec.handler
+        }
+        self._tracer = tracer
+        # call id -> speculative turn on the caller's interim transcript
+        self._speculations: dict[str, _Speculation] = {}
+
+    @property
+    def tracer(self) -> Tracer:
+        return self._tracer or get_tracer()
+
+    async def warmup(self, timeout: float | None = DEFAULT_TIMEOUT) -> None:
+        """Load what the first turn would otherwise wait for: the model SDK
+        and its connections, the service catalogue, the technician roster
+        and the token encoder. Call before taking traffic."""
+        get_catalogue()
+        get_engine()
+        await self.handler.history.warmup()
+        if self.tracer.enabled:
+            await self.tracer.warmup()
+        await self.llm.warmup(timeout)
+
+    async def process_call(self, call_id: str,
+                           user_message: str) -> tuple[SessionContext, str]:
+        """`process` for stateless callers: the session is loaded from and
+        saved back to `self.store`, keyed by call id. A call id the store
+        doesn't know starts a new conversation."""
+        base = await self.store.load(call_id)
+        ctx, reply = await self.process(user_message, base or SessionContext(call_id=call_id))
+        await self.store.save(ctx, base)
+        return ctx, reply
+
+    def process_stream(self, user_message: str,
+                       context: SessionContext | None = None) -> ReplyStream:
+        """Like `process`, but yields the reply as it is generated:
+
+            stream = agent.process_stream(text, ctx)
+            async for chunk in stream:
+                tts.speak(chunk)
+            ctx = stream.context
+        """
+        return ReplyStream(self, user_message, context)
+
+    async def process_partial_call(self, call_id: str, partial: str,
+                                   stable: str | None = None) -> bool:
+        """`process_partial` for stateless callers, see `process_call`."""
+        ctx = await self.store.load(call_id)
+        return ctx is not None and self.process_partial(partial, ctx, stable)
+
+    def process_partial(self, partial: str, context: SessionContext,
+                        stable: str | None = None) -> bool:
+        """Speculate on an interim transcript of the caller's next utterance,
+        such as an ASR partial hypothesis, before they finish speaking.
+
+        The stable prefix is `stable`, or else the words this hypothesis
+        shares with the previous one. Once it covers the whole hypothesis
+        (the caller paused), the turn runs ahead in the background on it;
+        a later, different one restarts it. It stops before a state with
+        side effects and commits nothing: `process` with the final
+        utterance reuses it when the words are the same and otherwise
+        cancels it. Returns whether a speculative turn started.
+        """
+        spec = self.transitions.get(context.state)
+        if spec is None or not spec.needs_input or spec.side_effects:
+            return False
+        speculation = self._speculations.get(context.call_id)
+        if speculation is None or not speculation.matches(context):
+            if speculation is not None:
+                speculation.cancel()
+            speculation = self._speculations[context.call_id] = _Speculation(context)
+        if stable is None:
+            stable = _stable_prefix(speculation.hypothesis, partial)
+        speculation.hypothesis = partial
+        words = _words(stable)
+        # a prefix of what was heard can't be what the caller ends up saying
+        if not words or words != _words(partial) or words == _words(speculation.text):
+            return False
+        self.handler.stats["speculation.started"] += 1
+        speculation.restart(stable, self._speculate(context.fork(), stable))
+        return True
+
+    def discard_partial(self, call_id: str) -> None:
+        """Cancel speculation for a call that ends without a final utterance."""
+        if (speculation := self._speculations.pop(call_id, None)) is not None:
+            speculation.cancel()
+
+    async def _speculate(self, ctx: SessionContext,
+                         user_message: str) -> tuple[SessionContext, str, int]:
+        # nothing reaches the caller before the final utterance
+        _reply_sink.set(None)
+        ctx.transcript.append(("user", user_message))
+        with self.tracer.span("speculation", call_id=ctx.call_id) as span:
+            reply, steps = await self._advance(ctx, user_message, self.max_steps,
+                                               speculative=True)
+            span.set("steps", steps)
+        return ctx, reply, steps
+
+    async def _resume(self, speculation: _Speculation, context: SessionContext,
+                      user_message: str) -> tuple[SessionContext, str, int] | None:
+        # the speculative turn if it ran on the final words, None to run the turn
+        task = speculation.task
+        if task is None:
+            return None
+        if not speculation.matches(context) or _words(speculation.text) != _words(user_message):
+            task.cancel()
+            self.handler.stats["speculation.discarded"] += 1
+            return None
+        try:
+            # may still be running; not cancelled with us before we own it
+            await asyncio.wait([task])
+        except BaseException:
+            task.cancel()
+            raise
+        if task.cancelled() or task.exception() is not None:
+            self.handler.stats["speculation.failed"] += 1
+            return None
+        self.handler.stats["speculation.reused"] += 1
+        ctx, reply, steps = task.result()
+        if speculation.text != user_message:
+            # the transcript records what the caller finally said
+            entries = ctx.transcript[speculation.position + 1:]
+            ctx.transcript = context.transcript.fork()
+            ctx.transcript.extend([("user", user_message), *entries])
+            ctx.rendered = context.rendered.fork()
+        return ctx, reply, steps
+
+    async def _advance(self, ctx: SessionContext, user_message: str, max_steps: int,
+                       speculative: bool = False) -> tuple[str, int]:
+        # runs handlers until one replies or a terminal state is reached (a
+        # speculative turn also stops before side effects); returns the reply
+        # and the number of handlers run
+        sink = _reply_sink.get()
+        tracer = self.tracer
+        for steps in range(max_steps):
+            spec = self.transitions[ctx.state]
+            if spec.terminal or (speculative and spec.side_effects):
+                return "", steps
+            emitted = sink.count if sink is not None else 0
+            with tracer.span(f"state.{ctx.state.value}") as span:
+                state, reply = await self._dispatch[ctx.state](
+                    ctx, user_message if spec.needs_input else "")
+                span.set("next", state.value)
+            if state not in spec.next:
+                raise RuntimeError(f"invalid transition {ctx.state.value} -> {state.value}")
+            ctx.state = state
+            if reply:
+                # non-LLM replies (tool results, fixed texts) go out in one chunk
+                if sink is not None and sink.count == emitted:
+                    sink.emit(reply)
+                ctx.transcript.append(("assistant", reply))
+                return reply, steps + 1
+        raise RuntimeError(f"turn did not finish within {self.max_steps} steps")
 
     async def process(self, user_message: str,
-                      context: Optional[SessionContext] = None) -> tuple[SessionContext, str]:
+                      context: SessionContext | None = None) -> tuple[SessionContext, str]:
+        resumed = None
         if not context:
             ctx = SessionContext()
             ctx.state = StateName.START
         else:
-            ctx = deepcopy(context)
-
-        # START -> GREETING
-        if ctx.state == StateName.START:
-            ctx.state, greeting_text = await self.handler.greeting(ctx)
-            ctx.transcript.append(("assistant", greeting_text))
-            return ctx, greeting_text
-
-        # listen loop
-        user_text = user_message
-        ctx.transcript.append(("user", user_text))
-        EOP: bool = False
-        while not EOP:
-            # central listen state handles many transitions
-            if ctx.state == StateName.LISTEN:
-                ctx.state, reply = await self.handler.listen_and_route(ctx, user_text)
-
-            # handle state-specific actions
-            elif ctx.state == StateName.HANDOFF_TO_COMPLETION:
-                ctx.state, reply = await self.handler.handoff_to_completion(ctx, user_text)
-
-            elif ctx.state == StateName.COLLECT_INFO:
-                # try collect info - will ask for missing slot if any
-                ctx.state, reply = await self.handler.collect_info(ctx)
-
-            elif ctx.state == StateName.CALL_API_CHECK_SERVICE:
-                ctx.state, reply = await self.handler.call_api_check_service(ctx)
-
-            elif ctx.state == StateName.SERVICE_NOT_FOUND_SUGGEST:
-                ctx.state, reply = await self.handler.service_not_found_suggest(ctx)
-
-            elif ctx.state == StateName.GET_AVAILABILITY:
-                ctx.state, reply = await self.handler.get_availability(ctx)
-
-            elif ctx.state == StateName.OFFER_SLOTS:
-                ctx.state, reply = await self.handler.offer_slots(ctx)
-
-            elif ctx.state == StateName.NO_AVAILABILITY_HANDLE:
-                ctx.state, reply = await self.handler.no_availability_handle(ctx)
-
-            elif ctx.state == StateName.CONFIRM_SCHEDULE:
-                ctx.state, reply = await self.handler.confirm_schedule(ctx, user_text)
-
-            elif ctx.state == StateName.ANYTHING_ELSE:
-                ctx.state, reply = await self.handler.anything_else(ctx, user_text)
-
-            elif ctx.state == StateName.END_CONVERSATION:
-                ctx.state, reply = await self.handler.end_conversation(ctx, user_text)
-
-            elif ctx.state == StateName.END:
-                EOP = True
-                continue
-
-            else:
-                # default fallback
-                reply = ""
-                ctx.state = StateName.LISTEN
-
-            if reply:
-                ctx.transcript.append(("assistant", reply))
-                EOP = True
-                continue
-
+            ctx = context.fork()
+            if (speculation := self._speculations.pop(ctx.call_id, None)) is not None:
+                resumed = await self._resume(speculation, context, user_message)
+
+        if ctx.state not in self.transitions:
+            # e.g. a session saved by an older version
+            ctx.state = StateName.LISTEN
+        reply, steps = "", 0
+        if resumed is not None:
+            ctx, reply, steps = resumed
+            if reply and (sink := _reply_sink.get()) is not None:
+                sink.emit(reply)
+        elif self.transitions[ctx.state].needs_input:
+            ctx.transcript.append(("user", user_message))
+        with self.tracer.span("turn", call_id=ctx.call_id) as turn:
+            if resumed is not None:
+                turn.set("speculated", steps)
+            if not reply:
+                # the rest of a speculative turn: the states with side effects
+                reply, more = await self._advance(ctx, user_message, self.max_steps - steps)
+                steps += more
+            turn.set("steps", steps)
+        if ctx.state == StateName.END and ctx.prefetch is not None:
+            ctx.prefetch.cancel()
         return ctx, reply
@@ -1,7 +1,11 @@
+from __future__ import annotations
+
 import uuid
-from dataclasses import dataclass, field
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass, field, fields, replace
 from enum import Enum
-from typing import Any, Optional
+from itertools import islice
+from typing import Any, overload
 
 
 class StateName(str, Enum):
@@ -23,16 +27,16 @@ class StateName(str, Enum):
     END = "END"
 
 
-@dataclass
+@dataclass(slots=True)
 class Slots:
-    customer_name: Optional[str] = None
-    contact_address: Optional[str] = None
-    contact_number: Optional[str] = None
-    service_requested: Optional[str] = None
-    problem_description: Optional[str] = None
-    preferred_date: Optional[str] = None  # ISO date or human text
-    preferred_time: Optional[str] = None  # human text or ISO time
-    extra_notes: Optional[str] = None
+    customer_name: str | None = None
+    contact_address: str | None = None
+    contact_number: str | None = None
+    service_requested: str | None = None
+    problem_description: str | None = None
+    preferred_date: str | None = None  # ISO date or human text
+    preferred_time: str | None = None  # human text or ISO time
+    extra_notes: str | None = None
 
     def minimal_filled(self) -> bool:
         # Minimal required for an API check (service + at least date or time preference)
@@ -49,11 +53,163 @@ class Slots:
         return missing
 
 
-@dataclass
+class AppendLog[T]:
+    """Append-only sequence whose storage is shared by forks.
+
+    A fork is O(1): it points at the same list and remembers its own length.
+    Appending at the end of the shared list is done in place; a log that
+    falls behind (because a fork appended past its end) copies its prefix
+    once before appending, so forks never see each other's entries.
+    """
+
+    __slots__ = ("_items", "_len")
+
+    def __init__(self, items: Iterable[T] = ()):
+        self._items: list[T] = list(items)
+        self._len = len(self._items)
+
+    def fork(self) -> AppendLog[T]:
+        log = AppendLog.__new__(AppendLog)
+        log._items = self._items
+        log._len = self._len
+        return log
+
+    def append(self, item: T) -> None:
+        if self._len != len(self._items):
+            self._items = self._items[:self._len]
+        self._items.append(item)
+        self._len += 1
+
+    def extend(self, items: Iterable[T]) -> None:
+        for item in items:
+            self.append(item)
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self) -> Iterator[T]:
+        return islice(self._items, self._len)
+
+    @overload
+    def __getitem__(self, key: int) -> T: ...
+
+    @overload
+    def __getitem__(self, key: slice) -> list[T]: ...
+
+    def __getitem__(self, key: int | slice) -> T | list[T]:
+        if isinstance(key, slice):
+            return self._items[slice(*key.indices(self._len))]
+        if key < 0:
+            key += self._len
+        if not 0 <= key < self._len:
+            raise IndexError("AppendLog index out of range")
+        return self._items[key]
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, AppendLog):
+            other = other[:]
+        return self[:] == other
+
+    def __repr__(self) -> str:
+        return f"AppendLog({self[:]!r})"
+
+
+@dataclass(slots=True)
+class RenderedHistory:
+    # transcript entries already rendered as chat messages; only ever appended
+    # to, so it stays a stable prompt prefix across turns
+    messages: AppendLog[tuple[str, str]] = field(default_factory=AppendLog)
+    # token count per rendered message, filled lazily by the history policy
+    tokens: AppendLog[int] = field(default_factory=AppendLog)
+
+    def fork(self) -> RenderedHistory:
+        return RenderedHistory(self.messages.fork(), self.tokens.fork())
+
+
+@dataclass(slots=True)
+class TurnDelta:
+    """What a turn changed on a session, see `SessionContext.diff`. Stores
+    save these instead of the whole session, see `store.SqliteSessionStore`."""
+    state: StateName | None = None
+    slots: dict[str, Any] = field(default_factory=dict)
+    metadata: dict[str, Any] = field(default_factory=dict)
+    removed: list[str] = field(default_factory=list)
+    transcript: list[tuple[str, str]] = field(default_factory=list)
+    summary: tuple[str, int] | None = None
+
+    def __bool__(self) -> bool:
+        return bool(self.state or self.slots or self.metadata or self.removed
+                    or self.transcript or self.summary)
+
+
+@dataclass(slots=True)
 class SessionContext:
     call_id: str = field(default_factory=lambda: str(uuid.uuid4()))
     slots: Slots = field(default_factory=Slots)
     state: StateName = StateName.START
-    transcript: list[tuple[str, str]] = field(
-        default_factory=list)  # list of (who, text)
+    transcript: AppendLog[tuple[str, str]] = field(
+        default_factory=AppendLog)  # list of (who, text)
+    # values are replaced, never mutated in place: forks share them
     metadata: dict[str, Any] = field(default_factory=dict)
+    # rolling summary of transcript[:summary_upto], which is no longer sent verbatim
+    summary: str = ""
+    summary_upto: int = 0
+    rendered: RenderedHistory = field(
+        default_factory=RenderedHistory, repr=False, compare=False)
+    # in-process only (not stored by the codec): core.ToolPrefetch of this call
+    prefetch: Any = field(default=None, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        if not isinstance(self.transcript, AppendLog):
+            self.transcript = AppendLog(self.transcript)
+
+    def fork(self) -> SessionContext:
+        """Copy for the next turn, in O(slots + metadata keys): the transcript
+        and rendered history share storage with this context and metadata
+        values are shared, so neither is copied."""
+        return SessionContext(
+            call_id=self.call_id,
+            slots=replace(self.slots),
+            state=self.state,
+            transcript=self.transcript.fork(),
+            metadata=dict(self.metadata),
+            summary=self.summary,
+            summary_upto=self.summary_upto,
+            rendered=self.rendered.fork(),
+            # its own view of the prefetched tool calls, see core.ToolPrefetch
+            prefetch=self.prefetch.fork() if self.prefetch is not None else None,
+        )
+
+    def diff(self, base: SessionContext) -> TurnDelta:
+        """Changes from `base` (an earlier fork of this session) to self."""
+        delta = TurnDelta()
+        if self.state != base.state:
+            delta.state = self.state
+        for f in fields(Slots):
+            value = getattr(self.slots, f.name)
+            if value != getattr(base.slots, f.name):
+                delta.slots[f.name] = value
+        for key, value in self.metadata.items():
+            # values are replaced, never mutated: identity says what changed
+            if key not in base.metadata or base.metadata[key] is not value:
+                delta.metadata[key] = value
+        delta.removed = [k for k in base.metadata if k not in self.metadata]
+        delta.transcript = self.transcript[len(base.transcript):]
+        if (self.summary, self.summary_upto) != (base.summary, base.summary_upto):
+            delta.summary = (self.summary, self.summary_upto)
+        return delta
+
+    def apply(self, delta: TurnDelta) -> SessionContext:
+        """Return a fork of self with `delta` applied."""
+        ctx = self.fork()
+        if delta.state is not None:
+            ctx.state = delta.state
+        for name, value in delta.slots.items():
+            setattr(ctx.slots, name, value)
+        ctx.metadata.update(delta.metadata)
+        for key in delta.removed:
+            ctx.metadata.pop(key, None)
+        ctx.transcript.extend(delta.transcript)
+        if delta.summary is not None:
+            ctx.summary, ctx.summary_upto = delta.summary
+        return ctx
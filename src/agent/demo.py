@@ -2,34 +2,35 @@ from __future__ import annotations
 
 import asyncio
 import json
+import os
 
 from agent.core import Agent
 from agent.llm import LlmClient
 
+# Simulated user messages for happy path
+HAPPY_PATH = [
+    "Hi, I'm Steven Manley. I need to schedule a plumbing appointment.",
+    "123 Main Street, Springfield.",
+    "555-123-4567",
+    "I have a leaky faucet.",
+    "I prefer in the morning",
+    "Let's go with Option 2",
+    "No. That's all. Thanks"
+]
+
 
 async def main():
     llm = LlmClient(
         model_name="openai/gpt-oss-20b",
-        base_url="http://localhost:1234/v1",
+        base_url=os.environ.get("LLM_BASE_URL", "http://localhost:1234/v1"),
     )
     agent = Agent(llm)
 
-    # Simulated user messages for happy path
     ctx = None
     # init the conversation
     ctx, _ = await agent.process("", ctx)
 
-    user_messages = [
-        "Hi, I'm Steven Manley. I need to schedule a plumbing appointment.",
-        "123 Main Street, Springfield.",
-        "555-123-4567",
-        "I have a leaky faucet.",
-        "I prefer in the morning",
-        "Let's go with Option 2",
-        "No. That's all. Thanks"
-    ]
-
-    for user_message in user_messages:
+    for user_message in HAPPY_PATH:
         ctx, reply = await agent.process(user_message, ctx)
 
     print("--- Transcript ---")
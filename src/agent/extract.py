@@ -0,0 +1,149 @@
+"""Rule-based slot extraction used before the LLM on trivial turns.
+
+When the agent has just asked for one slot ("Could you share your phone
+number?"), answers like "555-123-4567" don't need a model round-trip. The
+extractor scores each match; `StateHandler` only skips the LLM when the
+slot it asked for is found with at least `threshold` confidence.
+"""
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass, field
+
+PHONE = re.compile(r"(?<!\d)(?:\+?1[\s.-]?)?\(?\d{3}\)?[\s.-]?\d{3}[\s.-]?\d{4}(?!\d)")
+ADDRESS = re.compile(
+    r"\b\d{1,6}\s+(?:[A-Za-z0-9.'-]+\s+){0,4}?"
+    r"(?:street|st|avenue|ave|road|rd|boulevard|blvd|lane|ln|drive|dr|court|ct|"
+    r"way|place|pl|terrace|circle|parkway|pkwy|highway|hwy)\b\.?"
+    r"(?:,\s*[A-Za-z][A-Za-z .'-]*(?:,\s*[A-Z]{2})?(?:\s+\d{5})?)?",
+    re.I)
+NAME = re.compile(
+    r"(?:(?i:my name is|my name's|this is|i am|i'm|it's|it is|name is)\s+)"
+    r"([A-Z][a-z'-]+(?:\s+[A-Z][a-z'-]+){0,2})")
+# "am" alone is the verb ("I am free tomorrow"): a.m./p.m. only after a
+# clock time or when dotted
+AM = re.compile(r"\d\s*a\.?m\b|\ba\.m\.|\b(?:morning|before noon)\b", re.I)
+PM = re.compile(r"\d\s*p\.?m\b|\bp\.m\.|\b(?:afternoon|evening|after lunch)\b", re.I)
+DATE = re.compile(
+    r"\b(?:\d{4}-\d{2}-\d{2}|\d{1,2}/\d{1,2}(?:/\d{2,4})?|"
+    r"today|tomorrow|day after tomorrow|"
+    r"(?:(?:next|this|coming)\s+)?(?:mon|tues|wednes|thurs|fri|satur|sun)day|"
+    r"(?:jan|feb|mar|apr|may|jun|jul|aug|sep|sept|oct|nov|dec)[a-z]*\.?\s+\d{1,2}(?:st|nd|rd|th)?|"
+    r"\d{1,2}(?:st|nd|rd|th)?\s+(?:of\s+)?(?:jan|feb|mar|apr|may|jun|jul|aug|sep|sept|oct|nov|dec)[a-z]*|"
+    r"next week|this week(?:end)?|next weekend)\b",
+    re.I)
+NO = re.compile(r"^\W*(?:no|nope|nah|not really|that's (?:all|it)|that is all|nothing else)\b", re.I)
+YES = re.compile(r"^\W*(?:yes|yeah|yep|yup|sure|of course|please do|ok(?:ay)?)\b", re.I)
+QUESTION = re.compile(r"\?|^\W*(?:what|how|when|why|where|who|do you|can you|could you|is there)\b", re.I)
+WAITLIST = re.compile(r"\b(?:wait\s?-?list|notify|let me know|call me (?:back|when))", re.I)
+WIDEN = re.compile(r"\b(?:alternatives?|other (?:times?|days?|dates?|slots?|options?)|"
+                   r"any (?:time|day|other)|anytime|different|whenever|first available|earliest)\b", re.I)
+PROBLEM_LEAD = re.compile(r"^\W*(?:i have|i've got|i got|there is|there's|we have|it's|my)\s+(?:an?\s+)?", re.I)
+
+# catalogue keys (see agent/data/services.json) understood by tools.check_service
+SERVICES = [
+    ("re-pipes", re.compile(r"\bre-?pip", re.I)),
+    ("jet", re.compile(r"\bjet", re.I)),
+    ("clean", re.compile(r"\b(?:clean|drain|clog|unclog)", re.I)),
+    # "new" only for a new fixture: "a new leak" is a repair
+    ("install", re.compile(r"\b(?:install|replace|new\s+(?:\w+\s+)?"
+                           r"(?:faucet|tap|toilet|sink|shower|tub|bath|heater|disposal|fixture)s?\b)",
+                           re.I)),
+    ("repair", re.compile(r"\b(?:repair|fix|leak|broken|burst)", re.I)),
+    ("plumb", re.compile(r"\bplumb", re.I)),
+]
+
+
+@dataclass
+class Extraction:
+    # slot name -> (value, confidence)
+    slots: dict[str, tuple[str, float]] = field(default_factory=dict)
+
+    def confident(self, threshold: float) -> dict[str, str]:
+        return {k: v for k, (v, c) in self.slots.items() if c >= threshold}
+
+
+class RuleExtractor:
+    """Compiled-regex extractor for phone numbers, addresses, names, dates,
+    AM/PM preferences, service keywords and yes/no answers.
+
+    A `threshold` above 1 disables the fast path.
+    """
+
+    def __init__(self, threshold: float = 0.8):
+        self.threshold = threshold
+
+    def extract(self, text: str, expecting: str | None = None) -> Extraction:
+        """Extract every slot the rules recognise. Free-text slots (problem
+        description, service) are only taken when `expecting` asks for them."""
+        found = Extraction()
+        short = len(text.split()) <= 8
+        self._contact(text, expecting, short, found.slots)
+        if m := DATE.search(text):
+            found.slots["preferred_date"] = (m.group(), 0.9)
+        am, pm = AM.search(text), PM.search(text)
+        if bool(am) != bool(pm):
+            found.slots["preferred_time"] = ("AM" if am else "PM", 0.9)
+        self._free_text(text, expecting, found.slots)
+        return found
+
+    def _contact(self, text: str, expecting: str | None, short: bool,
+                 slots: dict[str, tuple[str, float]]) -> None:
+        if m := PHONE.search(text):
+            slots["contact_number"] = (m.group().strip(), 0.95 if short else 0.85)
+        # phone digits would otherwise pass for a house number
+        if m := ADDRESS.search(PHONE.sub(" ", text)):
+            slots["contact_address"] = (m.group().strip(" .,"), 0.9)
+        if m := NAME.search(text):
+            slots["customer_name"] = (m.group(1), 0.9)
+        elif expecting == "customer_name" and short and re.fullmatch(
+                r"\W*[A-Z][a-z'-]+(?:\s+[A-Z][a-z'-]+){0,2}\W*", text):
+            slots["customer_name"] = (text.strip(" .,!"), 0.85)
+
+    def _free_text(self, text: str, expecting: str | None,
+                   slots: dict[str, tuple[str, float]]) -> None:
+        if expecting == "service_requested":
+            for key, pattern in SERVICES:
+                if pattern.search(text):
+                    slots["service_requested"] = (key, 0.85)
+                    break
+        if expecting == "problem_description" and not QUESTION.search(text):
+            problem = PROBLEM_LEAD.sub("", text).strip(" .!")
+            if len(problem.split()) >= 2:
+                slots["problem_description"] = (problem, 0.8)
+
+    def answer_slot(self, text: str, expecting: str) -> dict[str, str] | None:
+        """Slots to fill if `text` confidently answers the `expecting` question,
+        else None."""
+        if QUESTION.search(text):
+            return None
+        slots = self.extract(text, expecting).confident(self.threshold)
+        if expecting == "preferred_date_or_time":
+            answered = "preferred_date" in slots or "preferred_time" in slots
+        else:
+            answered = expecting in slots
+        return slots if answered else None
+
+    def yes_no(self, text: str) -> str | None:
+        """"yes" / "no" for a plain answer, None when the model should decide."""
+        # a long answer ("no, but I also need...") carries more than yes/no
+        if len(text.split()) > 6 or QUESTION.search(text):
+            return None
+        if NO.search(text):
+            answer, confidence = "no", 0.95
+        elif YES.search(text):
+            answer, confidence = "yes", 0.9
+        else:
+            return None
+        return answer if confidence >= self.threshold else None
+
+    def alternative_choice(self, text: str) -> str | None:
+        """"waitlist", "widen" (other times), "no" or None for the answer to
+        "alternatives or waitlist?"."""
+        if WAITLIST.search(text):
+            return "waitlist"
+        if WIDEN.search(text) or YES.search(text):
+            return "widen"
+        if NO.search(text):
+            return "no"
+        return None
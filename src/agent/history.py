@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+from collections.abc import Callable
+from typing import TYPE_CHECKING
+
+from agent.data_model import SessionContext
+from agent.prompts import SUMMARIZE_PROMPT, PromptBuilder
+from agent.tokens import TokenCounter
+
+if TYPE_CHECKING:
+    from agent.llm import LlmClient
+
+
+class HistoryPolicy:
+    """Bounds the conversation history sent with each prompt.
+
+    The last `max_turns` transcript entries are sent verbatim as long as they
+    fit in `max_tokens`; older entries are folded into `ctx.summary` by the
+    LLM. Folding happens lazily, right before a prompt is built, and only once
+    `fold_batch` entries have piled up past the window; history over
+    `max_tokens` is folded `fold_batch` entries at a time too. So the verbatim
+    history (and with it the prompt prefix) moves in steps rather than on
+    every turn.
+
+    Tokens are counted with tiktoken's `encoding` (see `agent.tokens`) unless
+    a `counter` is given.
+    """
+
+    def __init__(self, max_turns: int = 12, max_tokens: int = 1500,
+                 fold_batch: int = 6, encoding: str = "o200k_base",
+                 counter: Callable[[str], int] | None = None):
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.fold_batch = fold_batch
+        self.encoding = encoding
+        self._counter = counter or TokenCounter(encoding)
+
+    def count_tokens(self, text: str) -> int:
+        return self._counter(text)
+
+    async def warmup(self) -> None:
+        if isinstance(self._counter, TokenCounter):
+            await self._counter.load()
+
+    def _tokens(self, ctx: SessionContext, prompts: PromptBuilder,
+                start: int) -> list[int]:
+        # per-message counts are cached next to the rendered history
+        history = prompts.history(ctx)
+        counts = ctx.rendered.tokens
+        while len(counts) < start:
+            counts.append(0)  # already summarized, never counted
+        for _, text in history[len(counts):]:
+            counts.append(self.count_tokens(text))
+        return counts
+
+    def cutoff(self, ctx: SessionContext, prompts: PromptBuilder) -> int:
+        """Index of the first history entry to keep verbatim."""
+        n = len(prompts.history(ctx))
+        start = cut = ctx.summary_upto
+        if n - start > self.max_turns + self.fold_batch:
+            cut = n - self.max_turns
+        counts = self._tokens(ctx, prompts, cut)
+        total = sum(counts[cut:])
+        if total > self.max_tokens:
+            # at least fold_batch entries at a time, as for the turn window;
+            # always keep the latest entry, whatever its size
+            least = min(cut + self.fold_batch, n - 1)
+            while (total > self.max_tokens or cut < least) and cut < n - 1:
+                total -= counts[cut]
+                cut += 1
+        return max(cut, start)
+
+    async def fit(self, ctx: SessionContext, llm: LlmClient,
+                  prompts: PromptBuilder) -> None:
+        cut = self.cutoff(ctx, prompts)
+        if cut <= ctx.summary_upto:
+            return
+        folded = prompts.history(ctx)[ctx.summary_upto:cut]
+        ctx.summary = await self.summarize(llm, prompts, ctx.summary, folded)
+        ctx.summary_upto = cut
+
+    async def summarize(self, llm: LlmClient, prompts: PromptBuilder,
+                        summary: str, turns: list[tuple[str, str]]) -> str:
+        lines = "\n".join(f"{role}: {text}" for role, text in turns)
+        task = (f"{SUMMARIZE_PROMPT.strip()}\n\n[Current summary]\n"
+                f"{summary or '(empty)'}\n\n[New turns]\n{lines}")
+        resp = await llm.arun(prompts.build(task))
+        return resp.strip()
+
@@ -1,33 +1,213 @@
 # LLM interface to use different service
-from langchain.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI
+import asyncio
+import logging
+import time
+from collections.abc import AsyncIterator
+from contextlib import aclosing
+from typing import Any
+
+from agent.backends import LlmBackend, create_backend
+from agent.cache import ResponseCache
+from agent.structured import Schema
+from agent.tracing import Span, Tracer, get_tracer, prompt_text
+
+log = logging.getLogger(__name__)
+
+# a per-call `timeout` that wasn't given: the client's default applies
+# (an explicit None disables the deadline)
+DEFAULT_TIMEOUT: Any = object()
 
 
 class LlmClient:
     def __init__(self, model_name: str = "gpt-4o",
                  base_url: str = "http://localhost:8000/v1",
                  api_key: str = "secret-key",
-                 temperature: float = 0.0):
+                 temperature: float = 0.0,
+                 timeout: float | None = 30.0,
+                 backend: LlmBackend | str | None = None,
+                 cache: ResponseCache | None = None,
+                 tracer: Tracer | None = None,
+                 structured_output: str | None = None,
+                 endpoints: list[str] | None = None,
+                 hedge: bool = False,
+                 backend_options: dict | None = None):
         self.model_name = model_name
         self.temperature = temperature
         self.base_url = base_url
         self.api_key = api_key
-        self._client = ChatOpenAI(
+        # default per-call deadline (seconds) for the async API, None disables it
+        self.timeout = timeout
+        # any LlmBackend, e.g. backends.ReplayBackend for offline benchmarks,
+        # or the name of one in backends.BACKENDS, built with `backend_options`
+        if isinstance(backend, str):
+            backend = create_backend(backend, **(backend_options or {}))
+        elif backend is None and endpoints:
+            # several servers of the same model, see pool.PoolBackend. An
+            # attempt gets half the call's deadline: a server that hangs is
+            # given up on, and counted against its breaker, in time to fail
+            # over, instead of the whole call timing out first
+            backend = create_backend(
+                "pool", base_urls=endpoints, model_name=self.model_name,
+                api_key=self.api_key, temperature=self.temperature,
+                structured_output=structured_output, hedge=hedge,
+                timeout=None if timeout is None else timeout / 2)
+        self.backend = backend or create_backend(
+            "openai",
             model_name=self.model_name,
             base_url=self.base_url,
             api_key=self.api_key,
-            temperature=self.temperature
+            temperature=self.temperature,
+            # JSON mode / guided decoding, see ChatOpenAIBackend
+            structured_output=structured_output,
         )
+        # completions of prompts sent with cache=True
+        self.cache = cache
+        # in-flight cached calls, so concurrent misses share one request
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._tracer = tracer
+
+    @property
+    def tracer(self) -> Tracer:
+        # the globally installed tracer unless one was given
+        return self._tracer or get_tracer()
+
+    def _count_tokens(self, span: Span, done: list[tuple[Any, str]]) -> None:
+        # (prompt, completion) pairs the backend produced, cache hits cost
+        # nothing; a tokenizer failure costs the attributes, not the call
+        tracer = self.tracer
+        if not tracer.enabled:
+            return
+        try:
+            prompt_tokens = sum(tracer.count_tokens(prompt_text(p)) for p, _ in done)
+            completion_tokens = sum(tracer.count_tokens(text) for _, text in done)
+        except Exception:
+            log.debug("token count failed", exc_info=True)
+            return
+        span.set("prompt_tokens", prompt_tokens)
+        span.set("completion_tokens", completion_tokens)
+
+    def _cache_key(self, messages) -> str | None:
+        if self.cache is None:
+            return None
+        return self.cache.key(messages, model=self.model_name,
+                              temperature=self.temperature)
 
     @property
     def client(self):
-        return self._client
+        return getattr(self.backend, "client", self.backend)
+
+    def _timeout(self, timeout: float | None) -> float | None:
+        return self.timeout if timeout is DEFAULT_TIMEOUT else timeout
 
     def run(self, messages: list[dict[str, str] | tuple[str, str]]) -> str:
+        return self.backend.invoke(messages)
+
+    async def warmup(self, timeout: float | None = DEFAULT_TIMEOUT) -> None:
+        """Load the model SDK and connect to the server(s) now rather than
+        on the first call, see `LlmBackend.warmup`."""
+        async with asyncio.timeout(self._timeout(timeout)):
+            await self.backend.warmup()
+
+    def _backend(self, schema: Schema | None) -> LlmBackend:
+        return self.backend if schema is None else self.backend.with_schema(schema)
+
+    async def arun(self, messages: list[dict[str, str] | tuple[str, str]] | str,
+                   timeout: float | None = DEFAULT_TIMEOUT, cache: bool = False,
+                   schema: Schema | None = None) -> str:
+        """Async counterpart of `run`. Raises TimeoutError when the call exceeds
+        `timeout` (the client default unless given, None for no deadline);
+        cancelling the awaiting task aborts the underlying request.
+
+        With `cache=True` (for prompts whose answer doesn't depend on the
+        conversation) the completion is served from / stored in `self.cache`.
+        A `schema` is passed on to backends that can constrain their output.
+        """
+        with self.tracer.span("llm", model=self.model_name) as span:
+            key = self._cache_key(messages) if cache else None
+            if key is None:
+                async with asyncio.timeout(self._timeout(timeout)):
+                    text = await self._backend(schema).ainvoke(messages)
+                self._count_tokens(span, [(messages, text)])
+                return text
+            # while a variant is being generated, any variant we have will do
+            if (text := self.cache.get(key, partial=key in self._inflight)) is not None:
+                span.set("cache", "hit")
+                return text
+            if key in self._inflight:
+                span.set("cache", "shared")
+            else:
+                span.set("cache", "miss")
+                self._inflight[key] = asyncio.ensure_future(
+                    self._fill_cache(key, messages, timeout, span, schema))
+            # shared by concurrent misses; shielded so one caller hanging up
+            # doesn't cancel it for the others
+            return await asyncio.shield(self._inflight[key])
+
+    async def _fill_cache(self, key: str, messages, timeout: float | None,
+                          span: Span, schema: Schema | None) -> str:
         try:
-            return self.client.invoke(messages).content
-        except Exception as e:
-            raise e
+            async with asyncio.timeout(self._timeout(timeout)):
+                text = await self._backend(schema).ainvoke(messages)
+            self._count_tokens(span, [(messages, text)])
+            self.cache.put(key, text)
+            return text
+        finally:
+            del self._inflight[key]
+
+    async def abatch(self, prompts: list[list[dict[str, str] | tuple[str, str]] | str],
+                     timeout: float | None = DEFAULT_TIMEOUT,
+                     schema: Schema | None = None) -> list[str | Exception]:
+        """Completions of several prompts sent together, see
+        `LlmBackend.abatch`; a prompt that failed gets its exception.
+        `timeout` bounds the whole batch."""
+        with self.tracer.span("llm.batch", model=self.model_name, size=len(prompts)) as span:
+            async with asyncio.timeout(self._timeout(timeout)):
+                results = await self._backend(schema).abatch(prompts)
+            self._count_tokens(span, [(p, r) for p, r in zip(prompts, results, strict=True)
+                                      if isinstance(r, str)])
+            return results
+
+    async def astream(self, messages: list[dict[str, str] | tuple[str, str]] | str,
+                      timeout: float | None = DEFAULT_TIMEOUT,
+                      cache: bool = False,
+                      schema: Schema | None = None) -> AsyncIterator[str]:
+        """Yield completion chunks as they arrive. `timeout` bounds the time
+        spent waiting for the backend over the whole stream; time the
+        consumer takes between chunks doesn't count. A cache hit (see
+        `arun`) is a single chunk."""
+        # not a `with` span: the generator is suspended between chunks
+        span = self.tracer.start("llm.stream", model=self.model_name)
+        started = time.perf_counter()
+        try:
+            key = self._cache_key(messages) if cache else None
+            if key is not None and (text := self.cache.get(key)) is not None:
+                span.set("cache", "hit")
+                yield text
+                return
+            if key is not None:
+                span.set("cache", "miss")
+            parts = []
+            budget = self._timeout(timeout)
+            loop = asyncio.get_running_loop()
+            async with aclosing(self._backend(schema).astream(messages)) as chunks:
+                while True:
+                    waiting = loop.time()
+                    async with asyncio.timeout(budget):
+                        chunk = await anext(chunks, None)
+                    if chunk is None:
+                        break
+                    if budget is not None:
+                        budget -= loop.time() - waiting
+                    if not parts:
+                        span.set("first_chunk_ms", (time.perf_counter() - started) * 1000)
+                    parts.append(chunk)
+                    yield chunk
+            text = "".join(parts)
+            self._count_tokens(span, [(messages, text)])
+            if key is not None:
+                self.cache.put(key, text)
+        finally:
+            span.end()
 
 
 if __name__ == "__main__":
@@ -42,3 +222,10 @@ if __name__ == "__main__":
         ("user", "Tell me a joke"),
     ])
     print(content, type(content))
+
+    async def main():
+        async for chunk in llm.astream([("user", "Tell me a joke")]):
+            print(chunk, end="", flush=True)
+        print()
+
+    asyncio.run(main())
@@ -0,0 +1,326 @@
+"""Load driver: runs many scripted conversations concurrently through
+`Agent.process_call` against a `ReplayBackend`, and reports throughput, per-turn
+latency percentiles, LLM calls per turn and event-loop lag.
+
+    python -m agent.loadtest --calls 1000 --concurrency 200 --llm-latency 0.2
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import datetime as dt
+import json
+import logging
+import time
+import uuid
+from collections import Counter
+from collections.abc import AsyncIterator
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any
+
+from agent.availability import AvailabilityEngine, set_engine
+from agent.backends import Latency, Prompt, ReplayBackend
+from agent.batching import MicroBatcher
+from agent.cache import ResponseCache
+from agent.core import QUESTION_MODES, Agent, StateHandler
+from agent.demo import HAPPY_PATH
+from agent.llm import LlmClient
+from agent.pool import PoolBackend
+from agent.reservation import MemoryReservations, set_reservations
+from agent.semantic_cache import SemanticCache
+from agent.tracing import HistogramAggregator, Tracer, set_tracer
+from agent.waitlist import (
+    Notification,
+    WaitlistMatcher,
+    WaitlistStore,
+    get_matcher,
+    set_matcher,
+    set_waitlist,
+)
+
+log = logging.getLogger(__name__)
+
+SCENARIOS: dict[str, list[str]] = {
+    "happy_path": HAPPY_PATH,
+    "afternoon": HAPPY_PATH[:4] + ["Afternoons work best for me"] + HAPPY_PATH[5:],
+    "one_shot": [
+        "I'm Ann Lee at 9 Oak Avenue, 555-987-6543. My kitchen drain is clogged, "
+        "I need a cleaning tomorrow afternoon.",
+        "Option 1",
+        "Nope, thank you",
+    ],
+    # nothing is open on Sundays
+    "waitlist": [
+        "I'm Raj Patel at 4 Elm Road, 555-222-3333. The pipes are corroded, "
+        "I want the whole house re-piped on Sunday.",
+        "Put me on the waitlist please",
+        "No, that's all",
+    ],
+    "faq": ["Do you do weekend calls?"],
+    "faq_paraphrase": ["Do you do weekend call outs?"],
+    "faq_price": ["How much for cleaning a drain?"],
+    "faq_price_paraphrase": ["how much to clean drains"],
+}
+
+# what a well-behaved model extracts from each scripted utterance
+ROUTE_RESPONSES: dict[str, dict] = {
+    HAPPY_PATH[0]: {"intent": "book", "slots": {
+        "customer_name": "Steven Manley", "service_requested": "plumb"}},
+    HAPPY_PATH[1]: {"intent": "book", "slots": {
+        "contact_address": "123 Main Street, Springfield"}},
+    HAPPY_PATH[2]: {"intent": "book", "slots": {"contact_number": "555-123-4567"}},
+    HAPPY_PATH[3]: {"intent": "book", "slots": {"problem_description": "leaky faucet"}},
+    HAPPY_PATH[4]: {"intent": "book", "slots": {"preferred_time": "AM"}},
+    "Afternoons work best for me": {"intent": "book", "slots": {"preferred_time": "PM"}},
+    SCENARIOS["one_shot"][0]: {"intent": "book", "slots": {
+        "customer_name": "Ann Lee", "contact_address": "9 Oak Avenue",
+        "contact_number": "555-987-6543", "service_requested": "clean",
+        "problem_description": "clogged kitchen drain",
+        "preferred_date": "tomorrow", "preferred_time": "PM"}},
+    SCENARIOS["waitlist"][0]: {"intent": "book", "slots": {
+        "customer_name": "Raj Patel", "contact_address": "4 Elm Road",
+        "contact_number": "555-222-3333", "service_requested": "re-pipe",
+        "problem_description": "corroded pipes", "preferred_date": "Sunday"}},
+}
+
+# LLM calls made during the current turn, see `CountingReplayBackend`
+_turn_llm_calls: ContextVar[list[int] | None] = ContextVar("turn_llm_calls", default=None)
+
+
+class CountingReplayBackend(ReplayBackend):
+    """ReplayBackend that also counts calls per turn of `run_conversation`."""
+
+    def _count(self) -> None:
+        if (counter := _turn_llm_calls.get()) is not None:
+            counter[0] += 1
+
+    async def ainvoke(self, messages: Prompt) -> str:
+        self._count()
+        return await super().ainvoke(messages)
+
+    async def astream(self, messages: Prompt) -> AsyncIterator[str]:
+        self._count()
+        async for chunk in super().astream(messages):
+            yield chunk
+
+
+class CountingMicroBatcher(MicroBatcher):
+    """MicroBatcher that counts each prompt as an LLM call of its turn."""
+
+    async def submit(self, messages, schema=None) -> str:
+        if (counter := _turn_llm_calls.get()) is not None:
+            counter[0] += 1
+        return await super().submit(messages, schema)
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+@dataclass
+class LoadReport:
+    calls: int = 0
+    failed: int = 0
+    elapsed: float = 0.0
+    turn_latencies: list[float] = field(default_factory=list)
+    llm_calls: list[int] = field(default_factory=list)
+    loop_lag: list[float] = field(default_factory=list)
+    # failed conversations by exception type
+    errors: Counter[str] = field(default_factory=Counter)
+
+    def fail(self, error: Exception) -> None:
+        if not self.failed:
+            log.error("conversation failed", exc_info=error)
+        self.failed += 1
+        self.errors[type(error).__name__] += 1
+
+    @property
+    def turns(self) -> int:
+        return len(self.turn_latencies)
+
+    def summary(self) -> dict[str, Any]:
+        ms = [t * 1000 for t in self.turn_latencies]
+        lag = [t * 1000 for t in self.loop_lag]
+        return {
+            "calls": self.calls,
+            "failed": self.failed,
+            "errors": dict(self.errors),
+            "turns": self.turns,
+            "elapsed_s": round(self.elapsed, 3),
+            "turns_per_s": round(self.turns / self.elapsed, 1) if self.elapsed else 0.0,
+            "turn_p50_ms": round(percentile(ms, 50), 2),
+            "turn_p95_ms": round(percentile(ms, 95), 2),
+            "turn_p99_ms": round(percentile(ms, 99), 2),
+            "llm_calls_per_turn": round(sum(self.llm_calls) / self.turns, 3) if self.turns else 0.0,
+            "llm_calls_per_turn_max": max(self.llm_calls, default=0),
+            "loop_lag_p50_ms": round(percentile(lag, 50), 2),
+            "loop_lag_p99_ms": round(percentile(lag, 99), 2),
+            "loop_lag_max_ms": round(max(lag, default=0.0), 2),
+        }
+
+
+async def _monitor_loop(report: LoadReport, stop: asyncio.Event,
+                        interval: float = 0.01) -> None:
+    # how late the loop wakes us up is how long something else blocked it
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        report.loop_lag.append(max(0.0, time.perf_counter() - start - interval))
+
+
+async def speak(agent: Agent, call_id: str, user_message: str,
+                interval: float, endpointing: float) -> None:
+    # ASR partials: one more word every `interval`, then the whole
+    # utterance again until the endpointer gives up waiting for more
+    words = user_message.split()
+    for n in range(1, len(words) + 1):
+        await agent.process_partial_call(call_id, " ".join(words[:n]))
+        await asyncio.sleep(interval)
+    await agent.process_partial_call(call_id, user_message)
+    await asyncio.sleep(endpointing)
+
+
+async def run_conversation(agent: Agent, script: list[str], report: LoadReport,
+                           partials: float = 0.0, endpointing: float = 0.0) -> None:
+    call_id = str(uuid.uuid4())
+    # the empty first turn gets the greeting
+    for user_message in ["", *script]:
+        if partials and user_message:
+            # latency is counted from the final transcript, as the caller hears it
+            await speak(agent, call_id, user_message, partials, endpointing)
+        counter = [0]
+        token = _turn_llm_calls.set(counter)
+        start = time.perf_counter()
+        try:
+            await agent.process_call(call_id, user_message)
+        finally:
+            _turn_llm_calls.reset(token)
+        report.turn_latencies.append(time.perf_counter() - start)
+        report.llm_calls.append(counter[0])
+
+
+async def run_load(agent: Agent, calls: int = 100, concurrency: int = 50,
+                   scenarios: dict[str, list[str]] | None = None,
+                   partials: float = 0.0, endpointing: float = 0.0) -> LoadReport:
+    scenarios = scenarios or SCENARIOS
+    scripts = list(scenarios.values())
+    report = LoadReport(calls=calls)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int) -> None:
+        async with semaphore:
+            try:
+                await run_conversation(agent, scripts[i % len(scripts)], report,
+                                       partials, endpointing)
+            except Exception as e:
+                report.fail(e)
+
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(_monitor_loop(report, stop))
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(calls)))
+    report.elapsed = time.perf_counter() - start
+    stop.set()
+    await monitor
+    return report
+
+
+async def _notify_nobody(notification: Notification) -> None:
+    # scripted callers can't be reached; matching still holds their slots
+    return None
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--llm-latency", type=float, default=0.05,
+                        help="median time to first token, seconds")
+    parser.add_argument("--llm-sigma", type=float, default=0.0,
+                        help="lognormal spread of the latency (0: fixed)")
+    parser.add_argument("--llm-jitter", type=float, default=0.0,
+                        help="extra uniform delay, up to this many seconds")
+    parser.add_argument("--chunk-delay", type=float, default=0.0,
+                        help="delay per generated word, seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--question-mode", choices=QUESTION_MODES, default="llm")
+    parser.add_argument("--cache-variants", type=int, default=0,
+                        help="cache static replies with this many variants (0: off)")
+    parser.add_argument("--semantic-threshold", type=float, default=0.0,
+                        help="semantic FAQ cache similarity threshold (0: off)")
+    parser.add_argument("--semantic-learn", action="store_true",
+                        help="let the semantic FAQ cache keep generated answers")
+    parser.add_argument("--roster-copies", type=int, default=100,
+                        help="technician roster size, as copies of the packaged one")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), action="append")
+    parser.add_argument("--batch-window", type=float, default=0.0,
+                        help="batch routing prompts across calls for this many ms (0: off)")
+    parser.add_argument("--max-batch", type=int, default=32)
+    parser.add_argument("--endpoints", type=int, default=1,
+                        help="model servers behind an endpoint pool (1: no pool)")
+    parser.add_argument("--hedge", action="store_true",
+                        help="hedge pooled requests slower than their endpoint's p95")
+    parser.add_argument("--asr-partials", type=float, default=0.0,
+                        help="send interim transcripts, one word per this many seconds (0: off)")
+    parser.add_argument("--endpointing", type=float, default=0.5,
+                        help="silence before the final transcript, seconds")
+    parser.add_argument("--trace", action="store_true",
+                        help="report latency histograms per span (state, LLM call, tool)")
+    args = parser.parse_args()
+
+    # a fixed Monday morning, so "tomorrow" in the scripts is a working day
+    today = dt.date.today()
+    monday = dt.datetime.combine(today + dt.timedelta(days=7 - today.weekday()), dt.time(7))
+    set_engine(AvailabilityEngine.load(copies=args.roster_copies, now=lambda: monday))
+    reservations = MemoryReservations()
+    set_reservations(reservations)
+    waitlist = WaitlistStore(":memory:")
+    set_waitlist(waitlist)
+    set_matcher(WaitlistMatcher(waitlist, reservations, notify=_notify_nobody))
+    spans = HistogramAggregator() if args.trace else None
+    set_tracer(Tracer(spans) if spans is not None else None)
+    servers = [CountingReplayBackend(
+        routes=ROUTE_RESPONSES,
+        latency=Latency.lognormal(args.llm_latency, args.llm_sigma),
+        jitter=Latency.uniform(0.0, args.llm_jitter),
+        chunk_delay=args.chunk_delay,
+        seed=args.seed + i,
+    ) for i in range(max(1, args.endpoints))]
+    pool = PoolBackend(servers, hedge=args.hedge) if len(servers) > 1 else None
+    cache = ResponseCache(variants=args.cache_variants) if args.cache_variants else None
+    llm = LlmClient(model_name="replay", backend=pool or servers[0], cache=cache)
+    faq_cache = (SemanticCache(threshold=args.semantic_threshold, learn=args.semantic_learn)
+                 if args.semantic_threshold else None)
+    router = (CountingMicroBatcher(llm, args.batch_window / 1000, args.max_batch)
+              if args.batch_window else None)
+    agent = Agent(llm, handler=StateHandler(llm, question_mode=args.question_mode,
+                                            faq_cache=faq_cache, router=router))
+    scenarios = {name: SCENARIOS[name] for name in args.scenario} if args.scenario else None
+    report = await run_load(agent, args.calls, args.concurrency, scenarios,
+                            args.asr_partials, args.endpointing)
+    summary = report.summary()
+    # rules vs LLM decisions, see StateHandler.stats
+    summary["decisions"] = dict(sorted(agent.handler.stats.items()))
+    if cache is not None:
+        summary["response_cache"] = cache.stats()
+    summary["reservations"] = reservations.stats()
+    if router is not None:
+        summary["batching"] = router.stats()
+    if router is not None or pool is not None:
+        summary["llm_requests"] = sum(server.calls for server in servers)
+    if pool is not None:
+        summary["pool"] = pool.stats()
+    summary["waitlist"] = get_matcher().stats()
+    if faq_cache is not None:
+        summary["semantic_cache"] = faq_cache.stats()
+    if spans is not None:
+        summary["spans"] = spans.report()
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,385 @@
+"""A pool of model servers behind one `LlmBackend`.
+
+Each request goes to the endpoint with the fewest requests in flight
+(ties go to the one that has been faster lately). An endpoint that fails
+`failures` times in a row is taken out of rotation for `cooldown`
+seconds, then gets a single trial request before it is trusted again
+(circuit breaking). A failed request is retried on another endpoint; for
+streams, only until the first chunk has arrived. A request unanswered
+after `timeout` seconds is cancelled and counts as a failure of its
+endpoint, so a server that hangs is broken like one that errors.
+
+With `hedge=True`, a request still unanswered after its endpoint's recent
+p95 latency (`hedge_min` until there is a p95) is sent to a second endpoint as well, and whichever answers
+first wins; the other request is cancelled. This trades a few percent
+more requests for a much shorter tail when one server stalls.
+
+`PoolBackend.from_urls` builds OpenAI-compatible endpoints that share one
+keep-alive HTTP connection pool.
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import deque
+from collections.abc import AsyncIterator, Awaitable, Callable, Sequence
+from typing import TYPE_CHECKING, Any, TypeVar
+
+from agent.backends import ChatOpenAIBackend, LlmBackend, Prompt
+
+if TYPE_CHECKING:
+    from agent.structured import Schema
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+T = TypeVar("T")
+
+
+class Endpoint:
+    """One model server, its load, recent latencies and breaker state."""
+
+    def __init__(self, name: str, backend: LlmBackend, window: int = 200):
+        self.name = name
+        self.backend = backend
+        self.outstanding = 0
+        self.requests = 0
+        self.errors = 0
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self._latencies: deque[float] = deque(maxlen=window)
+        self._p95: float | None = None
+        self.mean_latency = 0.0  # exponentially weighted
+
+    def record(self, latency: float) -> None:
+        self._latencies.append(latency)
+        self._p95 = None
+        self.mean_latency = latency if not self.mean_latency else \
+            0.8 * self.mean_latency + 0.2 * latency
+
+    def p95(self, min_samples: int = 20,
+            default: float | None = None) -> float | None:
+        """Recent p95 latency, `default` until there are enough samples."""
+        if len(self._latencies) < min_samples:
+            return default
+        if self._p95 is None:
+            ordered = sorted(self._latencies)
+            self._p95 = ordered[int(0.95 * (len(ordered) - 1))]
+        return self._p95
+
+    def stats(self) -> dict[str, Any]:
+        p95 = self.p95()
+        return {
+            "state": self.state,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "errors": self.errors,
+            "p95_ms": round(p95 * 1000, 2) if p95 is not None else None,
+        }
+
+
+class PoolBackend(LlmBackend):
+    def __init__(self, endpoints: list[LlmBackend] | dict[str, LlmBackend],
+                 failures: int = 3, cooldown: float = 10.0,
+                 hedge: bool = False, hedge_min: float = 0.05,
+                 timeout: float | None = 30.0,
+                 clock: Callable[[], float] = time.monotonic):
+        if not endpoints:
+            raise ValueError("an endpoint pool needs at least one endpoint")
+        named = endpoints if isinstance(endpoints, dict) else {
+            f"endpoint_{i}": backend for i, backend in enumerate(endpoints)}
+        self.endpoints = [Endpoint(name, backend) for name, backend in named.items()]
+        self.failures = failures
+        self.cooldown = cooldown
+        self.hedge = hedge
+        # never hedge sooner than this, however fast the endpoint has been
+        self.hedge_min = hedge_min
+        # longest wait for one attempt (for streams, for the first chunk)
+        self.timeout = timeout
+        self.clock = clock
+        self.failovers = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.timeouts = 0
+
+    @classmethod
+    def from_urls(cls, base_urls: list[str], model_name: str, api_key: str,
+                  temperature: float = 0.0, max_connections: int = 100,
+                  structured_output: str | None = None,
+                  **kwargs: Any) -> PoolBackend:
+        """OpenAI-compatible endpoints sharing one keep-alive connection
+        pool. The pool does the retrying, so the clients don't."""
+        import httpx
+
+        limits = httpx.Limits(max_connections=max_connections,
+                              max_keepalive_connections=max_connections)
+        http_client = httpx.Client(limits=limits)
+        http_async_client = httpx.AsyncClient(limits=limits)
+        endpoints = {
+            url: ChatOpenAIBackend(model_name, url, api_key, temperature,
+                                   structured_output=structured_output,
+                                   http_client=http_client,
+                                   http_async_client=http_async_client,
+                                   max_retries=0)
+            for url in base_urls
+        }
+        return cls(endpoints, **kwargs)
+
+    # -- health
+
+    def _available(self, endpoint: Endpoint) -> bool:
+        if endpoint.state == OPEN and self.clock() - endpoint.opened_at >= self.cooldown:
+            endpoint.state = HALF_OPEN
+        if endpoint.state == HALF_OPEN:
+            # one trial request at a time
+            return endpoint.outstanding == 0
+        return endpoint.state == CLOSED
+
+    def _pick(self, exclude: Sequence[Endpoint] = ()) -> Endpoint | None:
+        candidates = [e for e in self.endpoints if e not in exclude and self._available(e)]
+        if not candidates:
+            if exclude:
+                return None
+            # everything is broken: try the one that has rested longest
+            candidates = [min(self.endpoints, key=lambda e: e.opened_at)]
+        return min(candidates, key=lambda e: (e.outstanding, e.mean_latency))
+
+    def _succeeded(self, endpoint: Endpoint, latency: float) -> None:
+        endpoint.record(latency)
+        endpoint.consecutive_failures = 0
+        endpoint.state = CLOSED
+
+    def _failed(self, endpoint: Endpoint) -> None:
+        endpoint.errors += 1
+        endpoint.consecutive_failures += 1
+        if endpoint.state == HALF_OPEN or endpoint.consecutive_failures >= self.failures:
+            endpoint.state = OPEN
+            endpoint.opened_at = self.clock()
+
+    # -- requests
+
+    def _backend(self, endpoint: Endpoint, schema: Schema | None) -> LlmBackend:
+        return endpoint.backend if schema is None else endpoint.backend.with_schema(schema)
+
+    async def _call(self, endpoint: Endpoint, messages: Prompt,
+                    schema: Schema | None) -> str:
+        endpoint.outstanding += 1
+        endpoint.requests += 1
+        started = self.clock()
+        try:
+            text = await self._backend(endpoint, schema).ainvoke(messages)
+        except asyncio.CancelledError:
+            # lost a hedge race or the caller hung up: says nothing about health
+            raise
+        except Exception:
+            self._failed(endpoint)
+            raise
+        finally:
+            endpoint.outstanding -= 1
+        self._succeeded(endpoint, self.clock() - started)
+        return text
+
+    async def _open(self, endpoint: Endpoint, messages: Prompt,
+                    schema: Schema | None) -> _Stream:
+        """A stream from `endpoint` with its first chunk (None if it is
+        empty). The endpoint counts it as outstanding until it is closed."""
+        endpoint.outstanding += 1
+        endpoint.requests += 1
+        started = self.clock()
+        stream = self._backend(endpoint, schema).astream(messages)
+        try:
+            first = await anext(stream, None)
+        except BaseException as e:
+            endpoint.outstanding -= 1
+            await stream.aclose()
+            if isinstance(e, Exception):
+                self._failed(endpoint)
+            raise
+        # time to first chunk is what callers wait on
+        self._succeeded(endpoint, self.clock() - started)
+        return _Stream(endpoint, stream, first)
+
+    def _hedge_delay(self, endpoint: Endpoint) -> float | None:
+        if not self.hedge or len(self.endpoints) < 2:
+            return None
+        # an endpoint without a p95 yet may be the one that hangs
+        return max(endpoint.p95(default=self.hedge_min), self.hedge_min)
+
+    async def _request(self, send: Callable[[Endpoint], Awaitable[T]],
+                       discard: Callable[[T], Awaitable[None]] | None = None) -> T:
+        """`send` to the best endpoint, failing over to the others in turn;
+        the error of the last attempt if all of them fail."""
+        tried: list[Endpoint] = []
+        error: Exception | None = None
+        while (endpoint := self._pick(tried)) is not None:
+            tried.append(endpoint)
+            try:
+                return await self._attempt(endpoint, tried, send, discard)
+            except Exception as e:
+                error = e
+                self.failovers += 1
+        raise error if error is not None else RuntimeError("no endpoint available")
+
+    async def _attempt(self, endpoint: Endpoint, tried: list[Endpoint],
+                       send: Callable[[Endpoint], Awaitable[T]],
+                       discard: Callable[[T], Awaitable[None]] | None) -> T:
+        """`send` to `endpoint`, and also to another endpoint (added to
+        `tried`) if it is slow; the first success wins. A losing request
+        that succeeded as well is given to `discard`. Raises TimeoutError,
+        and fails `endpoint`, if nothing has answered after `timeout`."""
+        tasks = [asyncio.ensure_future(send(endpoint))]
+        try:
+            winner, timed_out, hung = await self._race(endpoint, tried, send, tasks)
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+        if timed_out:
+            # hung rather than slow: cancelling it is not enough to keep
+            # the next request away from it
+            self.timeouts += 1
+            if hung:
+                self._failed(endpoint)
+            raise TimeoutError(f"{endpoint.name} did not answer in {self.timeout}s")
+        if winner is None:
+            # every request failed
+            return tasks[0].result()
+        if winner is not tasks[0]:
+            self.hedge_wins += 1
+        if discard is not None:
+            for task in tasks:
+                if task is not winner and task.done() and not task.cancelled() \
+                        and task.exception() is None:
+                    await discard(task.result())
+        return winner.result()
+
+    async def _race(self, endpoint: Endpoint, tried: list[Endpoint],
+                    send: Callable[[Endpoint], Awaitable[T]],
+                    tasks: list[asyncio.Future[T]]) -> tuple[asyncio.Future[T] | None, bool, bool]:
+        """Wait for the first of `tasks` to succeed, hedging to another
+        endpoint when `endpoint` is slow; (winner, whether `timeout` passed
+        first, whether `endpoint` was still pending then)."""
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        delay = self._hedge_delay(endpoint)
+        hedge_at = None if delay is None else now + delay
+        deadline = None if self.timeout is None else now + self.timeout
+        pending = set(tasks)
+        while pending:
+            wake = min((t for t in (hedge_at, deadline) if t is not None), default=None)
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED,
+                timeout=None if wake is None else max(wake - loop.time(), 0.0))
+            winner = next((t for t in tasks if t in done and t.exception() is None), None)
+            if winner is not None or not pending:
+                return winner, False, False
+            now = loop.time()
+            if deadline is not None and now >= deadline:
+                return None, True, tasks[0] in pending
+            if hedge_at is not None and now >= hedge_at:
+                hedge_at = None
+                if (backup := self._pick(tried)) is not None:
+                    tried.append(backup)
+                    self.hedged += 1
+                    task = asyncio.ensure_future(send(backup))
+                    tasks.append(task)
+                    pending.add(task)
+        return None, False, False
+
+    def _invoke(self, messages: Prompt, schema: Schema | None) -> str:
+        tried: list[Endpoint] = []
+        error: Exception | None = None
+        while (endpoint := self._pick(tried)) is not None:
+            tried.append(endpoint)
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+            started = self.clock()
+            try:
+                text = self._backend(endpoint, schema).invoke(messages)
+            except Exception as e:
+                self._failed(endpoint)
+                error = e
+                self.failovers += 1
+                continue
+            finally:
+                endpoint.outstanding -= 1
+            self._succeeded(endpoint, self.clock() - started)
+            return text
+        raise error if error is not None else RuntimeError("no endpoint available")
+
+    async def _ainvoke(self, messages: Prompt, schema: Schema | None) -> str:
+        return await self._request(lambda endpoint: self._call(endpoint, messages, schema))
+
+    async def _astream(self, messages: Prompt, schema: Schema | None) -> AsyncIterator[str]:
+        # failover and hedging end at the first chunk: after that the caller
+        # has seen part of one answer and it can't be swapped for another
+        stream = await self._request(lambda endpoint: self._open(endpoint, messages, schema),
+                                     discard=_Stream.close)
+        try:
+            if stream.first is None:
+                return
+            yield stream.first
+            async for chunk in stream.chunks:
+                yield chunk
+        finally:
+            await stream.close()
+
+    def invoke(self, messages: Prompt) -> str:
+        return self._invoke(messages, None)
+
+    async def ainvoke(self, messages: Prompt) -> str:
+        return await self._ainvoke(messages, None)
+
+    def astream(self, messages: Prompt) -> AsyncIterator[str]:
+        return self._astream(messages, None)
+
+    async def warmup(self) -> None:
+        results = await asyncio.gather(*(e.backend.warmup() for e in self.endpoints),
+                                       return_exceptions=True)
+        errors = [r for r in results if isinstance(r, Exception)]
+        if len(errors) == len(self.endpoints):
+            raise errors[0]
+        for endpoint, result in zip(self.endpoints, results, strict=True):
+            if isinstance(result, Exception):
+                # down at startup: out of rotation until its cooldown ends
+                endpoint.state = OPEN
+                endpoint.opened_at = self.clock()
+
+    def with_schema(self, schema: Schema) -> LlmBackend:
+        # the same endpoints, load and breakers; each endpoint binds the schema
+        return _SchemaPool(self, schema)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "failovers": self.failovers,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "timeouts": self.timeouts,
+            "endpoints": {e.name: e.stats() for e in self.endpoints},
+        }
+
+
+class _Stream:
+    def __init__(self, endpoint: Endpoint, chunks: AsyncIterator[str], first: str | None):
+        self.endpoint = endpoint
+        self.chunks = chunks
+        self.first = first
+
+    async def close(self) -> None:
+        self.endpoint.outstanding -= 1
+        await self.chunks.aclose()
+
+
+class _SchemaPool(LlmBackend):
+    def __init__(self, pool: PoolBackend, schema: Schema):
+        self.pool = pool
+        self.schema = schema
+
+    def invoke(self, messages: Prompt) -> str:
+        return self.pool._invoke(messages, self.schema)
+
+    async def ainvoke(self, messages: Prompt) -> str:
+        return await self.pool._ainvoke(messages, self.schema)
+
+    def astream(self, messages: Prompt) -> AsyncIterator[str]:
+        return self.pool._astream(messages, self.schema)
@@ -1,3 +1,5 @@
+from agent.data_model import SessionContext
+
 SYSTEM_PROMPT = """
 [System]
 You are a helpful assistant at Jacobs Plumbing. Be polite and friendly while remain professional.
@@ -27,6 +29,27 @@ Return a JSON object exactly in this form:
 }
 """
 
+ROUTE_AND_ASK_PROMPT = """
+[Task]
+Extract intent and any scheduling slots from the Historical Context AND User Utterance, and write the next question for the customer.
+The booking still needs the items listed under [Missing information]. Set "next_slot" to the first of them the User Utterance does not provide, and "next_question" to one short, friendly question asking for it. Leave both empty if nothing is left to ask or the intent is not "book".
+Return a JSON object exactly in this form:
+{
+    "intent": "book" or "other",
+    "slots": {
+        "customer_name": ...,
+        "contact_address": ...,
+        "contact_number": ...,
+        "service_requested": "plumb" or "repair" or "install" or "clean" or "jet" or "re-pipes",
+        "problem_description": ...,  # example: leaky pipes, toilet damage, etc.
+        "preferred_date": ...,
+        "preferred_time": "AM" or "PM",
+    },
+    "next_slot": ...,
+    "next_question": ...,
+}
+"""
+
 REQUEST_INFO_PROMPT = """
 [Task]
 Kindly request customer for the information about
@@ -50,3 +73,95 @@ END_CONVERSATION_PROMPT = """
 [Task]
 Thankfully say goodbye to the customer
 """
+
+SUMMARIZE_PROMPT = """
+[Task]
+Update the running summary of this phone call with the new turns below.
+Keep every detail needed to finish the booking: customer name, address, phone number, requested service, problem, preferred date/time and any option chosen.
+Answer with the updated summary only, in at most 120 words.
+"""
+
+# what the JSON answers to the prompts above must look like, see agent.structured;
+# also sent to servers that support JSON mode or guided decoding
+_SLOT_SCHEMA = {
+    "type": ["object", "null"],
+    "properties": {name: {"type": ["string", "null"]} for name in (
+        "customer_name", "contact_address", "contact_number", "service_requested",
+        "problem_description", "preferred_date", "preferred_time")},
+    "additionalProperties": False,
+}
+
+ROUTE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "intent": {"type": "string", "enum": ["book", "other"]},
+        "slots": _SLOT_SCHEMA,
+    },
+    "required": ["intent"],
+}
+
+ROUTE_AND_ASK_SCHEMA = {
+    "type": "object",
+    "properties": {
+        **ROUTE_SCHEMA["properties"],
+        "next_slot": {"type": ["string", "null"]},
+        "next_question": {"type": ["string", "null"]},
+    },
+    "required": ["intent"],
+}
+
+ANYTHING_ELSE_SCHEMA = {
+    "type": "object",
+    "properties": {"answer": {"type": "string", "enum": ["yes", "no", "other"]}},
+    "required": ["answer"],
+}
+
+# collect_info questions that need no LLM, keyed by Slots.missing_slots() names
+QUESTION_TEMPLATES = {
+    "customer_name": "May I have your full name, please?",
+    "contact_address": "What is the address where you need the service?",
+    "contact_number": "What is the best phone number to reach you?",
+    "service_requested": "Which service would you like to book: drain cleaning, hydro jetting, installation, repair or re-piping?",
+    "problem_description": "Could you briefly describe the problem you're having?",
+    "preferred_date_or_time": "Do you have a preferred date, and would morning or afternoon suit you better?",
+}
+
+
+Messages = list[tuple[str, str]]
+
+
+class PromptBuilder:
+    """Assembles prompts as structured chat messages:
+
+        [system] + [conversation history...] + [task (+ user utterance)]
+
+    The history is rendered once per transcript entry and cached on the
+    session, so building a prompt is O(new entries) and consecutive calls
+    share the system + history prefix (which lets the server reuse its
+    prefix/KV cache). Entries folded into `ctx.summary` by a history policy
+    are replaced by a single summary message.
+    """
+
+    def __init__(self, system_prompt: str = SYSTEM_PROMPT):
+        self.system = ("system", system_prompt.strip())
+
+    def history(self, ctx: SessionContext) -> Messages:
+        rendered = ctx.rendered.messages
+        for who, text in ctx.transcript[len(rendered):]:
+            role = "assistant" if who == "assistant" else "user"
+            rendered.append((role, text.strip()))
+        return rendered
+
+    def build(self, task: str, ctx: SessionContext | None = None,
+              user_text: str | None = None) -> Messages:
+        messages = [self.system]
+        if ctx is not None:
+            if ctx.summary:
+                messages.append(
+                    ("system", f"[Conversation summary]\n{ctx.summary}"))
+            messages.extend(self.history(ctx)[ctx.summary_upto:])
+        content = task.strip()
+        if user_text is not None:
+            content += f"\n\n[User utterance]\n{user_text}"
+        messages.append(("user", content))
+        return messages
@@ -0,0 +1,425 @@
+"""Holds on offered slots, and their conversion into bookings.
+
+`offer_slots` holds the options it reads out, so nobody else is offered or
+books them while the caller decides; `confirm_schedule` commits the hold of
+the chosen option and releases the others. Holds that are never committed
+expire after `ttl` seconds and are swept in bulk. Whenever a held or booked
+slot is given back, the `listeners` are told, so the waitlist can offer it.
+
+A hold claims one technician at the slot's time, not the whole slot: a
+popular 8am slot with ten qualified technicians can be held by ten callers.
+"""
+from __future__ import annotations
+
+import asyncio
+import heapq
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections.abc import Callable
+from dataclasses import dataclass
+
+from agent.availability import AvailabilityEngine, get_engine, to_minutes
+
+
+@dataclass(slots=True)
+class Hold:
+    hold_id: str
+    slot_id: str
+    technician_id: str
+    call_id: str
+    expires: float
+
+
+class Reservations(ABC):
+    """Where `agent.tools` places holds and commits bookings."""
+
+    def __init__(self, engine: AvailabilityEngine | None = None, ttl: float = 180.0):
+        self._engine = engine
+        self.ttl = ttl
+        self.held = 0
+        self.conflicts = 0
+        self.committed = 0
+        self.expired = 0
+        # called with the slot id whenever a hold or booking is given back
+        self.listeners: list[Callable[[str], None]] = []
+
+    def _freed(self, slot_id: str) -> None:
+        for listener in self.listeners:
+            listener(slot_id)
+
+    @property
+    def engine(self) -> AvailabilityEngine:
+        # the engine installed in agent.availability unless one was given
+        return self._engine or get_engine()
+
+    @abstractmethod
+    async def hold(self, call_id: str, slot_ids: list[str], want: int | None = None,
+                   ttl: float | None = None) -> dict[str, str]:
+        """Hold slots in the given order until `want` are held, for `ttl`
+        seconds (default `self.ttl`); slot id -> hold id for those held.
+        Taken slots are skipped."""
+
+    @abstractmethod
+    async def commit(self, hold_id: str) -> str | None:
+        """Turn a live hold into a booking; the technician id, or None if the
+        hold expired or is unknown."""
+
+    @abstractmethod
+    async def release(self, hold_ids: list[str]) -> None:
+        ...
+
+    @abstractmethod
+    async def cancel(self, slot_id: str, technician_id: str) -> bool:
+        """Give back a committed booking; False if there was none."""
+
+    @abstractmethod
+    async def sweep(self) -> int:
+        """Drop expired holds; how many there were."""
+
+    async def refresh(self) -> None:
+        """Bring the engine's calendars up to date with the holds and
+        bookings made elsewhere, before they are searched for open slots."""
+        return None
+
+    async def book(self, call_id: str, slot_id: str) -> str | None:
+        """Hold and commit in one go, for a slot that wasn't held."""
+        held = await self.hold(call_id, [slot_id])
+        return await self.commit(held[slot_id]) if held else None
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "held": self.held,
+            "conflicts": self.conflicts,
+            "committed": self.committed,
+            "expired": self.expired,
+        }
+
+
+class MemoryReservations(Reservations):
+    """Holds on the in-process calendars of the availability engine.
+
+    A hold books the technician's calendar right away (so `find_slots` stops
+    offering that time) and releasing or expiring it frees the calendar
+    again. Each operation runs without awaiting in between, so within the
+    event loop it is atomic and needs no lock, however many sessions compete
+    for the same slot. Expiry times are kept in a heap and swept from its
+    head on every hold and commit.
+    """
+
+    def __init__(self, engine: AvailabilityEngine | None = None, ttl: float = 180.0,
+                 clock: Callable[[], float] = time.monotonic):
+        super().__init__(engine, ttl)
+        self.clock = clock
+        self._holds: dict[str, Hold] = {}
+        # (expires, hold id); committed and released holds are skipped when popped
+        self._expiry: list[tuple[float, str]] = []
+
+    def __len__(self) -> int:
+        return len(self._holds)
+
+    def _sweep(self) -> int:
+        now = self.clock()
+        swept = 0
+        while self._expiry and self._expiry[0][0] <= now:
+            _, hold_id = heapq.heappop(self._expiry)
+            if (hold := self._holds.pop(hold_id, None)) is not None:
+                self.engine.release(hold.slot_id, hold.technician_id)
+                self._freed(hold.slot_id)
+                swept += 1
+        self.expired += swept
+        return swept
+
+    async def hold(self, call_id: str, slot_ids: list[str], want: int | None = None,
+                   ttl: float | None = None) -> dict[str, str]:
+        self._sweep()
+        expires = self.clock() + (self.ttl if ttl is None else ttl)
+        held: dict[str, str] = {}
+        for slot_id in slot_ids:
+            if want is not None and len(held) >= want:
+                break
+            technician = self.engine.book(slot_id)
+            if technician is None:
+                self.conflicts += 1
+                continue
+            hold = Hold(uuid.uuid4().hex, slot_id, technician.id, call_id, expires)
+            self._holds[hold.hold_id] = hold
+            heapq.heappush(self._expiry, (expires, hold.hold_id))
+            held[slot_id] = hold.hold_id
+        self.held += len(held)
+        return held
+
+    async def commit(self, hold_id: str) -> str | None:
+        self._sweep()
+        hold = self._holds.pop(hold_id, None)
+        if hold is None:
+            return None
+        # the calendar entry made by the hold is now the booking
+        self.committed += 1
+        return hold.technician_id
+
+    async def release(self, hold_ids: list[str]) -> None:
+        for hold_id in hold_ids:
+            if (hold := self._holds.pop(hold_id, None)) is not None:
+                self.engine.release(hold.slot_id, hold.technician_id)
+                self._freed(hold.slot_id)
+
+    async def cancel(self, slot_id: str, technician_id: str) -> bool:
+        try:
+            released = self.engine.release(slot_id, technician_id)
+        except ValueError:
+            return False
+        if released:
+            self._freed(slot_id)
+        return released
+
+    async def sweep(self) -> int:
+        return self._sweep()
+
+
+class SqliteReservations(Reservations):
+    """Holds and bookings in a SQLite table shared by worker processes.
+
+    Each hold runs in one `BEGIN IMMEDIATE` transaction, which first deletes
+    expired holds and then claims the first technician with no overlapping
+    claim, so two processes can never claim the same technician at the same
+    time. The table decides who gets a technician; the engine's in-process
+    calendars mirror its live claims, so `find_slots` doesn't offer what is
+    claimed. Triggers append every change to the claims to `claim_log`, and
+    the mirror applies the entries it hasn't seen yet: this process's own
+    claims at once and other processes' on `refresh` (done by
+    `tools.get_availability`); a slot claimed elsewhere in between is
+    skipped by `hold`.
+
+    SQL runs in a worker thread; the engine's calendars and the counters
+    are only changed on the event loop, where `find_slots` reads them.
+    """
+
+    def __init__(self, path: str = "reservations.sqlite3",
+                 engine: AvailabilityEngine | None = None, ttl: float = 180.0):
+        super().__init__(engine, ttl)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS claims ("
+            " hold_id TEXT PRIMARY KEY, slot_id TEXT NOT NULL,"
+            " technician_id TEXT NOT NULL, start INTEGER NOT NULL, end INTEGER NOT NULL,"
+            " call_id TEXT NOT NULL, expires REAL NOT NULL,"
+            " committed INTEGER NOT NULL DEFAULT 0)")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS claims_technician ON claims (technician_id, start)")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS claims_expires ON claims (expires) WHERE committed = 0")
+        # one row per change to a claim: live = 0 once it is gone, expires is
+        # NULL once it is a booking
+        logged = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'claim_log'").fetchone()
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS claim_log ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT, hold_id TEXT NOT NULL,"
+            " slot_id TEXT NOT NULL, technician_id TEXT NOT NULL, end INTEGER NOT NULL,"
+            " live INTEGER NOT NULL, expires REAL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS claim_log_end ON claim_log (end)")
+        if not logged:
+            # claims made before there was a log
+            self._conn.execute(
+                "INSERT INTO claim_log (hold_id, slot_id, technician_id, end, live, expires)"
+                " SELECT hold_id, slot_id, technician_id, end, 1,"
+                " CASE WHEN committed THEN NULL ELSE expires END FROM claims")
+        for event, row, live in (("INSERT", "new", 1), ("UPDATE OF committed", "new", 1),
+                                 ("DELETE", "old", 0)):
+            self._conn.execute(
+                f"CREATE TRIGGER IF NOT EXISTS claims_{event.split()[0].lower()}"
+                f" AFTER {event} ON claims BEGIN"
+                " INSERT INTO claim_log (hold_id, slot_id, technician_id, end, live, expires)"
+                f" VALUES ({row}.hold_id, {row}.slot_id, {row}.technician_id, {row}.end, {live},"
+                f" CASE WHEN {live} AND NOT {row}.committed THEN {row}.expires END); END")
+        # hold id -> (slot id, technician id, expiry or None for a booking) of
+        # the claims booked in the engine's calendars
+        self._mirrored: dict[str, tuple[str, str, float | None]] = {}
+        # last claim_log entry applied, and (expires, hold id) of mirrored holds
+        self._synced = 0
+        self._expiry: list[tuple[float, str]] = []
+
+    def _changes(self) -> list[tuple]:
+        # claim_log entries not yet applied; run in the worker thread
+        return self._conn.execute(
+            "SELECT seq, hold_id, slot_id, technician_id, live, expires FROM claim_log"
+            " WHERE seq > ? ORDER BY seq", (self._synced,)).fetchall()
+
+    def _apply(self, changes: list[tuple]) -> None:
+        # book new claims into the engine's calendars and free those that are
+        # gone or expired; on the event loop. Entries fetched twice by
+        # overlapping calls are applied once.
+        engine = self.engine
+        now = time.time()
+        for seq, hold_id, slot_id, tech_id, live, expires in changes:
+            if seq <= self._synced:
+                continue
+            self._synced = seq
+            mirrored = self._mirrored.pop(hold_id, None)
+            if not live or (expires is not None and expires < now):
+                if mirrored is not None:
+                    engine.release(slot_id, tech_id)
+            elif mirrored is not None or engine.claim(slot_id, tech_id):
+                self._mirrored[hold_id] = (slot_id, tech_id, expires)
+                if expires is not None:
+                    heapq.heappush(self._expiry, (expires, hold_id))
+        while self._expiry and self._expiry[0][0] < now:
+            _, hold_id = heapq.heappop(self._expiry)
+            mirrored = self._mirrored.get(hold_id)
+            # committed since, or pushed again with a later expiry
+            if mirrored is not None and mirrored[2] is not None and mirrored[2] < now:
+                del self._mirrored[hold_id]
+                engine.release(*mirrored[:2])
+
+    def _refresh(self) -> list[tuple]:
+        with self._lock:
+            return self._changes()
+
+    async def refresh(self) -> None:
+        self._apply(await asyncio.to_thread(self._refresh))
+
+    def _delete_expired(self) -> list[str]:
+        # slot ids of the expired holds
+        rows = self._conn.execute(
+            "DELETE FROM claims WHERE committed = 0 AND expires < ? RETURNING slot_id",
+            (time.time(),)).fetchall()
+        return [slot_id for slot_id, in rows]
+
+    def _expired(self, slot_ids: list[str]) -> None:
+        self.expired += len(slot_ids)
+        for slot_id in slot_ids:
+            self._freed(slot_id)
+
+    def _hold(self, call_id: str, slot_ids: list[str], want: int | None,
+              ttl: float | None) -> tuple[dict[str, str], int, list[str], list[tuple]]:
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        held: dict[str, str] = {}
+        conflicts = 0
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                expired = self._delete_expired()
+                for slot_id in slot_ids:
+                    if want is not None and len(held) >= want:
+                        break
+                    try:
+                        start, end, technicians = self.engine.candidates(slot_id)
+                    except ValueError:
+                        continue
+                    for tech in technicians:
+                        busy = self._conn.execute(
+                            "SELECT 1 FROM claims WHERE technician_id = ?"
+                            " AND start < ? AND end > ? LIMIT 1",
+                            (tech.id, end, start)).fetchone()
+                        if busy is None:
+                            hold_id = uuid.uuid4().hex
+                            self._conn.execute(
+                                "INSERT INTO claims (hold_id, slot_id, technician_id,"
+                                " start, end, call_id, expires) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                (hold_id, slot_id, tech.id, start, end, call_id, expires))
+                            held[slot_id] = hold_id
+                            break
+                    else:
+                        conflicts += 1
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            return held, conflicts, expired, self._changes()
+
+    async def hold(self, call_id: str, slot_ids: list[str], want: int | None = None,
+                   ttl: float | None = None) -> dict[str, str]:
+        held, conflicts, expired, changes = await asyncio.to_thread(
+            self._hold, call_id, slot_ids, want, ttl)
+        self._apply(changes)
+        self.held += len(held)
+        self.conflicts += conflicts
+        self._expired(expired)
+        return held
+
+    def _commit(self, hold_id: str) -> tuple[str | None, list[tuple]]:
+        with self._lock:
+            row = self._conn.execute(
+                "UPDATE claims SET committed = 1 WHERE hold_id = ? AND committed = 0"
+                " AND expires >= ? RETURNING technician_id",
+                (hold_id, time.time())).fetchone()
+            return (row[0] if row else None), self._changes()
+
+    async def commit(self, hold_id: str) -> str | None:
+        technician_id, changes = await asyncio.to_thread(self._commit, hold_id)
+        self._apply(changes)
+        if technician_id is not None:
+            self.committed += 1
+        return technician_id
+
+    def _release(self, hold_ids: list[str]) -> tuple[list[str], list[tuple]]:
+        with self._lock:
+            rows = [self._conn.execute(
+                "DELETE FROM claims WHERE hold_id = ? AND committed = 0 RETURNING slot_id",
+                (hold_id,)).fetchone() for hold_id in hold_ids]
+            return [row[0] for row in rows if row is not None], self._changes()
+
+    async def release(self, hold_ids: list[str]) -> None:
+        if hold_ids:
+            released, changes = await asyncio.to_thread(self._release, hold_ids)
+            self._apply(changes)
+            for slot_id in released:
+                self._freed(slot_id)
+
+    def _cancel(self, slot_id: str, technician_id: str) -> tuple[bool, list[tuple]]:
+        with self._lock:
+            cancelled = self._conn.execute(
+                "DELETE FROM claims WHERE slot_id = ? AND technician_id = ? AND committed = 1",
+                (slot_id, technician_id)).rowcount > 0
+            return cancelled, self._changes()
+
+    async def cancel(self, slot_id: str, technician_id: str) -> bool:
+        cancelled, changes = await asyncio.to_thread(self._cancel, slot_id, technician_id)
+        self._apply(changes)
+        if cancelled:
+            self._freed(slot_id)
+        return cancelled
+
+    def _sweep(self, now: int) -> tuple[list[str], list[tuple]]:
+        with self._lock:
+            expired = self._delete_expired()
+            # claims that have ended no longer matter to anyone's calendars
+            self._conn.execute("DELETE FROM claim_log WHERE end <= ?", (now,))
+            return expired, self._changes()
+
+    async def sweep(self) -> int:
+        expired, changes = await asyncio.to_thread(
+            self._sweep, to_minutes(self.engine.now()))
+        self._apply(changes)
+        self._expired(expired)
+        return len(expired)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_reservations: Reservations | None = None
+
+
+def get_reservations() -> Reservations:
+    """The reservations used by `agent.tools`: in memory unless
+    `set_reservations` installed another backend."""
+    global _reservations
+    if _reservations is None:
+        _reservations = MemoryReservations()
+    return _reservations
+
+
+def set_reservations(reservations: Reservations | None) -> None:
+    """Install the backend behind `agent.tools` (None: a new in-memory one)."""
+    global _reservations
+    _reservations = reservations
@@ -0,0 +1,199 @@
+"""Semantic cache for FAQ answers given by `StateHandler.handoff_to_completion`.
+
+Questions are embedded into unit vectors and kept as rows of one matrix, so
+a lookup is a single matrix-vector product (cosine similarity) followed by
+an argmax. A cached answer is returned when the nearest question scores at
+least `threshold`.
+
+The cache is shared by every caller, so by default it only serves curated
+answers preloaded with `add_many`. With `learn=True` generated answers are
+kept too (`learn`), except for questions carrying personal details.
+"""
+from __future__ import annotations
+
+import asyncio
+import re
+import zlib
+from abc import ABC, abstractmethod
+from typing import Any
+
+import numpy as np
+
+_WORDS = re.compile(r"[a-z0-9']+")
+_STOPWORDS = frozenset(
+    "a an the i you we me my your our is are do does can could would will to of "
+    "for in on at and or it this that be with please hi hello hey".split())
+_SUFFIX = re.compile(r"(?<=\w{3})(?:ing|ed|es|s)$")
+# "Do you not do weekend calls?" must not get the answer to "Do you do..."
+_NEGATION = re.compile(r"\b(?:not|no|never|none|nothing|without)\b|n't\b", re.I)
+# answers to these are about one caller: digits (phone numbers, addresses,
+# booking references), first-person possessives and names
+_PERSONAL = re.compile(r"\d|\b(?:my|mine|our|ours)\b|\b(?:name is|i'm|i am)\s+[A-Z]", re.I)
+# a capitalised word that doesn't start a sentence, e.g. a name or street
+_PROPER_NOUN = re.compile(r"(?<![.!?]\s)(?<!^)\b(?!I\b)[A-Z][a-z]+")
+
+
+def negated(text: str) -> bool:
+    return bool(_NEGATION.search(text))
+
+
+def cacheable(question: str) -> bool:
+    """Whether a generated answer to `question` may be shared with other
+    callers."""
+    question = question.strip()
+    return not (_PERSONAL.search(question) or _PROPER_NOUN.search(question))
+
+
+class Embedder(ABC):
+    dim: int
+
+    @abstractmethod
+    def embed(self, texts: list[str]) -> np.ndarray:
+        """(len(texts), dim) float32 matrix of L2-normalized rows."""
+
+    async def aembed(self, texts: list[str]) -> np.ndarray:
+        # remote embedders shouldn't block the event loop
+        return await asyncio.to_thread(self.embed, texts)
+
+
+class HashingEmbedder(Embedder):
+    """Offline embedder: signed feature hashing of content words, word
+    bigrams and character trigrams. Deterministic across processes."""
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+
+    def _features(self, text: str) -> list[tuple[str, float]]:
+        # crude stemming so "weekend"/"weekends" share their word features
+        words = [_SUFFIX.sub("", w) for w in _WORDS.findall(text.lower())
+                 if w not in _STOPWORDS]
+        feats = [(w, 1.0) for w in words]
+        feats += [(f"{a} {b}", 1.0) for a, b in zip(words, words[1:], strict=False)]
+        for w in words:
+            padded = f"#{w}#"
+            feats += [(padded[i:i + 3], 0.5) for i in range(len(padded) - 2)]
+        return feats
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feat, weight in self._features(text):
+                h = zlib.crc32(feat.encode())
+                out[row, h % self.dim] += weight if h & 0x80000000 else -weight
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        return out / np.maximum(norms, 1e-12)
+
+    async def aembed(self, texts: list[str]) -> np.ndarray:
+        return self.embed(texts)
+
+
+class LangChainEmbedder(Embedder):
+    """Adapter for any LangChain `Embeddings` (e.g. OpenAIEmbeddings)."""
+
+    def __init__(self, embeddings: Any, dim: int):
+        self.embeddings = embeddings
+        self.dim = dim
+
+    @staticmethod
+    def _normalize(vectors: list[list[float]]) -> np.ndarray:
+        out = np.asarray(vectors, dtype=np.float32)
+        return out / np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-12)
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        return self._normalize(self.embeddings.embed_documents(texts))
+
+    async def aembed(self, texts: list[str]) -> np.ndarray:
+        return self._normalize(await self.embeddings.aembed_documents(texts))
+
+
+class SemanticCache:
+    """Nearest-neighbour cache of question -> answer.
+
+    Holds at most `capacity` entries; once full, the oldest entry is
+    overwritten. A good `threshold` depends on the embedder: the lexical
+    `HashingEmbedder` scores paraphrases lower than a dense model does.
+    `learn` also keeps generated answers, see `learn()`.
+    """
+
+    def __init__(self, embedder: Embedder | None = None,
+                 threshold: float = 0.75, capacity: int = 4096,
+                 learn: bool = False):
+        self.embedder = embedder or HashingEmbedder()
+        self.threshold = threshold
+        self.capacity = capacity
+        self.learn_generated = learn
+        self._matrix = np.zeros((min(capacity, 64), self.embedder.dim), dtype=np.float32)
+        self._questions: list[str] = []
+        self._answers: list[str] = []
+        self._negated: list[bool] = []
+        self._next = 0  # row the next add writes to
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._answers)
+
+    def _nearest(self, vector: np.ndarray) -> tuple[int, float]:
+        scores = self._matrix[:len(self)] @ vector
+        i = int(np.argmax(scores))
+        return i, float(scores[i])
+
+    def _store(self, vectors: np.ndarray, questions: list[str], answers: list[str]) -> None:
+        for vector, question, answer in zip(vectors, questions, answers, strict=True):
+            row = self._next
+            if row >= len(self._matrix):
+                grown = np.zeros((min(self.capacity, 2 * len(self._matrix)),
+                                  self.embedder.dim), dtype=np.float32)
+                grown[:len(self._matrix)] = self._matrix
+                self._matrix = grown
+            self._matrix[row] = vector
+            if row < len(self._answers):
+                self._questions[row], self._answers[row] = question, answer
+                self._negated[row] = negated(question)
+            else:
+                self._questions.append(question)
+                self._answers.append(answer)
+                self._negated.append(negated(question))
+            self._next = (row + 1) % self.capacity
+
+    async def lookup(self, question: str) -> tuple[str, float] | None:
+        """(answer, similarity) of the nearest cached question, or None."""
+        if not self._answers:
+            self.misses += 1
+            return None
+        vector = (await self.embedder.aembed([question]))[0]
+        i, score = self._nearest(vector)
+        # lexically close but asking the opposite
+        if score < self.threshold or negated(question) != self._negated[i]:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self._answers[i], score
+
+    async def add(self, question: str, answer: str) -> None:
+        await self.add_many([(question, answer)])
+
+    async def learn(self, question: str, answer: str) -> bool:
+        """Keep a generated answer if this cache learns and the question
+        isn't about the caller; whether it was stored."""
+        if not self.learn_generated or not cacheable(question):
+            return False
+        await self.add(question, answer)
+        return True
+
+    async def add_many(self, pairs: list[tuple[str, str]]) -> None:
+        """Store (question, answer) pairs, e.g. to preload known FAQs."""
+        if not pairs:
+            return
+        questions = [q for q, _ in pairs]
+        vectors = await self.embedder.aembed(questions)
+        self._store(vectors, questions, [a for _, a in pairs])
+
+    def stats(self) -> dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,1010 @@
+"""HTTP and websocket server for the agent, one worker process per core.
+
+    python -m agent.server --workers 4 --base-url http://gpu:8000/v1
+        --reservations reservations.sqlite3 --waitlist waitlist.sqlite3
+
+Sessions are keyed by call id:
+
+    POST   /calls/{call_id}/turns   {"text": "..."} -> {"reply": ..., "state": ...}
+    DELETE /calls/{call_id}         forget the session
+    GET    /calls/{call_id}         websocket: each text message is an
+                                    utterance, answered with
+                                    {"type": "chunk", "text": ...} messages as
+                                    the reply is generated, then
+                                    {"type": "done", "reply": ..., "state": ...};
+                                    {"type": "partial", "text": ...} is an
+                                    interim ASR transcript of the next
+                                    utterance, not answered (see
+                                    `Agent.process_partial`)
+    GET    /health, /stats
+
+As with `Agent.process`, the first turn of a new call returns the greeting
+(its text is ignored); a websocket on a new call gets the greeting right
+away.
+
+With `workers > 1` the parent process forks the workers and reads only the
+request line of each connection, then passes the socket (SCM_RIGHTS) to
+the worker that owns the call id by hash. All turns of a call run in one
+process, in order, so in-memory sessions work; reservations and the
+waitlist must be shared (`--reservations`, `--waitlist`) for workers not
+to book the same slot or miss each other's waitlist entries, and without
+them the server runs a single worker. A
+keep-alive connection that moves on to another call is passed on the
+same way.
+
+A worker admits a turn while fewer than `max_llm_calls` LLM calls are in
+flight, counting admitted turns that haven't called yet. Others queue (at
+most `max_waiting`, for `queue_timeout` seconds) and then get 503. On
+SIGTERM or SIGINT listeners close, running turns finish (within
+`drain_timeout`) and websockets are closed with 1001.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import base64
+import functools
+import hashlib
+import importlib
+import itertools
+import json
+import logging
+import os
+import signal
+import socket
+import struct
+import time
+import zlib
+from collections import deque
+from collections.abc import AsyncIterator, Awaitable, Callable
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from http import HTTPStatus
+from typing import TYPE_CHECKING, Any
+from urllib.parse import unquote, urlsplit
+
+from agent.backends import LlmBackend, Prompt
+from agent.core import Agent
+from agent.data_model import SessionContext
+
+if TYPE_CHECKING:
+    from agent.structured import Schema
+
+log = logging.getLogger(__name__)
+
+MAX_REQUEST = 1 << 16
+
+
+# -- admission control
+
+
+class Overloaded(Exception):
+    pass
+
+
+# per admitted turn: [True] until its first LLM call
+_starting: ContextVar[list[bool] | None] = ContextVar("starting", default=None)
+
+
+class Admission:
+    """Admits turns while LLM calls in flight (reported by
+    `InflightBackend`) plus admitted turns that haven't called yet stay
+    under `max_llm_calls`. Turns wait in FIFO order."""
+
+    def __init__(self, max_llm_calls: int = 256, max_waiting: int = 1024,
+                 timeout: float = 5.0):
+        self.max_llm_calls = max_llm_calls
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self.llm_calls = 0
+        self.starting = 0
+        self._waiters: deque[asyncio.Future] = deque()
+        self.admitted = 0
+        self.rejected = 0
+        self.peak_llm_calls = 0
+
+    def _full(self) -> bool:
+        return self.llm_calls + self.starting >= self.max_llm_calls
+
+    @property
+    def busy(self) -> bool:
+        # no room for a turn right now
+        return self._full() or bool(self._waiters)
+
+    def _wake(self) -> None:
+        while self._waiters and not self._full():
+            future = self._waiters.popleft()
+            if not future.done():
+                # the place is taken on the waiter's behalf
+                self.starting += 1
+                future.set_result(None)
+
+    def _started(self, flag: list[bool]) -> None:
+        if flag[0]:
+            flag[0] = False
+            self.starting -= 1
+
+    @asynccontextmanager
+    async def admit(self) -> AsyncIterator[None]:
+        """Raises Overloaded if the turn can't be admitted in time."""
+        flag = [True]
+        if self._full() or self._waiters:
+            if len(self._waiters) >= self.max_waiting:
+                self.rejected += 1
+                raise Overloaded("too many turns waiting")
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.append(future)
+            try:
+                async with asyncio.timeout(self.timeout):
+                    await future
+            except BaseException as e:
+                if future.done() and not future.cancelled():
+                    # woken just as it gave up: pass the place on
+                    self._started(flag)
+                    self._wake()
+                else:
+                    future.cancel()
+                    # unless `_wake` dropped it already
+                    if future in self._waiters:
+                        self._waiters.remove(future)
+                if isinstance(e, TimeoutError):
+                    self.rejected += 1
+                    raise Overloaded("no capacity within the queue timeout") from None
+                raise
+        else:
+            self.starting += 1
+        self.admitted += 1
+        token = _starting.set(flag)
+        try:
+            yield
+        finally:
+            _starting.reset(token)
+            self._started(flag)
+            self._wake()
+
+    def call_started(self, n: int = 1) -> None:
+        if (flag := _starting.get()) is not None:
+            self._started(flag)
+        self.llm_calls += n
+        self.peak_llm_calls = max(self.peak_llm_calls, self.llm_calls)
+
+    def call_finished(self, n: int = 1) -> None:
+        self.llm_calls -= n
+        self._wake()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "llm_calls": self.llm_calls,
+            "peak_llm_calls": self.peak_llm_calls,
+            "waiting": len(self._waiters),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
+
+
+class InflightBackend(LlmBackend):
+    """Passes calls through to `backend`, reporting them to `admission`."""
+
+    def __init__(self, backend: LlmBackend, admission: Admission):
+        self.backend = backend
+        self.admission = admission
+
+    def with_schema(self, schema: Schema) -> LlmBackend:
+        return InflightBackend(self.backend.with_schema(schema), self.admission)
+
+    async def warmup(self) -> None:
+        await self.backend.warmup()
+
+    def invoke(self, messages: Prompt) -> str:
+        self.admission.call_started()
+        try:
+            return self.backend.invoke(messages)
+        finally:
+            self.admission.call_finished()
+
+    async def ainvoke(self, messages: Prompt) -> str:
+        self.admission.call_started()
+        try:
+            return await self.backend.ainvoke(messages)
+        finally:
+            self.admission.call_finished()
+
+    async def astream(self, messages: Prompt) -> AsyncIterator[str]:
+        self.admission.call_started()
+        try:
+            async for chunk in self.backend.astream(messages):
+                yield chunk
+        finally:
+            self.admission.call_finished()
+
+    async def abatch(self, prompts: list[Prompt]) -> list[str | Exception]:
+        self.admission.call_started(len(prompts))
+        try:
+            return await self.backend.abatch(prompts)
+        finally:
+            self.admission.call_finished(len(prompts))
+
+
+# -- HTTP
+
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+@dataclass(slots=True)
+class Request:
+    method: str
+    path: str
+    version: str
+    headers: dict[str, str]
+    body: bytes
+    # as received, to pass the connection on to another worker
+    raw: bytes
+
+    @property
+    def keep_alive(self) -> bool:
+        connection = self.headers.get("connection", "").lower()
+        if self.version == "HTTP/1.0":
+            return connection == "keep-alive"
+        return connection != "close"
+
+    def json(self) -> Any:
+        try:
+            return json.loads(self.body or b"{}")
+        except ValueError:
+            raise HttpError(400, "body is not JSON") from None
+
+
+async def read_request(reader: asyncio.StreamReader,
+                       max_size: int = MAX_REQUEST) -> Request | None:
+    """The next request on the connection, None if the client closed it."""
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as e:
+        if not e.partial.strip():
+            return None
+        raise HttpError(400, "incomplete request") from None
+    except asyncio.LimitOverrunError:
+        raise HttpError(431, "request head too large") from None
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, version = lines[0].split(" ")
+    except ValueError:
+        raise HttpError(400, "malformed request line") from None
+    headers = {}
+    for line in lines[1:]:
+        if line:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+    if "chunked" in headers.get("transfer-encoding", ""):
+        raise HttpError(411, "chunked request bodies are not supported")
+    try:
+        length = int(headers.get("content-length", 0))
+    except ValueError:
+        raise HttpError(400, "bad content-length") from None
+    if length < 0 or len(head) + length > max_size:
+        raise HttpError(413, "request too large")
+    body = await reader.readexactly(length) if length else b""
+    return Request(method, unquote(urlsplit(target).path), version, headers,
+                   body, head + body)
+
+
+def response(status: int, body: Any = None, keep_alive: bool = True,
+             headers: tuple[tuple[str, str], ...] = ()) -> bytes:
+    payload = json.dumps(body).encode() if body is not None else b""
+    lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}",
+             "Content-Type: application/json",
+             f"Content-Length: {len(payload)}",
+             f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+    lines += [f"{name}: {value}" for name, value in headers]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + payload
+
+
+def call_id_of(path: str) -> str | None:
+    """The call id of a /calls/{call_id}[/...] path."""
+    parts = path.strip("/").split("/")
+    if len(parts) >= 2 and parts[0] == "calls" and parts[1]:
+        return parts[1]
+    return None
+
+
+def owner(call_id: str, workers: int) -> int:
+    """The worker serving `call_id`, the same in every process."""
+    return zlib.crc32(call_id.encode()) % workers
+
+
+# -- websockets (RFC 6455, text messages)
+
+_WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+_CONTINUATION, _TEXT, _BINARY, _CLOSE, _PING, _PONG = 0x0, 0x1, 0x2, 0x8, 0x9, 0xA
+
+
+def _partial_text(message: str) -> str | None:
+    # the text of a {"type": "partial", "text": ...} message
+    if not message.startswith("{"):
+        return None
+    try:
+        data = json.loads(message)
+    except ValueError:
+        return None
+    if isinstance(data, dict) and data.get("type") == "partial":
+        return str(data.get("text") or "")
+    return None
+
+
+class WebSocketError(Exception):
+    def __init__(self, code: int, reason: str):
+        super().__init__(reason)
+        self.code = code
+        self.reason = reason
+
+
+def _unmask(data: bytes, mask: bytes) -> bytes:
+    n = len(data)
+    key = int.from_bytes((mask * (n // 4 + 1))[:n], "big")
+    return (int.from_bytes(data, "big") ^ key).to_bytes(n, "big")
+
+
+def _frame(opcode: int, payload: bytes) -> bytes:
+    n = len(payload)
+    if n < 126:
+        header = struct.pack("!BB", 0x80 | opcode, n)
+    elif n < 1 << 16:
+        header = struct.pack("!BBH", 0x80 | opcode, 126, n)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 127, n)
+    return header + payload
+
+
+class WebSocket:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                 max_size: int = MAX_REQUEST):
+        self.reader = reader
+        self.writer = writer
+        self.max_size = max_size
+        self.closed = False
+
+    @staticmethod
+    def handshake(request: Request) -> bytes:
+        key = request.headers.get("sec-websocket-key")
+        if not key or request.headers.get("upgrade", "").lower() != "websocket":
+            raise HttpError(400, "not a websocket handshake")
+        accept = base64.b64encode(hashlib.sha1((key + _WS_GUID).encode()).digest()).decode()
+        return ("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n"
+                f"Connection: Upgrade\r\nSec-WebSocket-Accept: {accept}\r\n\r\n").encode()
+
+    async def receive(self) -> str | None:
+        """The next message, None once the connection is closing. Pings are
+        answered on the way."""
+        parts: list[bytes] = []
+        size = 0
+        while True:
+            first, opcode, payload = await self._read_frame(self.max_size - size)
+            if opcode == _CLOSE:
+                await self.close()
+                return None
+            if opcode == _PING:
+                self.writer.write(_frame(_PONG, payload))
+                continue
+            if opcode == _PONG:
+                continue
+            if opcode not in (_CONTINUATION, _TEXT, _BINARY):
+                raise WebSocketError(1002, f"unknown opcode {opcode}")
+            size += len(payload)
+            parts.append(payload)
+            if first & 0x80:
+                try:
+                    return b"".join(parts).decode()
+                except UnicodeDecodeError:
+                    raise WebSocketError(1007, "messages must be UTF-8") from None
+
+    async def _read_frame(self, limit: int) -> tuple[int, int, bytes]:
+        # (first header byte, opcode, unmasked payload) of the next frame,
+        # whose payload may be `limit` bytes at most
+        first, second = await self.reader.readexactly(2)
+        length = second & 0x7F
+        if length == 126:
+            length = struct.unpack("!H", await self.reader.readexactly(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", await self.reader.readexactly(8))[0]
+        if not second & 0x80:
+            raise WebSocketError(1002, "client frames must be masked")
+        if length > limit:
+            raise WebSocketError(1009, "message too big")
+        mask = await self.reader.readexactly(4)
+        return first, first & 0x0F, _unmask(await self.reader.readexactly(length), mask)
+
+    async def send(self, message: dict[str, Any]) -> None:
+        self.writer.write(_frame(_TEXT, json.dumps(message).encode()))
+        await self.writer.drain()
+
+    async def close(self, code: int = 1000, reason: str = "") -> None:
+        if self.closed:
+            return
+        self.closed = True
+        self.writer.write(_frame(_CLOSE, struct.pack("!H", code) + reason.encode()[:120]))
+        await self.writer.drain()
+
+
+# -- passing connections between processes
+
+
+async def hand_off(channel: socket.socket, sock: Any, data: bytes,
+                   timeout: float = 1.0) -> None:
+    """Send the connection `sock`, and the bytes already read from it, to the
+    worker listening on `channel`. Raises OSError if it can't be delivered."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.send_fds(channel, [data], [sock.fileno()])
+            return
+        except BlockingIOError:
+            # the worker's queue is full
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.01)
+
+
+@dataclass(slots=True, eq=False)
+class _Connection:
+    task: asyncio.Task
+    writer: asyncio.StreamWriter
+    busy: bool = False
+    websocket: WebSocket | None = None
+
+
+class Worker:
+    """Serves the sessions of one process. `outbox` holds the channels of
+    all workers (this one at `index`), for connections that belong
+    elsewhere."""
+
+    def __init__(self, agent: Agent, admission: Admission | None = None,
+                 index: int = 0, outbox: list[socket.socket] | None = None,
+                 drain_timeout: float = 30.0, max_request: int = MAX_REQUEST):
+        self.agent = agent
+        self.admission = admission or Admission()
+        # every LLM call of the agent counts against admission
+        agent.llm.backend = InflightBackend(agent.llm.backend, self.admission)
+        self.index = index
+        self.outbox = outbox or []
+        self.drain_timeout = drain_timeout
+        self.max_request = max_request
+        self.draining = False
+        self._connections: set[_Connection] = set()
+        # adopted connections being set up: the loop keeps only weak
+        # references to tasks
+        self._tasks: set[asyncio.Task] = set()
+        # call id -> [lock, users], so a call's turns run one at a time
+        self._locks: dict[str, list[Any]] = {}
+        self.turns = 0
+        self.errors = 0
+
+    # -- turns
+
+    @asynccontextmanager
+    async def _serialized(self, call_id: str) -> AsyncIterator[None]:
+        entry = self._locks.get(call_id)
+        if entry is None:
+            entry = self._locks[call_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[call_id]
+
+    async def turn(self, call_id: str, text: str,
+                   on_chunk: Callable[[str], Awaitable[None]] | None = None
+                   ) -> tuple[SessionContext, str]:
+        """One turn of `call_id`, after the call's earlier turns and once
+        admitted. Reply chunks go to `on_chunk` as they are generated."""
+        store = self.agent.store
+        async with self._serialized(call_id), self.admission.admit():
+            base = await store.load(call_id)
+            ctx = base or SessionContext(call_id=call_id)
+            if on_chunk is None:
+                ctx, reply = await self.agent.process(text, ctx)
+            else:
+                stream = self.agent.process_stream(text, ctx)
+                async for chunk in stream:
+                    await on_chunk(chunk)
+                ctx, reply = stream.context, stream.reply
+            await store.save(ctx, base)
+        self.turns += 1
+        return ctx, reply
+
+    async def partial(self, call_id: str, text: str) -> None:
+        """Speculate on an interim transcript of the call's next turn, unless
+        LLM capacity is short: turns come first."""
+        if not self.admission.busy:
+            await self.agent.process_partial_call(call_id, text)
+
+    # -- connections
+
+    async def connection(self, reader: asyncio.StreamReader,
+                         writer: asyncio.StreamWriter) -> None:
+        conn = _Connection(asyncio.current_task(), writer)
+        self._connections.add(conn)
+        passed_on = False
+        try:
+            while not self.draining:
+                try:
+                    request = await read_request(reader, self.max_request)
+                except HttpError as e:
+                    writer.write(response(e.status, {"error": e.message}, keep_alive=False))
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+                conn.busy = True
+                call_id = call_id_of(request.path)
+                if call_id is not None and len(self.outbox) > 1 and \
+                        (index := owner(call_id, len(self.outbox))) != self.index:
+                    writer.transport.pause_reading()
+                    try:
+                        await hand_off(self.outbox[index], writer.get_extra_info("socket"),
+                                       request.raw)
+                    except OSError:
+                        writer.write(response(503, {"error": "worker unavailable"},
+                                              keep_alive=False))
+                        await writer.drain()
+                        break
+                    passed_on = True
+                    break
+                if not await self._handle(request, call_id, reader, writer, conn):
+                    break
+                conn.busy = False
+        except (ConnectionError, asyncio.IncompleteReadError, WebSocketError):
+            pass
+        finally:
+            self._connections.discard(conn)
+            if passed_on:
+                # the socket lives on in the other worker
+                writer.transport.abort()
+            else:
+                writer.close()
+
+    async def _handle(self, request: Request, call_id: str | None,
+                      reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                      conn: _Connection) -> bool:
+        """Answer `request`; False if the connection is done."""
+        keep_alive = request.keep_alive
+        try:
+            if call_id is not None and request.method == "GET" \
+                    and request.headers.get("upgrade", "").lower() == "websocket":
+                writer.write(WebSocket.handshake(request))
+                conn.websocket = WebSocket(reader, writer, self.max_request)
+                await self._websocket(call_id, conn)
+                return False
+            status, body = await self._route(request, call_id)
+        except HttpError as e:
+            status, body = e.status, {"error": e.message}
+        except Overloaded as e:
+            writer.write(response(503, {"error": str(e)}, keep_alive and not self.draining,
+                                  headers=(("Retry-After", "1"),)))
+            await writer.drain()
+            return keep_alive
+        except Exception as e:
+            self.errors += 1
+            log.exception("turn of %s failed", call_id)
+            status, body = 500, {"error": type(e).__name__}
+        keep_alive = keep_alive and not self.draining
+        writer.write(response(status, body, keep_alive))
+        await writer.drain()
+        return keep_alive
+
+    async def _route(self, request: Request, call_id: str | None) -> tuple[int, Any]:
+        if request.path == "/health":
+            return (503, {"status": "draining"}) if self.draining else (200, {"status": "ok"})
+        if request.path == "/stats":
+            return 200, self.stats()
+        if call_id is None:
+            raise HttpError(404, "no such endpoint")
+        if request.path.rstrip("/").endswith("/turns") and request.method == "POST":
+            text = request.json().get("text", "")
+            if not isinstance(text, str):
+                raise HttpError(400, "text must be a string")
+            ctx, reply = await self.turn(call_id, text)
+            return 200, {"call_id": call_id, "reply": reply, "state": ctx.state.value}
+        if request.method == "DELETE" and request.path.rstrip("/").count("/") == 2:
+            async with self._serialized(call_id):
+                await self.agent.store.delete(call_id)
+            return 200, {"call_id": call_id, "deleted": True}
+        raise HttpError(405, f"{request.method} not allowed here")
+
+    async def _websocket(self, call_id: str, conn: _Connection) -> None:
+        ws = conn.websocket
+        try:
+            # a new call starts with the greeting
+            if await self.agent.store.load(call_id) is None:
+                text: str | None = ""
+            else:
+                text = await self._next_text(call_id, conn)
+            while text is not None:
+                conn.busy = True
+                if not await self._websocket_turn(call_id, ws, text):
+                    await ws.close()
+                    return
+                text = await self._next_text(call_id, conn)
+        except WebSocketError as e:
+            await ws.close(e.code, e.reason)
+        finally:
+            self.agent.discard_partial(call_id)
+
+    async def _next_text(self, call_id: str, conn: _Connection) -> str | None:
+        # the text of the call's next turn, None once the websocket is
+        # closing; interim transcripts are speculated on meanwhile
+        ws = conn.websocket
+        while True:
+            conn.busy = False
+            if self.draining:
+                await ws.close(1001, "server shutting down")
+                return None
+            text = await ws.receive()
+            if text is None:
+                return None
+            if ws.closed:
+                # sent after our close frame
+                continue
+            if (partial := _partial_text(text)) is not None:
+                await self.partial(call_id, partial)
+                continue
+            return text
+
+    async def _websocket_turn(self, call_id: str, ws: WebSocket, text: str) -> bool:
+        # one turn with its reply streamed to `ws`; False once the call ended
+        async def chunk(part: str) -> None:
+            await ws.send({"type": "chunk", "text": part})
+        try:
+            ctx, reply = await self.turn(call_id, text, chunk)
+        except Overloaded as e:
+            await ws.send({"type": "error", "error": "overloaded", "detail": str(e)})
+            return True
+        except Exception as e:
+            self.errors += 1
+            log.exception("turn of %s failed", call_id)
+            await ws.send({"type": "error", "error": type(e).__name__})
+            return True
+        await ws.send({"type": "done", "reply": reply, "state": ctx.state.value})
+        return ctx.state.value != "END"
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "worker": self.index,
+            "pid": os.getpid(),
+            "connections": len(self._connections),
+            "websockets": sum(1 for c in self._connections if c.websocket is not None),
+            "turns": self.turns,
+            "errors": self.errors,
+            "admission": self.admission.stats(),
+        }
+
+    # -- serving
+
+    def _adopt(self, channel: socket.socket) -> None:
+        # connections passed on by the parent or another worker
+        while True:
+            try:
+                data, fds, _, _ = socket.recv_fds(channel, self.max_request + 1024, 4)
+            except BlockingIOError:
+                return
+            for fd in fds:
+                sock = socket.socket(fileno=fd)
+                if self.draining:
+                    sock.close()
+                else:
+                    task = asyncio.ensure_future(self._serve_socket(sock, data))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+
+    async def _serve_socket(self, sock: socket.socket, data: bytes) -> None:
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader(limit=self.max_request)
+        reader.feed_data(data)
+        protocol = asyncio.StreamReaderProtocol(reader)
+        transport, _ = await loop.connect_accepted_socket(lambda: protocol, sock)
+        writer = asyncio.StreamWriter(transport, protocol, reader, loop)
+        await self.connection(reader, writer)
+
+    async def run(self, listener: socket.socket | None = None,
+                  inbox: socket.socket | None = None) -> None:
+        """Serve connections accepted on `listener` and/or passed on
+        `inbox` until SIGTERM or SIGINT, then drain."""
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, stop.set)
+        try:
+            await self.agent.warmup()
+        except Exception as e:
+            # the first turns will pay for it, or fail on their own
+            log.warning("worker %d: warmup failed: %r", self.index, e)
+        server = None
+        if listener is not None:
+            server = await asyncio.start_server(self.connection, sock=listener,
+                                                limit=self.max_request)
+        if inbox is not None:
+            inbox.setblocking(False)
+            loop.add_reader(inbox, self._adopt, inbox)
+        await stop.wait()
+        if server is not None:
+            server.close()
+        if inbox is not None:
+            loop.remove_reader(inbox)
+        await self.drain()
+
+    async def drain(self) -> None:
+        """Stop taking turns, let running ones finish within
+        `drain_timeout`, then cancel what is left."""
+        self.draining = True
+        # idle connections are closed now, busy ones after their turn
+        for conn in list(self._connections):
+            if conn.busy:
+                continue
+            if conn.websocket is not None:
+                try:
+                    await conn.websocket.close(1001, "server shutting down")
+                except ConnectionError:
+                    pass
+            conn.writer.close()
+        tasks = [conn.task for conn in self._connections]
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=self.drain_timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                log.warning("worker %d: cancelled %d connections after %.0fs",
+                            self.index, len(pending), self.drain_timeout)
+                await asyncio.wait(pending)
+        close = getattr(self.agent.store, "close", None)
+        if close is not None:
+            close()
+
+
+class Front:
+    """Parent process: forks the workers, accepts connections and passes
+    each one to the worker owning its call id. Restarts workers that die;
+    on SIGTERM or SIGINT stops accepting and waits for the workers to
+    drain."""
+
+    def __init__(self, listener: socket.socket, workers: int,
+                 start_worker: Callable[[int, socket.socket, list[socket.socket]], None],
+                 head_timeout: float = 10.0, drain_timeout: float = 30.0):
+        self.listener = listener
+        self.workers = workers
+        self.start_worker = start_worker
+        self.head_timeout = head_timeout
+        self.drain_timeout = drain_timeout
+        pairs = [socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM) for _ in range(workers)]
+        self.inbox = [pair[0] for pair in pairs]
+        self.outbox = [pair[1] for pair in pairs]
+        for channel in self.outbox:
+            channel.setblocking(False)
+        self.pids: dict[int, int] = {}
+        self._next = itertools.cycle(range(workers))
+        # connections being routed: the loop keeps only weak references to tasks
+        self._tasks: set[asyncio.Task] = set()
+        self.stopping = False
+
+    def spawn(self, index: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                self.listener.close()
+                for i, channel in enumerate(self.inbox):
+                    if i != index:
+                        channel.close()
+                self.start_worker(index, self.inbox[index], self.outbox)
+            except BaseException:
+                log.exception("worker %d crashed", index)
+                code = 1
+            finally:
+                os._exit(code)
+        self.pids[pid] = index
+
+    def run(self) -> None:
+        for index in range(self.workers):
+            self.spawn(index)
+        asyncio.run(self._serve())
+
+    async def _serve(self) -> None:
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, stop.set)
+        self.listener.setblocking(False)
+        accepting = asyncio.create_task(self._accept())
+        reaping = asyncio.create_task(self._reap())
+        await stop.wait()
+        self.stopping = True
+        accepting.cancel()
+        self.listener.close()
+        for pid in self.pids:
+            os.kill(pid, signal.SIGTERM)
+        try:
+            async with asyncio.timeout(self.drain_timeout + 5):
+                await reaping
+        except TimeoutError:
+            for pid in self.pids:
+                os.kill(pid, signal.SIGKILL)
+
+    async def _accept(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            sock, _ = await loop.sock_accept(self.listener)
+            task = asyncio.ensure_future(self._route(sock))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _route(self, sock: socket.socket) -> None:
+        # read up to the request line, which names the call
+        loop = asyncio.get_running_loop()
+        data = b""
+        try:
+            sock.setblocking(False)
+            async with asyncio.timeout(self.head_timeout):
+                while b"\r\n" not in data and len(data) < 8192:
+                    chunk = await loop.sock_recv(sock, 8192)
+                    if not chunk:
+                        return
+                    data += chunk
+            target = data.split(b"\r\n", 1)[0].split(b" ")
+            call_id = call_id_of(unquote(urlsplit(target[1].decode("latin-1")).path)) \
+                if len(target) > 1 else None
+            index = owner(call_id, self.workers) if call_id is not None else next(self._next)
+            await hand_off(self.outbox[index], sock, data)
+        except (OSError, TimeoutError):
+            try:
+                sock.send(response(503, {"error": "no worker available"}, keep_alive=False))
+            except OSError:
+                pass
+        finally:
+            sock.close()
+
+    async def _reap(self) -> None:
+        while self.pids:
+            while self.pids:
+                try:
+                    pid, status = os.waitpid(-1, os.WNOHANG)
+                except ChildProcessError:
+                    self.pids.clear()
+                    break
+                if not pid:
+                    break
+                index = self.pids.pop(pid)
+                if not self.stopping:
+                    log.warning("worker %d exited (status %d), restarting", index, status)
+                    self.spawn(index)
+            await asyncio.sleep(0.1)
+
+
+def serve(make_agent: Callable[[], Agent], host: str = "0.0.0.0", port: int = 8080,
+          workers: int = 1, max_llm_calls: int = 256, max_waiting: int = 1024,
+          queue_timeout: float = 5.0, drain_timeout: float = 30.0,
+          max_request: int = MAX_REQUEST) -> None:
+    """Run the server until SIGTERM or SIGINT. `make_agent` is called in
+    each worker process, after the fork, so clients and connection pools
+    aren't shared between processes."""
+    listener = socket.create_server((host, port), backlog=1024)
+
+    def start_worker(index: int, inbox: socket.socket | None,
+                     outbox: list[socket.socket]) -> None:
+        async def main() -> None:
+            worker = Worker(make_agent(), Admission(max_llm_calls, max_waiting, queue_timeout),
+                            index=index, outbox=outbox, drain_timeout=drain_timeout,
+                            max_request=max_request)
+            await worker.run(listener if inbox is None else None, inbox)
+        asyncio.run(main())
+
+    log.info("serving on %s:%d with %d worker(s)", host, port, workers)
+    if workers <= 1:
+        start_worker(0, None, [])
+    else:
+        Front(listener, workers, start_worker, drain_timeout=drain_timeout).run()
+
+
+def default_agent(model_name: str = "gpt-4o", base_url: str = "http://localhost:8000/v1",
+                  api_key: str = "secret-key", endpoints: list[str] | None = None,
+                  hedge: bool = False, structured_output: str | None = None,
+                  replay: bool = False, sessions: str | None = None,
+                  reservations: str | None = None,
+                  waitlist: str | None = None) -> Agent:
+    """An agent configured from the command line options."""
+    from agent.llm import LlmClient
+    from agent.store import MemorySessionStore, SqliteSessionStore
+
+    if reservations:
+        from agent.reservation import SqliteReservations, set_reservations
+        set_reservations(SqliteReservations(reservations))
+    if waitlist:
+        from agent.waitlist import WaitlistStore, set_waitlist
+        set_waitlist(WaitlistStore(waitlist))
+    backend = None
+    if replay:
+        from agent.backends import ReplayBackend
+        from agent.loadtest import ROUTE_RESPONSES
+        backend = ReplayBackend(routes=ROUTE_RESPONSES, latency=0.05)
+    llm = LlmClient(model_name=model_name, base_url=base_url, api_key=api_key,
+                    backend=backend, endpoints=endpoints, hedge=hedge,
+                    structured_output=structured_output)
+    store = SqliteSessionStore(sessions) if sessions else MemorySessionStore()
+    return Agent(llm, store=store)
+
+
+def worker_count(workers: int | None, reservations: str | None,
+                 waitlist: str | None) -> int:
+    """`workers`, by default one per core. Several workers need shared
+    reservations and waitlist: in memory each worker would have its own."""
+    shared = bool(reservations and waitlist)
+    if workers is None:
+        return (os.cpu_count() or 1) if shared else 1
+    if workers > 1 and not shared:
+        raise ValueError(f"{workers} workers need --reservations and --waitlist "
+                         "files to share holds, bookings and the waitlist")
+    return workers
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int,
+                        help="worker processes (default: one per core with "
+                             "--reservations and --waitlist, otherwise one)")
+    parser.add_argument("--app", help="module:function returning the Agent to serve "
+                                      "(default: one built from the options below)")
+    parser.add_argument("--model", default="gpt-4o")
+    parser.add_argument("--base-url", default="http://localhost:8000/v1")
+    parser.add_argument("--api-key", default=os.environ.get("OPENAI_API_KEY", "secret-key"))
+    parser.add_argument("--endpoint", action="append",
+                        help="model server URL, repeat for an endpoint pool")
+    parser.add_argument("--hedge", action="store_true")
+    parser.add_argument("--structured-output", choices=("json_object", "json_schema", "guided_json"))
+    parser.add_argument("--replay", action="store_true",
+                        help="answer with the offline ReplayBackend")
+    parser.add_argument("--sessions", help="SQLite file for sessions (default: in memory)")
+    parser.add_argument("--reservations", help="SQLite file for holds and bookings, "
+                                               "needed with several workers")
+    parser.add_argument("--waitlist", help="SQLite file for the waitlist, "
+                                           "needed with several workers")
+    parser.add_argument("--max-llm-calls", type=int, default=256,
+                        help="LLM calls in flight per worker before turns queue")
+    parser.add_argument("--max-waiting", type=int, default=1024)
+    parser.add_argument("--queue-timeout", type=float, default=5.0)
+    parser.add_argument("--drain-timeout", type=float, default=30.0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(process)d %(levelname)s %(message)s")
+
+    if args.app:
+        module, _, name = args.app.partition(":")
+        make_agent = getattr(importlib.import_module(module), name)
+        # the app decides where its state lives
+        workers = args.workers or os.cpu_count() or 1
+    else:
+        try:
+            workers = worker_count(args.workers, args.reservations, args.waitlist)
+        except ValueError as e:
+            parser.error(str(e))
+        make_agent = functools.partial(
+            default_agent, model_name=args.model, base_url=args.base_url,
+            api_key=args.api_key, endpoints=args.endpoint, hedge=args.hedge,
+            structured_output=args.structured_output, replay=args.replay,
+            sessions=args.sessions, reservations=args.reservations,
+            waitlist=args.waitlist)
+    serve(make_agent, args.host, args.port, workers,
+          max_llm_calls=args.max_llm_calls, max_waiting=args.max_waiting,
+          queue_timeout=args.queue_timeout, drain_timeout=args.drain_timeout)
+
+
+if __name__ == "__main__":
+    main()
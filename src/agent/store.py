@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+import asyncio
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+from agent.codec import decode_delta, decode_session, encode_delta, encode_session
+from agent.data_model import SessionContext, TurnDelta
+
+
+class SessionStore(ABC):
+    """Where `Agent.process_call` keeps sessions between turns."""
+
+    @abstractmethod
+    async def load(self, call_id: str) -> SessionContext | None:
+        ...
+
+    @abstractmethod
+    async def save(self, ctx: SessionContext,
+                   base: SessionContext | None = None) -> None:
+        """Store `ctx`. `base` is the session `load` returned for the turn
+        that produced it, if any: stores may save only what changed."""
+
+    @abstractmethod
+    async def delete(self, call_id: str) -> None:
+        ...
+
+
+class MemorySessionStore(SessionStore):
+    """In-process store bounded by `max_sessions` (least recently used calls
+    are evicted first) and by `ttl` seconds since the last save.
+
+    Sessions are kept as objects, not encoded: `Agent.process` forks the
+    context it is given, so stored sessions are never mutated by a turn.
+    """
+
+    def __init__(self, max_sessions: int = 10_000, ttl: float | None = 3600.0):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions: OrderedDict[str, tuple[float, SessionContext]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    async def load(self, call_id: str) -> SessionContext | None:
+        entry = self._sessions.get(call_id)
+        if entry is None:
+            return None
+        expires, ctx = entry
+        if expires < time.monotonic():
+            del self._sessions[call_id]
+            return None
+        self._sessions.move_to_end(call_id)
+        return ctx
+
+    async def save(self, ctx: SessionContext,
+                   base: SessionContext | None = None) -> None:
+        expires = time.monotonic() + self.ttl if self.ttl else float("inf")
+        self._sessions[ctx.call_id] = (expires, ctx)
+        self._sessions.move_to_end(ctx.call_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    async def delete(self, call_id: str) -> None:
+        self._sessions.pop(call_id, None)
+
+    def purge_expired(self) -> int:
+        now = time.monotonic()
+        expired = [k for k, (expires, _) in self._sessions.items() if expires < now]
+        for call_id in expired:
+            del self._sessions[call_id]
+        return len(expired)
+
+
+class SqliteSessionStore(SessionStore):
+    """SQLite-backed store shared by worker processes on one host.
+
+    Sessions are stored encoded with `agent.codec`. A turn saved with its
+    `base` appends only its `TurnDelta`, so saving doesn't grow with the
+    length of the call; after `compact_every` deltas the session is written
+    whole again. Queries run in a worker thread so they don't block the
+    event loop.
+    """
+
+    def __init__(self, path: str = "sessions.sqlite3", ttl: float | None = 3600.0,
+                 compact_every: int = 16):
+        self.path = path
+        self.ttl = ttl
+        self.compact_every = compact_every
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " call_id TEXT PRIMARY KEY, data BLOB NOT NULL, expires REAL NOT NULL)")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS session_deltas ("
+            " seq INTEGER PRIMARY KEY, call_id TEXT NOT NULL, data BLOB NOT NULL)")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS session_deltas_call ON session_deltas (call_id, seq)")
+
+    def _load(self, call_id: str) -> SessionContext | None:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT data FROM sessions WHERE call_id = ? AND expires >= ?",
+                (call_id, time.time())).fetchall()
+            if not rows:
+                return None
+            deltas = self._conn.execute(
+                "SELECT data FROM session_deltas WHERE call_id = ? ORDER BY seq",
+                (call_id,)).fetchall()
+        ctx = decode_session(rows[0][0])
+        for (data,) in deltas:
+            ctx = ctx.apply(decode_delta(data))
+        return ctx
+
+    async def load(self, call_id: str) -> SessionContext | None:
+        return await asyncio.to_thread(self._load, call_id)
+
+    def _save(self, ctx: SessionContext, delta: TurnDelta | None, expires: float) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if delta is not None:
+                    saved = self._conn.execute(
+                        "UPDATE sessions SET expires = ? WHERE call_id = ?",
+                        (expires, ctx.call_id)).rowcount
+                    (count,), = self._conn.execute(
+                        "SELECT COUNT(*) FROM session_deltas WHERE call_id = ?",
+                        (ctx.call_id,)).fetchall()
+                if delta is None or not saved or count >= self.compact_every:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO sessions (call_id, data, expires) VALUES (?, ?, ?)",
+                        (ctx.call_id, encode_session(ctx), expires))
+                    self._conn.execute(
+                        "DELETE FROM session_deltas WHERE call_id = ?", (ctx.call_id,))
+                elif delta:
+                    self._conn.execute(
+                        "INSERT INTO session_deltas (call_id, data) VALUES (?, ?)",
+                        (ctx.call_id, encode_delta(delta)))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    async def save(self, ctx: SessionContext,
+                   base: SessionContext | None = None) -> None:
+        expires = time.time() + self.ttl if self.ttl else float("inf")
+        delta = ctx.diff(base) if base is not None else None
+        await asyncio.to_thread(self._save, ctx, delta, expires)
+
+    async def delete(self, call_id: str) -> None:
+        def delete() -> None:
+            with self._lock:
+                self._conn.execute("DELETE FROM sessions WHERE call_id = ?", (call_id,))
+                self._conn.execute("DELETE FROM session_deltas WHERE call_id = ?", (call_id,))
+        await asyncio.to_thread(delete)
+
+    async def purge_expired(self) -> int:
+        def purge() -> int:
+            with self._lock:
+                now = time.time()
+                self._conn.execute(
+                    "DELETE FROM session_deltas WHERE call_id IN"
+                    " (SELECT call_id FROM sessions WHERE expires < ?)", (now,))
+                return self._conn.execute(
+                    "DELETE FROM sessions WHERE expires < ?", (now,)).rowcount
+        return await asyncio.to_thread(purge)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
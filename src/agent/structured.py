@@ -0,0 +1,426 @@
+"""Structured (JSON) answers of the model: tolerant, incremental parsing and
+schema checks.
+
+`JsonStream` is a push parser: chunks of a streamed completion are fed as
+they arrive, each character is looked at once, and every completed value
+is reported with its path, e.g. `("intent",) "book"` long before the
+closing brace. It accepts what models actually write, including what our
+own prompt templates show them:
+
+- prose or a ```json fence before the object, and anything after it;
+- `#`, `//` and `/* */` comments;
+- trailing or missing commas, single quotes, unquoted keys;
+- Python literals (`True`, `None`) and template left-overs such as
+  `"book" or "other"` or `...`;
+- a truncated object, which is closed at the end of the stream.
+
+`Schema` compiles a JSON-schema subset (type, enum, properties, required,
+items) once into a validator that normalizes where it is safe (enum case,
+numbers given for strings), drops optional properties that don't fit and
+rejects answers missing a required one. `Schema.json_schema` is what
+backends pass on for JSON mode or guided decoding.
+"""
+from __future__ import annotations
+
+import json
+import re
+from collections.abc import Callable
+from typing import Any
+
+# a run of characters that needs no special handling inside a string
+_PLAIN = {'"': re.compile(r'[^"\\]+'), "'": re.compile(r"[^'\\]+")}
+_SPACE = re.compile(r"\s+")
+# a run of characters of a number, literal or unquoted key
+_BARE_RUN = re.compile(r"[^,:}\]#/ \t\r\n]+")
+_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f"}
+_LITERALS = {"true": True, "false": False, "null": None, "none": None,
+             "undefined": None, "...": None, "…": None}
+
+# parser modes
+_PRELUDE, _VALUE, _KEY, _COLON, _AFTER, _STRING, _BARE, _COMMENT, _BLOCK, _DONE = range(10)
+
+
+def _bare_value(token: str) -> Any:
+    lower = token.lower()
+    if lower in _LITERALS:
+        return _LITERALS[lower]
+    try:
+        return int(token)
+    except ValueError:
+        pass
+    try:
+        return float(token)
+    except ValueError:
+        return token
+
+
+class JsonStream:
+    """Incremental, error-tolerant parser of one JSON object (or array).
+
+    `on_value(path, value)` is called for every value once it is complete,
+    innermost first; `value` is the object parsed so far (None until the
+    opening brace is seen) and `done` tells whether it was closed.
+    """
+
+    def __init__(self, on_value: Callable[[tuple, Any], None] | None = None):
+        self.on_value = on_value
+        self.value: Any = None
+        self.done = False
+        # open containers, each with its key (or index) in the parent
+        self._stack: list[tuple[Any, Any]] = []
+        self._key: Any = None
+        self._mode = _PRELUDE
+        self._resume = _PRELUDE  # mode to return to after a comment
+        self._token: list[str] = []
+        self._quote = ""
+        self._escape = ""  # pending escape: "\\" or "u" + hex digits so far
+        self._is_key = False
+        self._slash = False  # a "/" that may start a comment
+
+    def feed(self, chunk: str) -> None:
+        i, n = 0, len(chunk)
+        while i < n and self._mode != _DONE:
+            mode = self._mode
+            if mode == _STRING:
+                i = self._string(chunk, i)
+            elif mode == _COMMENT or mode == _BLOCK:
+                i = self._comment(chunk, i)
+            elif mode == _BARE:
+                i = self._bare(chunk, i)
+            else:
+                i = self._structure(chunk, i)
+
+    def finish(self) -> Any:
+        """End of the completion: close whatever is still open and return
+        the value (None if no object was found)."""
+        if self._mode == _BARE:
+            self._end_bare()
+        while self._stack:
+            self._close()
+        return self.value
+
+    # -- structure
+
+    def _structure(self, chunk: str, i: int) -> int:
+        # outside strings, comments and bare tokens; the index to go on from
+        c = chunk[i]
+        if self._slash:
+            # the previous character was a lone "/"
+            self._slash = False
+            if c in "/*":
+                self._resume, self._mode = self._mode, _COMMENT if c == "/" else _BLOCK
+                return i + 1
+        if c in " \t\r\n":
+            return _SPACE.match(chunk, i).end()
+        if c == "#" and self._mode != _PRELUDE:
+            self._resume, self._mode = self._mode, _COMMENT
+        elif c == "/" and self._mode != _PRELUDE:
+            self._slash = True
+        else:
+            self._char(c)
+        return i + 1
+
+    def _char(self, c: str) -> None:
+        mode = self._mode
+        if mode == _PRELUDE:
+            if c in "{[":
+                self._open({} if c == "{" else [])
+        elif mode == _KEY:
+            self._key_char(c)
+        elif mode == _COLON:
+            self._colon_char(c)
+        elif mode == _VALUE:
+            self._value_char(c)
+        elif mode == _AFTER:
+            self._after_char(c)
+
+    def _key_char(self, c: str) -> None:
+        if c in "\"'":
+            self._start_string(c, key=True)
+        elif c in "}]":
+            self._close()
+        elif c != ",":
+            self._token = [c]
+            self._is_key = True
+            self._mode = _BARE
+
+    def _colon_char(self, c: str) -> None:
+        if c in ":=":
+            self._mode = _VALUE
+        elif c == ",":
+            self._mode = _KEY  # a key without a value
+        elif c in "}]":
+            self._close()
+        else:
+            self._mode = _VALUE
+            self._value_char(c)
+
+    def _value_char(self, c: str) -> None:
+        if c in "{[":
+            self._open({} if c == "{" else [])
+        elif c in "\"'":
+            self._start_string(c, key=False)
+        elif c in "}]":
+            self._close()
+        elif c == ",":
+            if isinstance(self._stack[-1][0], dict):
+                self._mode = _KEY  # "key": , -> no value
+        else:
+            self._token = [c]
+            self._is_key = False
+            self._mode = _BARE
+
+    def _after_char(self, c: str) -> None:
+        container = self._stack[-1][0]
+        if c == ",":
+            self._mode = _KEY if isinstance(container, dict) else _VALUE
+        elif c in "}]":
+            self._close()
+        elif c in "\"'" and isinstance(container, dict):
+            # missing comma, or `"book" or "other"`: read it as a key,
+            # which is dropped if no value follows
+            self._start_string(c, key=True)
+        elif c in "{[" and isinstance(container, list):
+            self._open({} if c == "{" else [])
+        # anything else after a value ("or", stray text) is ignored
+
+    def _open(self, container: Any) -> None:
+        if self._stack:
+            parent = self._stack[-1][0]
+            if isinstance(parent, dict):
+                key = self._key
+                parent[key] = container
+            else:
+                key = len(parent)
+                parent.append(container)
+        else:
+            key = None
+            self.value = container
+        self._stack.append((container, key))
+        self._mode = _KEY if isinstance(container, dict) else _VALUE
+
+    def _close(self) -> None:
+        container, key = self._stack.pop()
+        if not self._stack:
+            self.done = True
+            self._mode = _DONE
+            if self.on_value is not None:
+                self.on_value((), container)
+            return
+        self._mode = _AFTER
+        if self.on_value is not None:
+            self.on_value(self._path(key), container)
+
+    def _path(self, key: Any) -> tuple:
+        return tuple(k for _, k in self._stack[1:]) + (key,)
+
+    def _set(self, value: Any) -> None:
+        parent = self._stack[-1][0]
+        if isinstance(parent, dict):
+            key = self._key
+            parent[key] = value
+        else:
+            key = len(parent)
+            parent.append(value)
+        self._mode = _AFTER
+        if self.on_value is not None:
+            self.on_value(self._path(key), value)
+
+    # -- tokens
+
+    def _string(self, chunk: str, i: int) -> int:
+        c = chunk[i]
+        if self._escape:
+            self._escape_char(c)
+        elif c == self._quote:
+            self._end_string()
+        elif c == "\\":
+            self._escape = "\\"
+        else:
+            m = _PLAIN[self._quote].match(chunk, i)
+            self._token.append(m.group())
+            return m.end()
+        return i + 1
+
+    def _comment(self, chunk: str, i: int) -> int:
+        c = chunk[i]
+        if self._mode == _COMMENT:
+            if c == "\n":
+                self._mode = self._resume
+        else:
+            if self._slash and c == "/":
+                self._mode = self._resume
+            self._slash = c == "*"
+        return i + 1
+
+    def _bare(self, chunk: str, i: int) -> int:
+        if m := _BARE_RUN.match(chunk, i):
+            self._token.append(m.group())
+            return m.end()
+        # the character that ends the token is read in the mode after it
+        self._end_bare()
+        return i
+
+    def _start_string(self, quote: str, key: bool) -> None:
+        self._quote = quote
+        self._is_key = key
+        self._token = []
+        self._mode = _STRING
+
+    def _end_string(self) -> None:
+        text = "".join(self._token)
+        if self._is_key:
+            self._key = text
+            self._mode = _COLON
+        else:
+            self._set(text)
+
+    def _escape_char(self, c: str) -> None:
+        if self._escape == "\\":
+            if c == "u":
+                self._escape = "u"
+                return
+            self._token.append(_ESCAPES.get(c, c))
+            self._escape = ""
+            return
+        # \uXXXX
+        self._escape += c
+        if len(self._escape) == 5:
+            try:
+                self._token.append(chr(int(self._escape[1:], 16)))
+            except ValueError:
+                self._token.append(self._escape[1:])
+            self._escape = ""
+
+    def _end_bare(self) -> None:
+        token = "".join(self._token)
+        if self._is_key:
+            self._key = token
+            self._mode = _COLON
+        else:
+            self._set(_bare_value(token))
+
+
+def loads(text: str) -> Any:
+    """The first JSON object (or array) in `text`, parsed tolerantly; None
+    if there is none."""
+    try:
+        return json.loads(text)
+    except (ValueError, TypeError):
+        pass
+    stream = JsonStream()
+    stream.feed(text)
+    return stream.finish()
+
+
+class SchemaError(ValueError):
+    pass
+
+
+_TYPES: dict[str, Callable[[Any], bool]] = {
+    "object": lambda v: isinstance(v, dict),
+    "array": lambda v: isinstance(v, list),
+    "string": lambda v: isinstance(v, str),
+    "integer": lambda v: isinstance(v, int) and not isinstance(v, bool),
+    "number": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    "boolean": lambda v: isinstance(v, bool),
+    "null": lambda v: v is None,
+}
+
+
+def _compile(schema: dict[str, Any]) -> Callable[[Any], Any]:
+    checks: list[Callable[[Any], Any]] = []
+    if (types := schema.get("type")) is not None:
+        checks.append(_check_type([types] if isinstance(types, str) else list(types)))
+    if "enum" in schema:
+        checks.append(_check_enum(schema["enum"]))
+    if "properties" in schema:
+        checks.append(_check_properties(schema))
+    if "items" in schema:
+        checks.append(_check_items(_compile(schema["items"])))
+
+    def validate(value: Any) -> Any:
+        for check in checks:
+            value = check(value)
+        return value
+    return validate
+
+
+def _check_type(types: list[str]) -> Callable[[Any], Any]:
+    accepts = [_TYPES[t] for t in types]
+    wants_string = "string" in types
+
+    def check_type(value: Any) -> Any:
+        if any(accept(value) for accept in accepts):
+            return value
+        # phone numbers and the like come back as numbers
+        if wants_string and isinstance(value, (int, float)) and not isinstance(value, bool):
+            return str(value)
+        raise SchemaError(f"expected {'/'.join(types)}, got {type(value).__name__}")
+    return check_type
+
+
+def _check_enum(values: list[Any]) -> Callable[[Any], Any]:
+    canonical = {(v.lower() if isinstance(v, str) else v): v for v in values}
+
+    def check_enum(value: Any) -> Any:
+        key = value.strip().lower() if isinstance(value, str) else value
+        if key not in canonical:
+            raise SchemaError(f"{value!r} is not one of {list(canonical.values())}")
+        return canonical[key]
+    return check_enum
+
+
+def _check_properties(schema: dict[str, Any]) -> Callable[[Any], Any]:
+    properties = {k: _compile(v) for k, v in schema["properties"].items()}
+    required = frozenset(schema.get("required", ()))
+    keep_extra = schema.get("additionalProperties", True) is not False
+
+    def check_properties(value: Any) -> Any:
+        if not isinstance(value, dict):
+            return value
+        out = {k: v for k, v in value.items() if keep_extra and k not in properties}
+        for key, check in properties.items():
+            if key not in value:
+                if key in required:
+                    raise SchemaError(f"missing {key!r}")
+                continue
+            try:
+                out[key] = check(value[key])
+            except SchemaError as e:
+                if key in required:
+                    raise SchemaError(f"{key}: {e}") from None
+                # an optional field that doesn't fit is dropped
+        return out
+    return check_properties
+
+
+def _check_items(item: Callable[[Any], Any]) -> Callable[[Any], Any]:
+    def check_items(value: Any) -> Any:
+        if not isinstance(value, list):
+            return value
+        return [item(v) for v in value]
+    return check_items
+
+
+class Schema:
+    """A JSON schema, compiled once into `validate`."""
+
+    def __init__(self, name: str, json_schema: dict[str, Any]):
+        self.name = name
+        self.json_schema = json_schema
+        self._validate = _compile(json_schema)
+
+    def validate(self, value: Any) -> Any:
+        """The value, normalized; raises SchemaError if it doesn't fit."""
+        return self._validate(value)
+
+    def parse(self, text: str) -> Any | None:
+        """Tolerantly parsed and validated `text`, None if it isn't usable."""
+        value = loads(text)
+        if value is None:
+            return None
+        try:
+            return self._validate(value)
+        except SchemaError:
+            return None
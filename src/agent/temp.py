@@ -1,7 +1,9 @@
 from __future__ import annotations
 
 import asyncio
+import functools
 import json
+import os
 from typing import Any, Callable, Optional
 
 from agent.data_model import SessionContext, StateName
@@ -10,10 +12,14 @@ from agent.prompts import *
 from agent.tools import check_service, create_appointment, get_availability
 from agent.utils import parse_json_strict
 
-llm = LlmClient(
-    model_name="openai/gpt-oss-20b",
-    base_url="http://192.168.0.198:1234/v1",
-)
+
+@functools.cache
+def get_llm() -> LlmClient:
+    # created on first use, not when the module is imported
+    return LlmClient(
+        model_name="openai/gpt-oss-20b",
+        base_url=os.environ.get("LLM_BASE_URL", "http://localhost:1234/v1"),
+    )
 
 
 def greeting(ctx: SessionContext) -> tuple[StateName, str]:
@@ -25,7 +31,7 @@ def listen_and_route(ctx: SessionContext, user_text: str) -> tuple[StateName, st
     # A prompt template for slot extraction (ask for JSON)
     prompt = LISTEN_AND_ROUTE_PROMPT.strip()
     prompt += f"User utterance: '''{user_text}'''\n"
-    raw: str = llm.run(prompt)
+    raw: str = get_llm().run(prompt)
     parsed: dict = parse_json_strict(raw)
     if not parsed:
         # fallback simplistic heuristics (very rough)
@@ -53,7 +59,7 @@ def listen_and_route(ctx: SessionContext, user_text: str) -> tuple[StateName, st
 def handoff_to_completion(ctx: SessionContext, user_text: str) -> tuple[StateName, str]:
     # Use LLM to answer generic queries
     prompt = f"{HANDOFF_TO_COMPLETION_PROMPT}: {user_text}"
-    resp = llm.run(prompt)
+    resp = get_llm().run(prompt)
     return StateName.LISTEN, resp
 
 
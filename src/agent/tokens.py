@@ -0,0 +1,63 @@
+"""Token counting for history budgets and traces.
+
+tiktoken downloads its encoding on first use, which blocks for a while
+and fails offline. `TokenCounter` never loads it on the event loop: call
+`await counter.load()` (done by `Agent.warmup`) or let the first count
+start loading it in a background thread. Until the encoder is there, or
+when it can't be loaded, counts are estimated from the text length.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+from typing import Any
+
+log = logging.getLogger(__name__)
+
+# characters per token of English text, for estimates
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+class TokenCounter:
+    def __init__(self, encoding: str = "o200k_base"):
+        self.encoding = encoding
+        self._encoder: Any = None
+        self._lock = threading.Lock()
+        # tried already (successfully or not): never again
+        self._tried = False
+        self._loading = False
+
+    @property
+    def exact(self) -> bool:
+        return self._encoder is not None
+
+    def _load(self) -> None:
+        with self._lock:
+            if self._tried:
+                return
+            try:
+                import tiktoken
+                self._encoder = tiktoken.get_encoding(self.encoding)
+            except Exception as e:
+                log.warning("tiktoken encoding %s unavailable, estimating token counts: %s",
+                            self.encoding, e)
+            finally:
+                self._tried = True
+
+    async def load(self) -> bool:
+        """Load the encoder off the event loop; whether counts are exact."""
+        await asyncio.to_thread(self._load)
+        return self.exact
+
+    def __call__(self, text: str) -> int:
+        if self._encoder is not None:
+            return len(self._encoder.encode(text, disallowed_special=()))
+        if not self._tried and not self._loading:
+            self._loading = True
+            threading.Thread(target=self._load, daemon=True).start()
+        return estimate_tokens(text)
@@ -1,57 +1,59 @@
 import asyncio
-import datetime
 import uuid
-from typing import Any, Optional
-
-
-async def check_service(service_name: str) -> dict[str, Any]:
-    """Check if the named service exists. Returns {exists: bool, service_id: Optional[str], suggestions: List[str]}"""
-    known = {
-        "plumb": "plumb_000",
-        "repair": "plumb_001",
-        "install": "plumb_002",
-        "clean": "plumb_003",
-        "jet": "plumb_004",
-        "re-pipes": "plumb_005",
-    }
-    lower = (service_name or "").strip().lower()
-    if lower in known:
-        return {"exists": True, "service_id": known[lower], "suggestions": []}
-    return {"exists": False, "service_id": None, "suggestions": list(known.keys())}
+from typing import Any
+
+from agent.availability import get_engine
+from agent.catalogue import get_catalogue
+from agent.reservation import get_reservations
+from agent.tracing import traced
+from agent.waitlist import get_matcher, get_waitlist, parse_window
+
 
+@traced("tool.check_service")
+async def check_service(service_name: str, branch: str | None = None) -> dict[str, Any]:
+    """Check if the named service exists. Returns {exists: bool, service_id: Optional[str], service: Optional[str], suggestions: List[str]}"""
+    return get_catalogue().check(service_name or "", branch)
 
+
+@traced("tool.get_availability")
 async def get_availability(
-        service_id: str, date_range: Optional[str] = None,
-        branch: Optional[str] = None,
-        time_preference: Optional[str] = "") -> dict[str, Any]:
-    """Return availability slots for a service_id. {slots: [ {slot_id, start_iso, end_iso, location} ]}
-    This is a stubbed schedule generator for demo.
-    """
-    now = datetime.datetime.now()
-    slots = []
-    # create 5 slots over the next 7 days
-    for i in range(1, 7):
-        if time_preference.lower() == "pm":
-            slot_dt = ((now + datetime.timedelta(days=i)).replace(hour=13, minute=0, second=0, microsecond=0)
-                       + datetime.timedelta(hours=i % 3))
-        elif time_preference.lower() == "am":
-            slot_dt = ((now + datetime.timedelta(days=i)).replace(hour=8, minute=0, second=0, microsecond=0)
-                       + datetime.timedelta(hours=i % 3))
-        else:
-            slot_dt = ((now + datetime.timedelta(days=i)).replace(hour=8, minute=0, second=0, microsecond=0)
-                       + datetime.timedelta(hours=i))
-        slots.append({
-            "slot_id": f"slot_{service_id}_{i}",
-            "start_iso": slot_dt.isoformat(),
-            "end_iso": (slot_dt + datetime.timedelta(minutes=45)).isoformat(),
-            # "location": branch or "Main Branch"
-        })
-    return {"slots": slots}
+        service_id: str, date_range: str | None = None,
+        branch: str | None = None,
+        time_preference: str | None = "") -> dict[str, Any]:
+    """Return availability slots for a service_id. {slots: [ {slot_id, start_iso, end_iso, branch, location} ]}"""
+    # holds and bookings made by other workers, see SqliteReservations
+    await get_reservations().refresh()
+    return {"slots": get_engine().find_slots(service_id, date_range, time_preference, branch)}
+
 
+@traced("tool.hold_slots")
+async def hold_slots(call_id: str, slot_ids: list[str],
+                     want: int | None = None) -> dict[str, Any]:
+    """Hold slots while the caller chooses. Returns {holds: {slot_id: hold_id}} for the slots held, in order, at most `want`."""
+    return {"holds": await get_reservations().hold(call_id, slot_ids, want)}
 
+
+@traced("tool.release_holds")
+async def release_holds(hold_ids: list[str]) -> None:
+    await get_reservations().release(hold_ids)
+
+
+@traced("tool.create_appointment")
 async def create_appointment(customer: dict[str, Any], service_id: str,
-                             slot_id: str, contact: Optional[str] = None) -> dict[str, Any]:
-    """Create appointment - returns success + appointment id and details."""
+                             slot_id: str, contact: str | None = None,
+                             hold_id: str | None = None,
+                             call_id: str = "") -> dict[str, Any]:
+    """Create appointment - returns success + appointment id and details.
+    Commits `hold_id` if given; a slot without a live hold is booked only if it is still free."""
+    reservations = get_reservations()
+    technician_id = await reservations.commit(hold_id) if hold_id else None
+    if technician_id is not None:
+        # if it was held for a waitlisted customer, they took it
+        await get_waitlist().booked(hold_id)
+    else:
+        technician_id = await reservations.book(call_id, slot_id)
+    if technician_id is None:
+        return {"success": False, "error": "slot_unavailable"}
     appointment_id = f"ap_{uuid.uuid4().hex[:8]}"
     return {
         "success": True,
@@ -60,15 +62,31 @@ async def create_appointment(customer: dict[str, Any], service_id: str,
             "customer": customer,
             "service_id": service_id,
             "slot_id": slot_id,
+            "technician_id": technician_id,
             "contact": contact,
         }
     }
 
 
+@traced("tool.cancel_appointment")
+async def cancel_appointment(slot_id: str, technician_id: str) -> dict[str, Any]:
+    """Cancel a booking; the freed slot is offered to the waitlist."""
+    return {"success": await get_reservations().cancel(slot_id, technician_id)}
+
+
+@traced("tool.create_waitlist_entry")
 async def create_waitlist_entry(customer: dict[str, Any] = {}, service_id: str = '',
-                                preferred_window: Optional[str] = None) -> dict[str, Any]:
-    entry_id = f"wait_{uuid.uuid4().hex[:8]}"
-    return {"success": True, "waitlist_id": entry_id}
+                                preferred_window: str | None = None,
+                                branch: str | None = None) -> dict[str, Any]:
+    """Put the customer on the waitlist for `service_id` within `preferred_window` (e.g. "next week mornings", None for any time). Returns {success, waitlist_id}."""
+    if not service_id:
+        return {"success": False, "error": "unknown_service"}
+    window = parse_window(preferred_window, get_engine().now().date())
+    entry = await get_waitlist().add(service_id, customer, window,
+                                     contact=customer.get("contact"), branch=branch)
+    # match freed slots for as long as there is a waitlist
+    get_matcher().start()
+    return {"success": True, "waitlist_id": entry.entry_id}
 
 
 async def main():
@@ -84,7 +102,8 @@ async def main():
         slot_id=avail.get("slots")[0].get("slot_id"),
     )
     print(apt)
-    waitlist = await create_waitlist_entry()
+    waitlist = await create_waitlist_entry({"name": "Will"}, service.get("service_id"),
+                                           "next week mornings")
     print(waitlist)
 
 
@@ -0,0 +1,277 @@
+"""Spans for where the time of a turn goes.
+
+`Agent`, `StateHandler`, `LlmClient` and the tools open spans around their
+work ("turn", "state.<STATE>", "prompt", "llm", "parse", "tool.<name>",
+...), with attributes such as token counts and cache hits. Finished spans
+are handed to the tracer's exporters, e.g. `HistogramAggregator` for
+latency percentiles per span name or `JsonLinesExporter` for raw traces.
+
+Tracing is off by default: the installed `NullTracer` hands out one shared
+span whose methods do nothing, so instrumented code costs a method call per
+span. Turn it on with
+
+    aggregator = HistogramAggregator()
+    set_tracer(Tracer(aggregator))
+    ...
+    print(aggregator.report())
+"""
+from __future__ import annotations
+
+import functools
+import itertools
+import json
+import math
+import time
+from abc import ABC, abstractmethod
+from collections import Counter, defaultdict
+from collections.abc import Callable
+from contextvars import ContextVar, Token
+from typing import Any, TextIO
+
+from agent.tokens import TokenCounter
+
+_ids = itertools.count(1)
+
+
+class Span:
+    __slots__ = ("tracer", "name", "attributes", "id", "parent_id", "trace_id",
+                 "start", "duration", "_token")
+
+    def __init__(self, tracer: Tracer, name: str, attributes: dict[str, Any],
+                 parent: Span | None):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.id = next(_ids)
+        self.parent_id = parent.id if parent else None
+        self.trace_id = parent.trace_id if parent else self.id
+        self.start = time.perf_counter()
+        self.duration = 0.0
+        self._token: Token | None = None
+
+    def set(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def end(self) -> None:
+        self.duration = time.perf_counter() - self.start
+        self.tracer._export(self)
+
+    def __enter__(self) -> Span:
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        _current.reset(self._token)
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        self.end()
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def set(self, key: str, value: Any) -> None:
+        pass
+
+    def end(self) -> None:
+        pass
+
+    def __enter__(self) -> _NullSpan:
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+# innermost open span of the running task
+_current: ContextVar[Span | None] = ContextVar("current_span", default=None)
+
+
+class SpanExporter(ABC):
+    @abstractmethod
+    def export(self, span: Span) -> None:
+        """Called once per finished span; must not block."""
+
+
+class Tracer:
+    """Creates spans and passes finished ones to `exporters`.
+
+    Token counts use a `tokens.TokenCounter` for tiktoken's `encoding`
+    unless a `counter` is given.
+    """
+
+    enabled = True
+
+    def __init__(self, *exporters: SpanExporter, encoding: str = "o200k_base",
+                 counter: Callable[[str], int] | None = None):
+        self.exporters = list(exporters)
+        self.encoding = encoding
+        self._counter = counter or TokenCounter(encoding)
+
+    def span(self, name: str, **attributes: Any) -> Span:
+        """A span to use as a context manager; spans opened inside it, in
+        this task or tasks it starts, are its children."""
+        return Span(self, name, attributes, _current.get())
+
+    def start(self, name: str, **attributes: Any) -> Span:
+        """A span ended explicitly with `end()`, for work that can't sit in
+        a `with` block, such as an async generator. It has no children."""
+        return Span(self, name, attributes, _current.get())
+
+    def count_tokens(self, text: str) -> int:
+        return self._counter(text)
+
+    async def warmup(self) -> None:
+        if isinstance(self._counter, TokenCounter):
+            await self._counter.load()
+
+    def _export(self, span: Span) -> None:
+        for exporter in self.exporters:
+            exporter.export(span)
+
+
+class NullTracer(Tracer):
+    """Tracing off: every span is `NULL_SPAN`."""
+
+    enabled = False
+
+    def span(self, name: str, **attributes: Any) -> _NullSpan:  # type: ignore[override]
+        return NULL_SPAN
+
+    def start(self, name: str, **attributes: Any) -> _NullSpan:  # type: ignore[override]
+        return NULL_SPAN
+
+
+def prompt_text(messages: Any) -> str:
+    """The text of a prompt in any of the shapes `LlmClient` accepts."""
+    if isinstance(messages, str):
+        return messages
+    parts = []
+    for message in messages:
+        parts.append(message["content"] if isinstance(message, dict) else message[1])
+    return "\n".join(parts)
+
+
+class Histogram:
+    """Log-bucketed histogram; quantiles are accurate to `precision`
+    (relative), whatever the number of values."""
+
+    __slots__ = ("_log_base", "_buckets", "count", "total", "max")
+
+    def __init__(self, precision: float = 0.02):
+        self._log_base = math.log1p(2 * precision)
+        self._buckets: Counter[int] = Counter()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value: float) -> None:
+        self._buckets[math.floor(math.log(value) / self._log_base) if value > 0 else -(1 << 30)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * (self.count - 1)
+        seen = 0
+        for bucket in sorted(self._buckets):
+            seen += self._buckets[bucket]
+            if seen > rank:
+                if bucket == -(1 << 30):
+                    return 0.0
+                # middle of the bucket
+                return min(self.max, math.exp((bucket + 0.5) * self._log_base))
+        return self.max
+
+    def summary(self) -> dict[str, float]:
+        return {
+            "count": self.count,
+            "mean": round(self.total / self.count, 3) if self.count else 0.0,
+            "p50": round(self.quantile(0.5), 3),
+            "p95": round(self.quantile(0.95), 3),
+            "p99": round(self.quantile(0.99), 3),
+            "max": round(self.max, 3),
+        }
+
+
+class HistogramAggregator(SpanExporter):
+    """Per span name: a histogram of durations (ms), histograms of numeric
+    attributes (e.g. token counts) and counts of the values of `labels` and
+    boolean attributes (e.g. cache hits)."""
+
+    def __init__(self, labels: tuple[str, ...] = ("cache", "next", "error")):
+        self.labels = frozenset(labels)
+        self.durations: defaultdict[str, Histogram] = defaultdict(Histogram)
+        self.values: defaultdict[tuple[str, str], Histogram] = defaultdict(Histogram)
+        self.counts: defaultdict[str, Counter[str]] = defaultdict(Counter)
+
+    def export(self, span: Span) -> None:
+        self.durations[span.name].add(span.duration * 1000)
+        for key, value in span.attributes.items():
+            if isinstance(value, bool) or key in self.labels:
+                self.counts[span.name][f"{key}={value}"] += 1
+            elif isinstance(value, (int, float)):
+                self.values[span.name, key].add(value)
+
+    def report(self) -> dict[str, dict[str, Any]]:
+        out: dict[str, dict[str, Any]] = {}
+        for name in sorted(self.durations):
+            entry: dict[str, Any] = {"ms": self.durations[name].summary()}
+            for (span_name, key), histogram in sorted(self.values.items()):
+                if span_name == name:
+                    entry[key] = {**histogram.summary(), "sum": round(histogram.total, 3)}
+            if name in self.counts:
+                entry["counts"] = dict(sorted(self.counts[name].items()))
+            out[name] = entry
+        return out
+
+    def reset(self) -> None:
+        self.durations.clear()
+        self.values.clear()
+        self.counts.clear()
+
+
+class JsonLinesExporter(SpanExporter):
+    """Writes each span as one JSON line, e.g. to a file for offline analysis."""
+
+    def __init__(self, stream: TextIO):
+        self.stream = stream
+
+    def export(self, span: Span) -> None:
+        self.stream.write(json.dumps({
+            "trace": span.trace_id, "span": span.id, "parent": span.parent_id,
+            "name": span.name, "duration_ms": round(span.duration * 1000, 3),
+            **span.attributes,
+        }, default=str) + "\n")
+
+
+_tracer: Tracer = NullTracer()
+
+
+def get_tracer() -> Tracer:
+    """The tracer used by components that weren't given one."""
+    return _tracer
+
+
+def set_tracer(tracer: Tracer | None) -> None:
+    """Install the tracer (None: tracing off)."""
+    global _tracer
+    _tracer = tracer or NullTracer()
+
+
+def traced(name: str) -> Callable:
+    """Decorator for coroutine functions: run each call in a span `name`."""
+    def decorate(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        async def run(*args: Any, **kwargs: Any) -> Any:
+            tracer = _tracer
+            if not tracer.enabled:
+                return await fn(*args, **kwargs)
+            with tracer.span(name):
+                return await fn(*args, **kwargs)
+        return run
+    return decorate
@@ -0,0 +1,400 @@
+"""Waitlist behind `tools.create_waitlist_entry`, and the matcher that offers
+freed capacity to it.
+
+Entries are kept in SQLite. Each one stores the days it covers as a range
+of minutes plus a window of start times within the day ("next week,
+mornings"); waiting entries are indexed by (service, first minute), so
+finding who could take a slot is a range scan over one service rather than
+a scan of the whole list.
+
+`WaitlistMatcher` listens to `agent.reservation` for slots that are given
+back (cancelled bookings, released or expired holds) and to
+`capacity_added` for new working hours. Events are collected for
+`interval` seconds and matched together: per service, one indexed query
+covers all freed times of the batch, entries are served first come first
+served, and each match holds the slot for the customer before they are
+notified. Without a `notify` callback nobody would hear about a match, so
+the matcher doesn't run at all.
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import datetime as dt
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from typing import Any
+
+from agent.availability import (
+    DAY,
+    AvailabilityEngine,
+    get_engine,
+    parse_date_range,
+    parse_time_preference,
+    to_minutes,
+)
+from agent.reservation import Reservations, get_reservations
+
+log = logging.getLogger(__name__)
+
+
+def parse_window(text: str | None, today: dt.date,
+                 default_days: int = 28) -> tuple[int, int, int, int]:
+    """(first minute, end minute, earliest start, latest start) of a
+    preferred window such as "next week mornings"; the last two are minutes
+    after midnight. No date means the next `default_days` days."""
+    first, last = parse_date_range(text, today, default_days)
+    day_start, day_end = parse_time_preference(text)
+    return first.toordinal() * DAY, (last.toordinal() + 1) * DAY, day_start, day_end
+
+
+@dataclass(slots=True)
+class WaitlistEntry:
+    entry_id: str
+    service_id: str
+    start: int
+    end: int
+    day_start: int
+    day_end: int
+    customer: dict[str, Any]
+    contact: str | None = None
+    branch: str | None = None
+    status: str = "waiting"
+    slot_id: str | None = None
+    hold_id: str | None = None
+
+    def wants(self, slot_id: str, branch: str, start: int) -> bool:
+        # not the slot whose hold they let lapse
+        return (slot_id != self.slot_id and self.start <= start < self.end
+                and self.day_start <= start % DAY < self.day_end
+                and self.branch in (None, branch))
+
+
+@dataclass(slots=True)
+class Notification:
+    entry: WaitlistEntry
+    slot: dict[str, Any]
+    hold_id: str
+
+
+_COLUMNS = ("entry_id, service_id, start, end, day_start, day_end, customer, contact,"
+            " branch, status, slot_id, hold_id")
+
+
+class WaitlistStore:
+    """Waitlist entries in a SQLite file, shared by worker processes.
+
+    `status` goes from "waiting" to "notified" (a slot was held for the
+    customer) or "cancelled". A notified entry is "booked" once the hold is
+    committed (`booked`) and goes back to waiting if it lapses first
+    (`requeue`). ":memory:" keeps entries in this process only, and
+    only until it exits.
+    """
+
+    def __init__(self, path: str = "waitlist.sqlite3"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " entry_id TEXT PRIMARY KEY, service_id TEXT NOT NULL,"
+            " start INTEGER NOT NULL, end INTEGER NOT NULL,"
+            " day_start INTEGER NOT NULL, day_end INTEGER NOT NULL,"
+            " customer TEXT NOT NULL, contact TEXT, branch TEXT,"
+            " status TEXT NOT NULL DEFAULT 'waiting', slot_id TEXT, hold_id TEXT,"
+            " created REAL NOT NULL, notified REAL)")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS entries_waiting ON entries (service_id, start)"
+            " WHERE status = 'waiting'")
+
+    @staticmethod
+    def _entry(row: tuple[Any, ...]) -> WaitlistEntry:
+        return WaitlistEntry(row[0], row[1], row[2], row[3], row[4], row[5],
+                             json.loads(row[6]), row[7], row[8], row[9], row[10], row[11])
+
+    def _add(self, entry: WaitlistEntry) -> None:
+        with self._lock:
+            self._conn.execute(
+                f"INSERT INTO entries ({_COLUMNS}, created) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (entry.entry_id, entry.service_id, entry.start, entry.end, entry.day_start,
+                 entry.day_end, json.dumps(entry.customer), entry.contact, entry.branch,
+                 entry.status, entry.slot_id, entry.hold_id, time.time()))
+
+    async def add(self, service_id: str, customer: dict[str, Any],
+                  window: tuple[int, int, int, int], contact: str | None = None,
+                  branch: str | None = None) -> WaitlistEntry:
+        """Put a customer on the waitlist; `window` as from `parse_window`."""
+        entry = WaitlistEntry(f"wait_{uuid.uuid4().hex[:8]}", service_id, *window,
+                              customer=customer, contact=contact, branch=branch)
+        await asyncio.to_thread(self._add, entry)
+        return entry
+
+    def get(self, entry_id: str) -> WaitlistEntry | None:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {_COLUMNS} FROM entries WHERE entry_id = ?", (entry_id,)).fetchone()
+        return self._entry(row) if row else None
+
+    def waiting(self, service_id: str, first: int, last: int,
+                after: int = 0, limit: int = 64) -> list[tuple[int, WaitlistEntry]]:
+        """Up to `limit` waiting entries for the service whose days overlap
+        the minutes [first, last], oldest first, each with the rowid to page
+        on with `after`."""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT rowid, {_COLUMNS} FROM entries WHERE service_id = ?"
+                " AND status = 'waiting' AND start <= ? AND end > ? AND rowid > ?"
+                " ORDER BY rowid LIMIT ?",
+                (service_id, last, first, after, limit)).fetchall()
+        return [(row[0], self._entry(row[1:])) for row in rows]
+
+    def notified(self, entry_id: str, slot_id: str, hold_id: str) -> bool:
+        """Record the slot held for a waiting entry; False if it was no
+        longer waiting."""
+        with self._lock:
+            return self._conn.execute(
+                "UPDATE entries SET status = 'notified', slot_id = ?, hold_id = ?, notified = ?"
+                " WHERE entry_id = ? AND status = 'waiting'",
+                (slot_id, hold_id, time.time(), entry_id)).rowcount > 0
+
+    def requeue(self, notified_before: float) -> int:
+        """Put entries notified before this time that didn't book back to
+        waiting; how many there were."""
+        with self._lock:
+            return self._conn.execute(
+                "UPDATE entries SET status = 'waiting', hold_id = NULL, notified = NULL"
+                " WHERE status = 'notified' AND notified < ?", (notified_before,)).rowcount
+
+    async def booked(self, hold_id: str) -> bool:
+        """A hold was committed: if it was held for a notified entry, the
+        customer took the slot. Whether it was one of ours."""
+        def booked() -> bool:
+            with self._lock:
+                return self._conn.execute(
+                    "UPDATE entries SET status = 'booked' WHERE hold_id = ?"
+                    " AND status = 'notified'", (hold_id,)).rowcount > 0
+        return await asyncio.to_thread(booked)
+
+    async def cancel(self, entry_id: str) -> bool:
+        def cancel() -> bool:
+            with self._lock:
+                return self._conn.execute(
+                    "UPDATE entries SET status = 'cancelled' WHERE entry_id = ?"
+                    " AND status = 'waiting'", (entry_id,)).rowcount > 0
+        return await asyncio.to_thread(cancel)
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, count(*) FROM entries GROUP BY status").fetchall()
+        return dict(rows)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class WaitlistMatcher:
+    """Offers freed capacity to waiting customers, in batches.
+
+    Each match holds the slot for `hold_ttl` seconds under the entry id and
+    is passed to `notify` (e.g. to send a text); without it nothing is
+    matched. If the customer doesn't book in time, the hold expires, the
+    slot goes to the next entry and the customer waits for another one.
+    Lapsed holds are looked for at least every `sweep_interval` seconds.
+    """
+
+    def __init__(self, store: WaitlistStore, reservations: Reservations | None = None,
+                 engine: AvailabilityEngine | None = None,
+                 notify: Callable[[Notification], Awaitable[None]] | None = None,
+                 interval: float = 0.5, batch_size: int = 64, hold_ttl: float = 900.0,
+                 sweep_interval: float = 60.0):
+        self.store = store
+        self.reservations = reservations or get_reservations()
+        self._engine = engine
+        self.notify = notify
+        self.interval = interval
+        self.batch_size = batch_size
+        self.hold_ttl = hold_ttl
+        self.sweep_interval = sweep_interval
+        # service id -> slot id -> how many times it was freed
+        self._pending: defaultdict[str, Counter[str]] = defaultdict(Counter)
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self.batches = 0
+        self.matched = 0
+        self.requeued = 0
+        self._warned = False
+
+    @property
+    def engine(self) -> AvailabilityEngine:
+        return self._engine or get_engine()
+
+    def freed(self, slot_id: str) -> None:
+        """A slot became free; cheap, matching happens in the next batch."""
+        self._pending[slot_id.split("@", 1)[0]][slot_id] += 1
+        self._wakeup.set()
+
+    def capacity_added(self, service_id: str, branch: str,
+                       start: dt.datetime, end: dt.datetime) -> None:
+        """New working hours (an extra technician or shift) for a service."""
+        engine = self.engine
+        first, last = to_minutes(start), to_minutes(end)
+        for at in range(first + -first % engine.step, last, engine.step):
+            self.freed(engine.make_slot_id(service_id, branch, at))
+
+    def start(self) -> None:
+        """Start matching in the background of the running loop (idempotent).
+        Does nothing without a `notify` callback."""
+        if self.notify is None:
+            if not self._warned:
+                log.warning("waitlist matcher has no notify callback, not matching")
+                self._warned = True
+            return
+        if self._task is None or self._task.done():
+            if self.freed not in self.reservations.listeners:
+                self.reservations.listeners.append(self.freed)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop listening and match what is still pending."""
+        if self.freed in self.reservations.listeners:
+            self.reservations.listeners.remove(self.freed)
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.run_once()
+
+    async def _run(self) -> None:
+        while True:
+            # lapsed holds are looked for even when nothing is freed
+            with contextlib.suppress(TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), self.sweep_interval)
+            # let a burst of cancellations arrive before matching them
+            await asyncio.sleep(self.interval)
+            await self.run_once()
+
+    async def run_once(self) -> list[Notification]:
+        """Match everything freed since the last batch, once the customers
+        whose holds lapsed are waiting again."""
+        if self.notify is None:
+            # nobody to tell
+            self._pending.clear()
+            return []
+        # expired holds free their slots (through `freed`)
+        await self.reservations.sweep()
+        self.requeued += await asyncio.to_thread(self.store.requeue,
+                                                 time.time() - self.hold_ttl)
+        self._wakeup.clear()
+        pending, self._pending = self._pending, defaultdict(Counter)
+        notifications: list[Notification] = []
+        for service_id, freed in pending.items():
+            notifications += await self._match(service_id, freed)
+        if pending:
+            self.batches += 1
+        self.matched += len(notifications)
+        for notification in notifications:
+            await self.notify(notification)
+        return notifications
+
+    async def _match(self, service_id: str, freed: Counter[str]) -> list[Notification]:
+        engine = self.engine
+        earliest = to_minutes(engine.now())
+        # (start, branch, slot id) of future slots, soonest first
+        slots = sorted((start, branch, slot_id) for slot_id in freed
+                       for _, branch, start in [engine.parse_slot_id(slot_id)]
+                       if start >= earliest)
+        if not slots:
+            return []
+        left = {slot_id: freed[slot_id] for _, _, slot_id in slots}
+        notifications: list[Notification] = []
+        after = 0
+        while left:
+            page = await asyncio.to_thread(self.store.waiting, service_id, slots[0][0],
+                                           slots[-1][0], after, self.batch_size)
+            for rowid, entry in page:
+                after = rowid
+                if notification := await self._offer(entry, slots, left):
+                    notifications.append(notification)
+                if not left:
+                    break
+            if len(page) < self.batch_size:
+                break
+        return notifications
+
+    async def _offer(self, entry: WaitlistEntry, slots: list[tuple[int, str, str]],
+                     left: dict[str, int]) -> Notification | None:
+        # hold the first slot still `left` that the entry wants, for them
+        for start, branch, slot_id in slots:
+            if slot_id not in left or not entry.wants(slot_id, branch, start):
+                continue
+            held = await self.reservations.hold(entry.entry_id, [slot_id], ttl=self.hold_ttl)
+            if not held:
+                # taken again before we got to it
+                del left[slot_id]
+                continue
+            hold_id = held[slot_id]
+            if not await asyncio.to_thread(self.store.notified, entry.entry_id,
+                                           slot_id, hold_id):
+                await self.reservations.release([hold_id])
+                return None
+            left[slot_id] -= 1
+            if not left[slot_id]:
+                del left[slot_id]
+            entry.status, entry.slot_id, entry.hold_id = "notified", slot_id, hold_id
+            return Notification(entry, self.engine.describe(slot_id), hold_id)
+        return None
+
+    def stats(self) -> dict[str, int]:
+        return {"batches": self.batches, "matched": self.matched, "requeued": self.requeued,
+                **self.store.stats()}
+
+
+_waitlist: WaitlistStore | None = None
+_matcher: WaitlistMatcher | None = None
+
+
+def get_waitlist() -> WaitlistStore:
+    """The store used by `agent.tools`: in memory unless `set_waitlist`
+    installed a file-backed one. The in-memory store loses its entries when
+    the process exits and isn't shared with other workers: servers should
+    install one with a path (`server.py --waitlist`)."""
+    global _waitlist
+    if _waitlist is None:
+        _waitlist = WaitlistStore(":memory:")
+    return _waitlist
+
+
+def set_waitlist(store: WaitlistStore | None) -> None:
+    global _waitlist, _matcher
+    _waitlist = store
+    _matcher = None
+
+
+def get_matcher() -> WaitlistMatcher:
+    """The matcher for `get_waitlist()`, created on first use. It has no
+    `notify` callback, so it doesn't match: install one that can reach
+    customers with `set_matcher`."""
+    global _matcher
+    if _matcher is None:
+        _matcher = WaitlistMatcher(get_waitlist())
+    return _matcher
+
+
+def set_matcher(matcher: WaitlistMatcher | None) -> None:
+    global _matcher
+    _matcher = matcher
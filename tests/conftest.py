@@ -0,0 +1,48 @@
+import datetime as dt
+
+import pytest
+
+from agent.availability import AvailabilityEngine, set_engine
+from agent.backends import ReplayBackend
+from agent.core import Agent, StateHandler
+from agent.history import HistoryPolicy
+from agent.llm import LlmClient
+from agent.loadtest import ROUTE_RESPONSES
+from agent.reservation import MemoryReservations, set_reservations
+from agent.tokens import estimate_tokens
+from agent.tracing import set_tracer
+from agent.waitlist import WaitlistStore, set_matcher, set_waitlist
+
+# a Monday morning, so "tomorrow" is a working day
+MONDAY = dt.datetime(2030, 1, 7, 7, 0)
+
+
+@pytest.fixture(autouse=True)
+def fresh_globals():
+    """Each test gets its own calendars, reservations, waitlist and no tracer."""
+    set_engine(AvailabilityEngine.load(now=lambda: MONDAY))
+    set_reservations(MemoryReservations())
+    set_waitlist(WaitlistStore(":memory:"))
+    set_matcher(None)
+    set_tracer(None)
+    yield
+    set_engine(None)
+    set_reservations(None)
+    set_waitlist(None)
+    set_matcher(None)
+    set_tracer(None)
+
+
+@pytest.fixture
+def replay_llm() -> LlmClient:
+    return LlmClient(model_name="replay", backend=ReplayBackend(routes=ROUTE_RESPONSES))
+
+
+@pytest.fixture
+def make_agent(replay_llm):
+    """Agents on the replay backend; keyword arguments go to StateHandler."""
+    def make(llm: LlmClient = replay_llm, **handler_options) -> Agent:
+        # no tokenizer download in tests
+        handler_options.setdefault("history", HistoryPolicy(counter=estimate_tokens))
+        return Agent(llm, handler=StateHandler(llm, **handler_options))
+    return make
@@ -0,0 +1,76 @@
+import asyncio
+
+from agent.backends import ReplayBackend
+from agent.core import Agent
+from agent.data_model import StateName
+from agent.demo import HAPPY_PATH
+
+
+async def stream_turn(agent: Agent, text: str, ctx=None):
+    stream = agent.process_stream(text, ctx)
+    chunks = [chunk async for chunk in stream]
+    return chunks, stream
+
+
+def test_stream_yields_the_reply_in_chunks(make_agent):
+    agent = make_agent()
+
+    async def main():
+        chunks, stream = await stream_turn(agent, "")
+        assert len(chunks) > 1
+        assert "".join(chunks) == stream.reply == ReplayBackend.GREETING
+        assert stream.context.state == StateName.LISTEN
+        # an LLM-phrased question streams too
+        chunks, stream = await stream_turn(agent, HAPPY_PATH[0], stream.context)
+        assert len(chunks) > 1 and "".join(chunks) == stream.reply
+        return stream.context
+
+    ctx = asyncio.run(main())
+    assert ctx.transcript[-1][0] == "assistant"
+    assert ctx.slots.customer_name == "Steven Manley"
+
+
+def test_fixed_replies_are_one_chunk(make_agent):
+    agent = make_agent(question_mode="template")
+
+    async def main():
+        ctx, _ = await agent.process("")
+        chunks, stream = await stream_turn(agent, HAPPY_PATH[0], ctx)
+        return chunks, stream
+
+    chunks, stream = asyncio.run(main())
+    assert chunks == [stream.reply]
+
+
+def test_stream_matches_process(make_agent):
+    async def run(streamed: bool):
+        agent = make_agent()
+        ctx, replies = None, []
+        for text in ["", *HAPPY_PATH[:4]]:
+            if streamed:
+                _, stream = await stream_turn(agent, text, ctx)
+                ctx, reply = stream.context, stream.reply
+            else:
+                ctx, reply = await agent.process(text, ctx)
+            replies.append(reply)
+        return ctx, replies
+
+    plain, streamed = asyncio.run(run(False)), asyncio.run(run(True))
+    assert plain[1] == streamed[1]
+    assert plain[0].slots == streamed[0].slots
+
+
+def test_abandoned_stream_commits_nothing(make_agent):
+    agent = make_agent()
+
+    async def main():
+        ctx, _ = await agent.process("")
+        stream = agent.process_stream(HAPPY_PATH[0], ctx)
+        async for _ in stream:
+            break
+        await asyncio.sleep(0)
+        return ctx, stream
+
+    ctx, stream = asyncio.run(main())
+    assert stream.context is None
+    assert len(ctx.transcript) == 1 and ctx.slots.customer_name is None
@@ -0,0 +1,89 @@
+import datetime as dt
+
+import pytest
+
+from agent.availability import (
+    Calendar,
+    get_engine,
+    parse_date_range,
+    parse_time_preference,
+)
+
+MONDAY = dt.date(2030, 1, 7)
+
+
+def days(n: int) -> dt.date:
+    return MONDAY + dt.timedelta(days=n)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("tomorrow", (days(1), days(1))),
+    ("day after tomorrow", (days(2), days(2))),
+    ("next friday", (days(4), days(4))),
+    ("next monday", (days(7), days(7))),
+    ("this weekend", (days(5), days(6))),
+    ("next week", (days(7), days(13))),
+    ("2030-01-20", (days(13), days(13))),
+    ("1/9", (days(2), days(2))),
+    ("Jan 10th", (days(3), days(3))),
+    ("tues", (days(1), days(1))),
+    ("thurs morning", (days(3), days(3))),
+    ("Sept 3", (dt.date(2030, 9, 3), dt.date(2030, 9, 3))),
+    ("12th of feb", (dt.date(2030, 2, 12), dt.date(2030, 2, 12))),
+    # not weekday or month names
+    ("next month", (MONDAY, days(6))),
+    ("a sunny afternoon", (MONDAY, days(6))),
+    ("after the wedding", (MONDAY, days(6))),
+    ("the march of time", (MONDAY, days(6))),
+    ("whenever", (MONDAY, days(6))),
+    (None, (MONDAY, days(6))),
+])
+def test_parse_date_range(text, expected):
+    assert parse_date_range(text, MONDAY) == expected
+
+
+def test_parse_time_preference():
+    assert parse_time_preference("AM") == parse_time_preference("a.m.") == (0, 720)
+    assert parse_time_preference("I am free") == (0, 24 * 60)
+    assert parse_time_preference("PM") == parse_time_preference("afternoon") == (720, 24 * 60)
+    assert parse_time_preference("10am") == (540, 661)
+    # after a date, as in a waitlist window
+    assert parse_time_preference("tomorrow AM") == parse_time_preference("next week a.m.") == (0, 720)
+    assert parse_time_preference("friday pm") == (720, 24 * 60)
+    assert parse_time_preference("am I free friday") == (0, 24 * 60)
+
+
+def test_calendar_rejects_overlaps():
+    calendar = Calendar()
+    assert calendar.book(60, 120) and calendar.book(120, 180)
+    assert not calendar.book(90, 150) and not calendar.book(0, 61)
+    assert calendar.release(60) and not calendar.release(60)
+    assert calendar.book(0, 60)
+
+
+def test_find_slots_respects_window_lead_and_spread():
+    engine = get_engine()
+    slots = engine.find_slots("plumb_000", "this week", "AM")
+    assert len(slots) == 6
+    starts = [dt.datetime.fromisoformat(s["start_iso"]) for s in slots]
+    # at least two hours from 07:00, mornings only, two a day
+    assert all(s >= dt.datetime(2030, 1, 7, 9) and s.hour < 12 for s in starts)
+    assert max(sum(s.date() == d.date() for s in starts) for d in starts) == 2
+    # nothing on Sundays
+    assert engine.find_slots("plumb_000", "sunday") == []
+
+
+def test_booking_fills_a_slot_and_release_frees_it():
+    engine = get_engine()
+    slot = engine.find_slots("plumb_000", "tomorrow", "10am", limit=1)[0]
+    _, _, staff = engine.candidates(slot["slot_id"])
+    booked = [engine.book(slot["slot_id"]) for _ in staff]
+    assert all(booked) and len({t.id for t in booked}) == len(staff)
+    assert engine.book(slot["slot_id"]) is None
+    assert slot not in engine.find_slots("plumb_000", "tomorrow", "10am")
+    assert engine.release(slot["slot_id"], booked[0].id)
+    assert engine.book(slot["slot_id"]) is booked[0]
+
+
+def test_unknown_slot_ids_are_not_booked():
+    assert get_engine().book("nonsense") is None
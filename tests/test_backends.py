@@ -0,0 +1,120 @@
+import asyncio
+import importlib
+import json
+import os
+import subprocess
+import sys
+import types
+
+import pytest
+
+from agent.backends import (
+    BACKENDS,
+    Latency,
+    RecordingBackend,
+    ReplayBackend,
+    create_backend,
+    prompt_key,
+    register_backend,
+)
+from agent.coldstart import HEAVY
+from agent.llm import LlmClient
+from agent.prompts import (
+    ANYTHING_ELSE_PROMPT,
+    GREETING_PROMPT,
+    LISTEN_AND_ROUTE_PROMPT,
+    PromptBuilder,
+)
+
+ROUTES = {"I need a plumber": {"intent": "book", "slots": {"service_requested": "plumb"}}}
+
+
+def prompt(task: str, utterance=None):
+    return PromptBuilder().build(task, user_text=utterance)
+
+
+def test_replay_routes_known_utterances():
+    backend = ReplayBackend(routes=ROUTES)
+    assert json.loads(backend.invoke(prompt(LISTEN_AND_ROUTE_PROMPT, "I need a plumber"))) \
+        == ROUTES["I need a plumber"]
+    assert json.loads(backend.invoke(prompt(LISTEN_AND_ROUTE_PROMPT, "what?")))["intent"] == "other"
+
+
+def test_replay_canned_answers():
+    backend = ReplayBackend()
+    assert backend.invoke(prompt(GREETING_PROMPT)) == ReplayBackend.GREETING
+    assert json.loads(backend.invoke(prompt(ANYTHING_ELSE_PROMPT, "nope")))["answer"] == "no"
+    assert json.loads(backend.invoke(prompt(ANYTHING_ELSE_PROMPT, "yes please")))["answer"] == "yes"
+
+
+def test_replay_streams_words_and_counts_calls():
+    backend = ReplayBackend()
+
+    async def main():
+        return [chunk async for chunk in backend.astream(prompt(GREETING_PROMPT))]
+
+    chunks = asyncio.run(main())
+    assert "".join(chunks) == ReplayBackend.GREETING and len(chunks) > 1
+    assert backend.calls == 1
+
+
+def test_latency_is_deterministic_per_seed():
+    import random
+    latency = Latency.lognormal(0.05, 0.5)
+    first = [latency(random.Random(7)) for _ in range(3)]
+    assert first == [latency(random.Random(7)) for _ in range(3)]
+    assert Latency.fixed(0.2)(random.Random()) == 0.2
+    assert 0.1 <= Latency.uniform(0.1, 0.2)(random.Random()) <= 0.2
+
+
+def test_recorded_completions_replay_exactly(tmp_path):
+    recorder = RecordingBackend(ReplayBackend(routes=ROUTES))
+    messages = prompt(LISTEN_AND_ROUTE_PROMPT, "I need a plumber")
+    answer = recorder.invoke(messages)
+    path = str(tmp_path / "recorded.json")
+    recorder.save(path)
+    replay = ReplayBackend.load(path)
+    assert prompt_key(messages) in replay.recorded
+    assert replay.invoke(messages) == answer
+
+
+def test_backends_are_created_by_name():
+    assert isinstance(create_backend("replay"), ReplayBackend)
+    assert isinstance(LlmClient(backend="replay").backend, ReplayBackend)
+    with pytest.raises(ValueError, match="unknown backend 'nope'"):
+        create_backend("nope")
+
+
+def test_registered_backend_is_imported_when_first_created(monkeypatch):
+    imported = []
+
+    class Vendor:
+        @staticmethod
+        def create(**kwargs):
+            return ReplayBackend(**kwargs)
+
+    def import_module(name):
+        imported.append(name)
+        return types.SimpleNamespace(Vendor=Vendor)
+
+    monkeypatch.setattr(importlib, "import_module", import_module)
+    monkeypatch.setitem(BACKENDS, "vendor", "")
+    register_backend("vendor", "vendor_sdk:Vendor.create")
+    assert imported == []
+    backend = create_backend("vendor", routes=ROUTES)
+    assert isinstance(backend, ReplayBackend) and backend.routes == ROUTES
+    assert imported == ["vendor_sdk"]
+
+
+def test_importing_the_agent_loads_no_model_sdk():
+    probe = ("import sys; from agent.core import Agent; from agent.llm import LlmClient; "
+             "Agent(LlmClient()); "
+             f"print([m for m in {HEAVY!r} if m in sys.modules])")
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)}
+    out = subprocess.run([sys.executable, "-c", probe], env=env, check=True,
+                         capture_output=True, text=True).stdout
+    assert out.strip() == "[]"
+
+
+def test_warmup_is_a_no_op_by_default():
+    assert asyncio.run(ReplayBackend().warmup()) is None
@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+from agent.batching import MicroBatcher
+
+
+class FakeLlm:
+    def __init__(self, delay=0.0, short=False):
+        self.delay = delay
+        self.short = short
+        self.batches = []
+
+    async def abatch(self, prompts, schema=None):
+        self.batches.append(list(prompts))
+        await asyncio.sleep(self.delay)
+        results = [f"re: {p}" for p in prompts]
+        return results[:-1] if self.short else results
+
+
+def test_requests_in_one_window_share_a_batch():
+    llm = FakeLlm()
+    batcher = MicroBatcher(llm, window=0.01)
+
+    async def run():
+        return await asyncio.gather(*(batcher.submit(f"q{i}") for i in range(3)))
+
+    assert asyncio.run(run()) == ["re: q0", "re: q1", "re: q2"]
+    assert llm.batches == [["q0", "q1", "q2"]]
+    assert batcher.stats()["mean_batch"] == 3
+
+
+def test_batch_task_is_kept_until_done():
+    batcher = MicroBatcher(FakeLlm(delay=0.05), window=0.0, max_batch=1)
+
+    async def run():
+        waiting = asyncio.ensure_future(batcher.submit("q"))
+        await asyncio.sleep(0.01)
+        assert len(batcher._tasks) == 1
+        assert await waiting == "re: q"
+        await asyncio.sleep(0)
+        assert not batcher._tasks
+
+    asyncio.run(run())
+
+
+def test_short_batch_fails_every_caller():
+    batcher = MicroBatcher(FakeLlm(short=True), window=0.01)
+
+    async def run():
+        return await asyncio.gather(*(batcher.submit(f"q{i}") for i in range(2)),
+                                    return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+def test_cancelled_batch_fails_its_callers():
+    batcher = MicroBatcher(FakeLlm(delay=10), window=0.0, max_batch=1)
+
+    async def run():
+        waiting = asyncio.ensure_future(batcher.submit("q"))
+        await asyncio.sleep(0.01)
+        for task in batcher._tasks:
+            task.cancel()
+        with pytest.raises(RuntimeError, match="not sent"):
+            await waiting
+
+    asyncio.run(run())
@@ -0,0 +1,50 @@
+from agent.cache import ResponseCache
+
+
+def test_key_ignores_case_spacing_and_punctuation():
+    key = ResponseCache.key
+    assert key([("user", "Hello  there!")], model="m") == key("hello there", model="m")
+    assert key("hello", model="m") != key("hello", model="other")
+    assert key([{"role": "user", "content": "Hi"}]) == key([("user", "hi")])
+
+
+def test_hit_miss_and_stats():
+    cache = ResponseCache()
+    assert cache.get("k") is None
+    cache.put("k", "hello")
+    assert cache.get("k") == "hello"
+    assert cache.stats() == {"entries": 1, "hits": 1, "misses": 1,
+                             "evictions": 0, "hit_rate": 0.5}
+
+
+def test_lru_eviction():
+    cache = ResponseCache(max_entries=2)
+    cache.put("a", "1")
+    cache.put("b", "2")
+    cache.get("a")
+    cache.put("c", "3")
+    assert cache.get("b") is None
+    assert cache.get("a") == "1" and cache.get("c") == "3"
+    assert cache.evictions == 1
+
+
+def test_expired_entries_miss(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("agent.cache.time.monotonic", lambda: now[0])
+    cache = ResponseCache(ttl=10)
+    cache.put("k", "hello")
+    now[0] += 11
+    assert cache.get("k") is None
+    assert len(cache) == 0
+
+
+def test_variants_fill_before_hitting():
+    cache = ResponseCache(variants=3, seed=1)
+    for text in ["hi", "hello"]:
+        assert cache.get("k") is None
+        cache.put("k", text)
+    # two of three stored: a miss, unless a partial pool will do
+    assert cache.get("k") is None
+    assert cache.get("k", partial=True) in {"hi", "hello"}
+    cache.put("k", "hey")
+    assert {cache.get("k") for _ in range(50)} == {"hi", "hello", "hey"}
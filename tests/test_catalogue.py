@@ -0,0 +1,49 @@
+import pytest
+
+from agent.catalogue import ServiceCatalogue, edit_distance, get_catalogue, terms
+
+
+@pytest.fixture
+def catalogue() -> ServiceCatalogue:
+    return get_catalogue()
+
+
+def test_terms_drop_stopwords_stem_and_join_hyphens():
+    assert terms("I need a re-pipe") == terms("repipes")
+    assert terms("clogged drains") == ["clog", "drain"]
+
+
+def test_edit_distance_is_bounded():
+    assert edit_distance("plumbng", "plumb", 2) == 2
+    assert edit_distance("abc", "xyzxyz", 1) == 2
+
+
+@pytest.mark.parametrize("query, key", [
+    ("re-piping", "re-pipes"),
+    ("water heater installation", "install"),
+    ("my kitchen drain is clogged", "clean"),
+    ("plumbng", "plumb"),
+    ("hydro jeting", "jet"),
+    ("leaking pipe in the garage", "repair"),
+])
+def test_check_finds_the_service(catalogue, query, key):
+    found = catalogue.check(query)
+    assert found["exists"] and found["service"] == key
+
+
+@pytest.mark.parametrize("query", ["roof repair", "fix my electrical outlet", "paint job"])
+def test_other_trades_are_not_plumbing(catalogue, query):
+    found = catalogue.check(query)
+    assert not found["exists"]
+    # nothing matched: every service is suggested
+    assert len(found["suggestions"]) == len(catalogue.services)
+
+
+def test_ambiguous_query_is_only_suggested(catalogue):
+    found = catalogue.check("toilet")
+    assert not found["exists"] and len(found["suggestions"]) > 1
+
+
+def test_branch_restricts_services(catalogue):
+    assert catalogue.check("hydro jetting", branch="main")["exists"]
+    assert not catalogue.check("hydro jetting", branch="south")["exists"]
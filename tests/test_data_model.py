@@ -0,0 +1,65 @@
+import pytest
+
+from agent.data_model import AppendLog, SessionContext, StateName, TurnDelta
+
+
+def test_append_log_forks_share_storage_until_they_diverge():
+    log = AppendLog([1, 2])
+    fork = log.fork()
+    fork.append(3)
+    assert log[:] == [1, 2] and fork[:] == [1, 2, 3]
+    # appending at the end of the shared list needs no copy
+    assert fork._items is log._items
+    log.append(4)
+    assert log[:] == [1, 2, 4] and fork[:] == [1, 2, 3]
+
+
+def test_append_log_indexing():
+    log = AppendLog("abc")
+    fork = log.fork()
+    log.append("d")
+    assert len(fork) == 3 and list(fork) == ["a", "b", "c"]
+    assert fork[-1] == "c" and fork[1:] == ["b", "c"]
+    with pytest.raises(IndexError):
+        fork[3]
+    assert fork == ["a", "b", "c"]
+
+
+def test_session_fork_is_isolated():
+    ctx = SessionContext(state=StateName.LISTEN)
+    ctx.transcript.append(("user", "hi"))
+    ctx.metadata["asked_slot"] = "customer_name"
+    fork = ctx.fork()
+    fork.slots.customer_name = "Ann"
+    fork.metadata["asked_slot"] = "contact_number"
+    fork.transcript.append(("assistant", "hello"))
+    fork.state = StateName.COLLECT_INFO
+    assert ctx.slots.customer_name is None
+    assert ctx.metadata["asked_slot"] == "customer_name"
+    assert ctx.transcript[:] == [("user", "hi")]
+    assert ctx.state == StateName.LISTEN
+    assert fork.call_id == ctx.call_id
+
+
+def test_session_transcript_accepts_lists():
+    ctx = SessionContext(transcript=[("user", "hi")])
+    assert isinstance(ctx.transcript, AppendLog) and len(ctx.transcript) == 1
+
+
+def test_diff_holds_only_what_the_turn_changed():
+    base = SessionContext(state=StateName.LISTEN)
+    base.transcript.append(("user", "hi"))
+    base.metadata.update(asked_slot="customer_name", availability={"slots": []})
+    ctx = base.fork()
+    ctx.state = StateName.COLLECT_INFO
+    ctx.slots.customer_name = "Ann"
+    ctx.metadata["asked_slot"] = "contact_number"
+    del ctx.metadata["availability"]
+    ctx.transcript.append(("assistant", "Your number?"))
+    delta = ctx.diff(base)
+    assert delta == TurnDelta(state=StateName.COLLECT_INFO, slots={"customer_name": "Ann"},
+                              metadata={"asked_slot": "contact_number"},
+                              removed=["availability"],
+                              transcript=[("assistant", "Your number?")])
+    assert base.apply(delta) == ctx
+    assert not ctx.fork().diff(ctx)
@@ -0,0 +1,67 @@
+import pytest
+
+from agent.extract import RuleExtractor
+
+extractor = RuleExtractor()
+
+
+def slots(text: str, expecting=None) -> dict[str, str]:
+    return {k: v for k, (v, _) in extractor.extract(text, expecting).slots.items()}
+
+
+@pytest.mark.parametrize("text", ["I am Steven Manley", "I am free tomorrow",
+                                  "I am at 12 Oak St", "Am I booked?"])
+def test_the_verb_am_is_not_a_morning(text):
+    assert "preferred_time" not in slots(text)
+
+
+@pytest.mark.parametrize("text, time", [
+    ("9am please", "AM"), ("around 10 a.m.", "AM"), ("a.m. works", "AM"),
+    ("in the morning", "AM"), ("3 pm", "PM"), ("after lunch", "PM"),
+    ("4PM tomorrow", "PM"),
+])
+def test_time_of_day(text, time):
+    assert slots(text)["preferred_time"] == time
+
+
+def test_morning_and_afternoon_is_no_preference():
+    assert "preferred_time" not in slots("morning or afternoon, either")
+
+
+def test_name_date_and_address():
+    assert slots("I am Steven Manley")["customer_name"] == "Steven Manley"
+    assert slots("I am free tomorrow") == {"preferred_date": "tomorrow"}
+    assert slots("I am at 12 Oak St")["contact_address"] == "12 Oak St"
+
+
+def test_phone_digits_are_not_a_house_number():
+    found = slots("call 555-123-4567")
+    assert found == {"contact_number": "555-123-4567"}
+
+
+@pytest.mark.parametrize("text, key", [
+    ("There is a new leak", "repair"),
+    ("I need a new kitchen faucet", "install"),
+    ("can you install a water heater", "install"),
+    ("my drain is clogged", "clean"),
+    ("whole house repipe", "re-pipes"),
+])
+def test_service_keywords(text, key):
+    assert slots(text, "service_requested")["service_requested"] == key
+
+
+def test_answer_slot_only_when_the_asked_slot_is_found():
+    assert extractor.answer_slot("555 123 4567", "contact_number") is not None
+    assert extractor.answer_slot("I am free tomorrow", "preferred_date_or_time") \
+        == {"preferred_date": "tomorrow"}
+    assert extractor.answer_slot("what number do you need?", "contact_number") is None
+    assert extractor.answer_slot("I am not sure", "preferred_date_or_time") is None
+
+
+def test_yes_no_and_alternatives():
+    assert extractor.yes_no("nope") == "no"
+    assert extractor.yes_no("yes please") == "yes"
+    assert extractor.yes_no("no, but can you also look at my sink?") is None
+    assert extractor.alternative_choice("put me on the waitlist") == "waitlist"
+    assert extractor.alternative_choice("any other day") == "widen"
+    assert extractor.alternative_choice("no thanks") == "no"
@@ -0,0 +1,97 @@
+import asyncio
+import sys
+import types
+
+from agent.data_model import SessionContext
+from agent.history import HistoryPolicy
+from agent.prompts import PromptBuilder
+from agent.tokens import TokenCounter, estimate_tokens
+
+
+class SummaryLlm:
+    def __init__(self):
+        self.calls = 0
+
+    async def arun(self, messages, **kwargs) -> str:
+        self.calls += 1
+        return f"summary {self.calls}"
+
+
+def words(text: str) -> int:
+    return len(text.split())
+
+
+def converse(policy: HistoryPolicy, turns: int, message: str) -> tuple[SessionContext, SummaryLlm]:
+    ctx, llm, prompts = SessionContext(), SummaryLlm(), PromptBuilder()
+
+    async def main():
+        for _ in range(turns):
+            ctx.transcript.append(("user", message))
+            await policy.fit(ctx, llm, prompts)
+            ctx.transcript.append(("assistant", message))
+
+    asyncio.run(main())
+    return ctx, llm
+
+
+def test_short_conversation_is_not_summarized():
+    ctx, llm = converse(HistoryPolicy(counter=words), 5, "hello there")
+    assert llm.calls == 0
+    assert ctx.summary_upto == 0
+
+
+def test_turn_window_folds_in_batches():
+    policy = HistoryPolicy(max_turns=4, fold_batch=4, counter=words)
+    ctx, llm = converse(policy, 20, "short answer")
+    # 40 entries: folded once every two turns, not every turn
+    assert 0 < llm.calls <= 20 // 2
+    assert len(PromptBuilder().history(ctx)) - ctx.summary_upto <= 4 + 4 + 1
+
+
+def test_token_budget_folds_in_batches():
+    policy = HistoryPolicy(max_tokens=1500, fold_batch=6, counter=words)
+    long_message = " ".join(["word"] * 200)
+    ctx, llm = converse(policy, 40, long_message)
+    # one summarization every three turns at most, instead of nearly every turn
+    assert llm.calls <= 40 // 3 + 1
+    asyncio.run(policy.fit(ctx, llm, PromptBuilder()))
+    kept = PromptBuilder().build("task", ctx)
+    assert sum(words(text) for _, text in kept[2:-1]) <= 1500
+
+
+def test_token_budget_keeps_latest_entry():
+    policy = HistoryPolicy(max_tokens=10, counter=words)
+    ctx, _ = converse(policy, 3, " ".join(["word"] * 50))
+    assert ctx.summary_upto == len(ctx.transcript) - 2
+
+
+def failing_tiktoken(calls: list[str]) -> types.ModuleType:
+    module = types.ModuleType("tiktoken")
+
+    def get_encoding(name: str):
+        calls.append(name)
+        raise ConnectionError("offline")
+
+    module.get_encoding = get_encoding
+    return module
+
+
+def test_token_counter_estimates_when_offline(monkeypatch):
+    calls: list[str] = []
+    monkeypatch.setitem(sys.modules, "tiktoken", failing_tiktoken(calls))
+    counter = TokenCounter()
+    assert asyncio.run(counter.load()) is False
+    assert counter("one two three four") == estimate_tokens("one two three four")
+    assert counter("again") == estimate_tokens("again")
+    # the download is attempted once, not on every count
+    assert calls == ["o200k_base"]
+
+
+def test_token_counter_never_loads_on_the_caller(monkeypatch):
+    calls: list[str] = []
+    monkeypatch.setitem(sys.modules, "tiktoken", failing_tiktoken(calls))
+    counter = TokenCounter()
+    # the first count starts loading in the background and estimates meanwhile
+    assert counter("abcdefgh") == 2
+    asyncio.run(counter.load())
+    assert calls == ["o200k_base"]
@@ -0,0 +1,93 @@
+import asyncio
+from collections.abc import AsyncIterator
+
+import pytest
+
+from agent.backends import LlmBackend, Prompt
+from agent.cache import ResponseCache
+from agent.llm import LlmClient
+
+
+class SlowBackend(LlmBackend):
+    def __init__(self, chunks=("Hello", " there"), delay=0.0):
+        self.chunks = list(chunks)
+        self.delay = delay
+        self.calls = 0
+        self.closed = False
+
+    def invoke(self, messages: Prompt) -> str:
+        self.calls += 1
+        return "".join(self.chunks)
+
+    async def ainvoke(self, messages: Prompt) -> str:
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return "".join(self.chunks)
+
+    async def astream(self, messages: Prompt) -> AsyncIterator[str]:
+        self.calls += 1
+        try:
+            for chunk in self.chunks:
+                await asyncio.sleep(self.delay)
+                yield chunk
+        finally:
+            self.closed = True
+
+
+async def collect(stream: AsyncIterator[str]) -> list[str]:
+    return [chunk async for chunk in stream]
+
+
+def test_arun_and_astream():
+    llm = LlmClient(backend=SlowBackend())
+    assert asyncio.run(llm.arun("hi")) == "Hello there"
+    assert asyncio.run(collect(llm.astream("hi"))) == ["Hello", " there"]
+
+
+def test_arun_times_out_with_client_default():
+    llm = LlmClient(backend=SlowBackend(delay=0.2), timeout=0.05)
+    with pytest.raises(TimeoutError):
+        asyncio.run(llm.arun("hi"))
+
+
+def test_per_call_none_disables_client_timeout():
+    llm = LlmClient(backend=SlowBackend(delay=0.1), timeout=0.01)
+    assert asyncio.run(llm.arun("hi", timeout=None)) == "Hello there"
+    assert asyncio.run(collect(llm.astream("hi", timeout=None))) == ["Hello", " there"]
+
+
+def test_astream_timeout_ignores_consumer_time():
+    backend = SlowBackend(chunks=["a", "b", "c"], delay=0.01)
+    llm = LlmClient(backend=backend, timeout=0.1)
+
+    async def slow_consumer() -> list[str]:
+        out = []
+        async for chunk in llm.astream("hi"):
+            out.append(chunk)
+            # e.g. speaking the chunk
+            await asyncio.sleep(0.08)
+        return out
+
+    assert asyncio.run(slow_consumer()) == ["a", "b", "c"]
+    assert backend.closed
+
+
+def test_astream_timeout_bounds_backend_waits():
+    llm = LlmClient(backend=SlowBackend(chunks=["a"] * 10, delay=0.03), timeout=0.1)
+    with pytest.raises(TimeoutError):
+        asyncio.run(collect(llm.astream("hi")))
+
+
+def test_cached_completion_is_shared_and_streamed_as_one_chunk():
+    backend = SlowBackend(delay=0.01)
+    llm = LlmClient(backend=backend, cache=ResponseCache())
+
+    async def main():
+        first = await asyncio.gather(*(llm.arun("Greet", cache=True) for _ in range(5)))
+        streamed = await collect(llm.astream("Greet", cache=True))
+        return first, streamed
+
+    first, streamed = asyncio.run(main())
+    assert first == ["Hello there"] * 5
+    assert streamed == ["Hello there"]
+    assert backend.calls == 1
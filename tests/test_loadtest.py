@@ -0,0 +1,41 @@
+import asyncio
+import logging
+
+from agent.backends import LlmBackend, Prompt
+from agent.llm import LlmClient
+from agent.loadtest import SCENARIOS, LoadReport, run_load
+
+
+class BrokenBackend(LlmBackend):
+    def invoke(self, messages: Prompt) -> str:
+        raise ConnectionError("model server down")
+
+    async def ainvoke(self, messages: Prompt) -> str:
+        raise ConnectionError("model server down")
+
+    async def astream(self, messages: Prompt):
+        raise ConnectionError("model server down")
+        yield ""
+
+
+def test_run_load_reports_turns(make_agent):
+    report = asyncio.run(run_load(make_agent(), calls=8, concurrency=4))
+    summary = report.summary()
+    assert summary["failed"] == 0 and summary["errors"] == {}
+    scripts = list(SCENARIOS.values())
+    assert report.turns == sum(len(scripts[i % len(scripts)]) + 1 for i in range(8))
+    assert summary["turn_p50_ms"] <= summary["turn_p99_ms"]
+
+
+def test_failures_are_counted_by_type_and_the_first_is_logged(make_agent, caplog):
+    agent = make_agent(LlmClient(backend=BrokenBackend()))
+    with caplog.at_level(logging.ERROR, logger="agent.loadtest"):
+        report = asyncio.run(run_load(agent, calls=5, concurrency=5))
+    assert report.failed == 5
+    assert report.summary()["errors"] == {"ConnectionError": 5}
+    logged = [r for r in caplog.records if r.name == "agent.loadtest"]
+    assert len(logged) == 1 and "model server down" in logged[0].exc_text
+
+
+def test_empty_report():
+    assert LoadReport().summary()["turns_per_s"] == 0.0
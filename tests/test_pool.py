@@ -0,0 +1,148 @@
+import asyncio
+
+import pytest
+
+from agent.backends import LlmBackend
+from agent.llm import LlmClient
+from agent.pool import CLOSED, OPEN, PoolBackend
+
+
+class Server(LlmBackend):
+    """Answers after `delay` seconds; never, if `delay` is None."""
+
+    def __init__(self, name, delay=0.0, fail=False):
+        self.name = name
+        self.delay = delay
+        self.fail = fail
+        self.calls = 0
+        self.cancelled = 0
+
+    def invoke(self, messages):
+        raise NotImplementedError
+
+    async def _wait(self):
+        self.calls += 1
+        try:
+            await asyncio.sleep(3600 if self.delay is None else self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.fail:
+            raise ConnectionError(self.name)
+
+    async def ainvoke(self, messages):
+        await self._wait()
+        return self.name
+
+    async def astream(self, messages):
+        await self._wait()
+        for chunk in (self.name, "!"):
+            yield chunk
+
+
+async def _collect(stream):
+    return "".join([chunk async for chunk in stream])
+
+
+def test_failed_request_fails_over():
+    broken, healthy = Server("broken", fail=True), Server("healthy")
+    pool = PoolBackend([broken, healthy], failures=1)
+    assert asyncio.run(pool.ainvoke("hi")) == "healthy"
+    assert pool.failovers == 1
+    assert pool.endpoints[0].state == OPEN
+
+
+def test_hung_endpoint_times_out_and_is_broken():
+    hung, healthy = Server("hung", delay=None), Server("healthy", delay=0.001)
+    pool = PoolBackend({"hung": hung, "healthy": healthy}, failures=2, timeout=0.05)
+
+    async def run():
+        return [await pool.ainvoke("hi") for _ in range(4)]
+
+    assert asyncio.run(run()) == ["healthy"] * 4
+    # the breaker opened after two timeouts: later requests skip it
+    assert hung.calls == 2 and hung.cancelled == 2
+    assert pool.timeouts == 2
+    stats = pool.stats()["endpoints"]["hung"]
+    assert stats["state"] == OPEN and stats["errors"] == 2 and stats["outstanding"] == 0
+
+
+def test_every_endpoint_hung_raises_timeout():
+    pool = PoolBackend([Server("a", delay=None), Server("b", delay=None)], timeout=0.02)
+    with pytest.raises(TimeoutError):
+        asyncio.run(pool.ainvoke("hi"))
+    assert all(e.outstanding == 0 for e in pool.endpoints)
+
+
+def test_hedge_reaches_another_endpoint_before_any_p95():
+    hung, healthy = Server("hung", delay=None), Server("healthy", delay=0.001)
+    pool = PoolBackend([hung, healthy], hedge=True, hedge_min=0.01, timeout=1.0)
+
+    assert asyncio.run(pool.ainvoke("hi")) == "healthy"
+    assert pool.hedged == 1 and pool.hedge_wins == 1
+    # beaten by a hedge, not timed out: not a failure
+    assert hung.cancelled == 1 and pool.endpoints[0].errors == 0
+
+
+def test_hedged_stream_closes_the_loser():
+    slow, fast = Server("slow", delay=0.2), Server("fast", delay=0.001)
+    pool = PoolBackend([slow, fast], hedge=True, hedge_min=0.01)
+
+    assert asyncio.run(_collect(pool.astream("hi"))) == "fast!"
+    assert all(e.outstanding == 0 for e in pool.endpoints)
+
+
+def test_hung_stream_fails_over_before_first_chunk():
+    hung, healthy = Server("hung", delay=None), Server("healthy")
+    pool = PoolBackend([hung, healthy], timeout=0.02)
+
+    assert asyncio.run(_collect(pool.astream("hi"))) == "healthy!"
+    assert pool.timeouts == 1 and pool.endpoints[0].errors == 1
+
+
+def test_p95_falls_back_until_enough_samples():
+    pool = PoolBackend([Server("a")])
+    endpoint = pool.endpoints[0]
+    assert endpoint.p95() is None
+    assert endpoint.p95(default=0.5) == 0.5
+    for _ in range(20):
+        endpoint.record(0.1)
+    assert endpoint.p95(default=0.5) == 0.1
+
+
+class Down(Server):
+    async def warmup(self):
+        raise ConnectionError(self.name)
+
+
+def test_warmup_opens_the_breaker_of_an_endpoint_that_is_down():
+    pool = PoolBackend([Down("down"), Server("up")])
+    asyncio.run(pool.warmup())
+    assert [e.state for e in pool.endpoints] == [OPEN, CLOSED]
+    assert asyncio.run(pool.ainvoke("hi")) == "up"
+
+
+def test_warmup_fails_when_every_endpoint_is_down():
+    pool = PoolBackend([Down("a"), Down("b")])
+    with pytest.raises(ConnectionError):
+        asyncio.run(pool.warmup())
+
+
+def test_client_deadline_leaves_room_to_fail_over(monkeypatch):
+    servers = {"hung": Server("hung", delay=None), "ok": Server("ok", delay=0.001)}
+
+    def from_urls(cls, base_urls, model_name, api_key, temperature=0.0,
+                  structured_output=None, **kwargs):
+        return cls({url: servers[url] for url in base_urls}, **kwargs)
+
+    monkeypatch.setattr(PoolBackend, "from_urls", classmethod(from_urls))
+    llm = LlmClient(endpoints=["hung", "ok"], timeout=0.2)
+    pool = llm.backend
+
+    async def run():
+        return [await llm.arun("hi") for _ in range(3)]
+
+    # each attempt on the hung server times out before the call's deadline
+    assert asyncio.run(run()) == ["ok"] * 3
+    assert pool.timeout == 0.1 and pool.timeouts == pool.failovers >= 1
+    assert pool.stats()["endpoints"]["hung"]["errors"] == pool.timeouts
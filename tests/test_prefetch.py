@@ -0,0 +1,118 @@
+import asyncio
+
+import pytest
+
+from agent import core
+from agent.core import ToolPrefetch
+from agent.data_model import SessionContext, Slots, StateName
+from agent.reservation import get_reservations
+
+
+def slots(service: str = "plumb", time: str = "AM") -> Slots:
+    return Slots(service_requested=service, preferred_time=time)
+
+
+def test_prefetch_starts_once_slots_allow_a_lookup():
+    async def main():
+        prefetch = ToolPrefetch()
+        prefetch.update(Slots(service_requested="plumb"))
+        assert not prefetch._tasks
+        prefetch.update(slots())
+        task, started = prefetch.availability("plumb", None, "AM")
+        assert started
+        return await task
+
+    assert asyncio.run(main())["slots"]
+
+
+def test_changed_slots_cancel_stale_lookups():
+    async def main():
+        prefetch = ToolPrefetch()
+        prefetch.update(slots(time="AM"))
+        stale, _ = prefetch.availability("plumb", None, "AM")
+        prefetch.update(slots(time="PM"))
+        await asyncio.sleep(0)
+        return stale
+
+    assert asyncio.run(main()).cancelled()
+
+
+def test_failed_lookup_is_retried(monkeypatch):
+    calls = []
+    real = core.check_service
+
+    async def flaky(name):
+        calls.append(name)
+        if len(calls) == 1:
+            raise ConnectionError("catalogue down")
+        return await real(name)
+
+    monkeypatch.setattr(core, "check_service", flaky)
+
+    async def main():
+        prefetch = ToolPrefetch()
+        failed, _ = prefetch.service("plumb")
+        with pytest.raises(ConnectionError):
+            await failed
+        task, reused = prefetch.service("plumb")
+        return reused, await task
+
+    reused, check = asyncio.run(main())
+    assert not reused and check["exists"]
+    assert calls == ["plumb", "plumb"]
+
+
+def test_forks_only_cancel_their_own_lookups(monkeypatch):
+    async def slow_check(name):
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(core, "check_service", slow_check)
+
+    async def main():
+        parent = ToolPrefetch()
+        parent.update(slots(time="AM"))
+        inherited, _ = parent.availability("plumb", None, "AM")
+        fork = parent.fork()
+        assert fork.availability("plumb", None, "AM") == (inherited, True)
+        # e.g. a speculative turn on other slot values
+        fork.update(slots(time="PM"))
+        own, _ = fork.availability("plumb", None, "PM")
+        fork.cancel()
+        await asyncio.sleep(0)
+        assert own.cancelled() and not inherited.cancelled()
+        assert parent.availability("plumb", None, "AM") == (inherited, True)
+        parent.cancel()
+        await asyncio.sleep(0)
+        assert inherited.cancelled()
+
+    asyncio.run(main())
+
+
+def test_session_forks_get_their_own_prefetch():
+    ctx = SessionContext()
+    assert ctx.fork().prefetch is None
+    ctx.prefetch = ToolPrefetch()
+    fork = ctx.fork()
+    assert isinstance(fork.prefetch, ToolPrefetch) and fork.prefetch is not ctx.prefetch
+
+
+def test_offer_looks_again_when_the_prefetched_slots_are_taken(make_agent):
+    handler = make_agent().handler
+
+    async def main():
+        ctx = SessionContext(slots=slots())
+        state, _ = await handler.get_availability(ctx)
+        assert state == StateName.OFFER_SLOTS
+        stale = [s["slot_id"] for s in ctx.metadata["availability"]["slots"]]
+        # other callers book what this call looked up turns ago, with
+        # every technician
+        for slot_id in stale:
+            while await get_reservations().book("other-call", slot_id):
+                pass
+        state, text = await handler.offer_slots(ctx)
+        return state, text, stale, ctx.metadata["presented_slots"]
+
+    state, text, stale, presented = asyncio.run(main())
+    assert state == StateName.CONFIRM_SCHEDULE and "Option 3" in text
+    assert len(presented) == 3 and not {s["slot_id"] for s in presented} & set(stale)
+    assert handler.stats["offer_slots.requery"] == 1
@@ -0,0 +1,51 @@
+from agent.data_model import SessionContext
+from agent.prompts import SYSTEM_PROMPT, PromptBuilder
+
+
+def test_build_orders_system_history_and_task():
+    ctx = SessionContext()
+    ctx.transcript.extend([("user", " hi "), ("assistant", "Hello!")])
+    messages = PromptBuilder().build("Do the task", ctx, "my utterance")
+    assert messages[0] == ("system", SYSTEM_PROMPT.strip())
+    assert messages[1:3] == [("user", "hi"), ("assistant", "Hello!")]
+    assert messages[-1] == ("user", "Do the task\n\n[User utterance]\nmy utterance")
+
+
+def test_history_is_rendered_once_per_entry():
+    ctx, prompts = SessionContext(), PromptBuilder()
+    ctx.transcript.append(("user", "one"))
+    first = prompts.history(ctx)
+    ctx.transcript.append(("assistant", "two"))
+    second = prompts.history(ctx)
+    # appended to, not rebuilt
+    assert second is first and second[:] == [("user", "one"), ("assistant", "two")]
+
+
+def test_consecutive_prompts_share_their_prefix():
+    ctx, prompts = SessionContext(), PromptBuilder()
+    ctx.transcript.extend([("user", "one"), ("assistant", "two")])
+    before = prompts.build("task", ctx)
+    ctx.transcript.append(("user", "three"))
+    after = prompts.build("task", ctx)
+    assert after[:len(before) - 1] == before[:-1]
+
+
+def test_summary_replaces_folded_entries():
+    ctx = SessionContext()
+    ctx.transcript.extend([("user", "a"), ("assistant", "b"), ("user", "c")])
+    ctx.summary, ctx.summary_upto = "caller said a", 2
+    messages = PromptBuilder().build("task", ctx)
+    assert messages[1] == ("system", "[Conversation summary]\ncaller said a")
+    assert messages[2:-1] == [("user", "c")]
+
+
+def test_forks_do_not_see_each_others_entries():
+    base, prompts = SessionContext(), PromptBuilder()
+    base.transcript.append(("user", "one"))
+    prompts.history(base)
+    left, right = base.fork(), base.fork()
+    left.transcript.append(("assistant", "left"))
+    right.transcript.append(("assistant", "right"))
+    assert prompts.history(left)[:] == [("user", "one"), ("assistant", "left")]
+    assert prompts.history(right)[:] == [("user", "one"), ("assistant", "right")]
+    assert prompts.history(base)[:] == [("user", "one")]
@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+
+from agent.demo import HAPPY_PATH
+from agent.prompts import QUESTION_TEMPLATES
+
+
+def first_turn(agent) -> tuple[int, str, dict]:
+    """LLM calls, reply and asked slot for the turn after the greeting."""
+    async def main():
+        ctx, _ = await agent.process("")
+        before = agent.llm.backend.calls
+        ctx, reply = await agent.process(HAPPY_PATH[0], ctx)
+        return agent.llm.backend.calls - before, reply, ctx.metadata["asked_slot"]
+
+    return asyncio.run(main())
+
+
+def test_llm_mode_phrases_questions_with_a_second_call(make_agent):
+    agent = make_agent(question_mode="llm")
+    calls, _, _ = first_turn(agent)
+    assert calls == 2
+    assert agent.handler.stats["collect_info.llm"] == 1
+
+
+def test_combined_mode_asks_in_the_routing_call(make_agent):
+    agent = make_agent(question_mode="combined")
+    calls, reply, asked = first_turn(agent)
+    assert calls == 1
+    assert reply == QUESTION_TEMPLATES[asked]
+    assert agent.handler.stats["collect_info.combined"] == 1
+
+
+def test_template_mode_needs_no_question_call(make_agent):
+    agent = make_agent(question_mode="template")
+    calls, reply, asked = first_turn(agent)
+    assert calls == 1
+    assert reply == QUESTION_TEMPLATES[asked]
+    assert agent.handler.stats["collect_info.template"] == 1
+
+
+def test_combined_mode_falls_back_to_the_template(make_agent):
+    agent = make_agent(question_mode="combined")
+
+    async def main():
+        ctx, _ = await agent.process("")
+        ctx, _ = await agent.process(HAPPY_PATH[0], ctx)
+        # the rules fast path answers the address question without the model
+        ctx, reply = await agent.process("12 Oak Street", ctx)
+        return ctx, reply
+
+    ctx, reply = asyncio.run(main())
+    assert ctx.slots.contact_address == "12 Oak Street"
+    assert reply == QUESTION_TEMPLATES[ctx.metadata["asked_slot"]]
+    assert agent.handler.stats["collect_info.template"] == 1
+
+
+def test_unknown_question_mode(make_agent):
+    with pytest.raises(ValueError):
+        make_agent(question_mode="smart")
@@ -0,0 +1,125 @@
+import asyncio
+import datetime as dt
+
+import pytest
+
+from agent.availability import AvailabilityEngine
+from agent.reservation import MemoryReservations, SqliteReservations, set_reservations
+from agent.tools import create_appointment, get_availability, hold_slots, release_holds
+
+MONDAY = dt.datetime(2030, 1, 7, 7, 0)
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def reservations(request, tmp_path):
+    if request.param == "memory":
+        reservations = MemoryReservations()
+    else:
+        reservations = SqliteReservations(str(tmp_path / "reservations.sqlite3"))
+    set_reservations(reservations)
+    yield reservations
+    if isinstance(reservations, SqliteReservations):
+        reservations.close()
+
+
+async def book_one(call_id: str) -> bool:
+    # what offer_slots and confirm_schedule do: hold three, book the first
+    slots = (await get_availability("plumb_000", "tomorrow"))["slots"]
+    held = (await hold_slots(call_id, [s["slot_id"] for s in slots], want=3))["holds"]
+    assert len(held) == min(3, len(slots)), "offered a slot that was taken"
+    if not held:
+        return False
+    (slot_id, hold_id), *others = held.items()
+    await release_holds([h for _, h in others])
+    booked = await create_appointment({"name": call_id}, "plumb_000", slot_id, hold_id=hold_id)
+    return booked["success"]
+
+
+def test_bookings_beyond_one_search_page(reservations):
+    async def main():
+        return [await book_one(f"call{i}") for i in range(15)]
+
+    # more than the 6 slots a search returns
+    assert all(asyncio.run(main()))
+    assert reservations.committed == 15
+
+
+def test_expired_holds_free_the_technician(reservations):
+    async def main():
+        slots = (await get_availability("plumb_000", "tomorrow", time_preference="9am"))["slots"]
+        slot_id = slots[0]["slot_id"]
+        _, _, staff = reservations.engine.candidates(slot_id)
+        for i in range(len(staff)):
+            assert await reservations.hold(f"call{i}", [slot_id], ttl=-1)
+        # each hold expires right away, so the next caller still gets one
+        return await reservations.book("late", slot_id)
+
+    assert asyncio.run(main()) is not None
+
+
+def test_sqlite_claims_reach_other_processes(tmp_path):
+    path = str(tmp_path / "shared.sqlite3")
+    engines = [AvailabilityEngine.load(now=lambda: MONDAY) for _ in range(2)]
+    first, second = (SqliteReservations(path, engine=e) for e in engines)
+
+    async def main():
+        slot_id = engines[0].find_slots("plumb_000", "tomorrow", limit=1)[0]["slot_id"]
+        _, _, staff = engines[0].candidates(slot_id)
+        held = [await first.hold(f"call{i}", [slot_id]) for i in range(len(staff))]
+        assert all(held)
+        await second.refresh()
+        assert slot_id not in {s["slot_id"] for s in engines[1].find_slots("plumb_000", "tomorrow")}
+        await first.release([h[slot_id] for h in held[:1]])
+        await second.refresh()
+        return slot_id in {s["slot_id"] for s in engines[1].find_slots("plumb_000", "tomorrow")}
+
+    try:
+        assert asyncio.run(main())
+    finally:
+        first.close()
+        second.close()
+
+
+def test_sqlite_threads_only_run_sql(tmp_path):
+    engine = AvailabilityEngine.load(now=lambda: MONDAY)
+    reservations = SqliteReservations(str(tmp_path / "r.sqlite3"), engine=engine)
+    slot_id = engine.find_slots("plumb_000", "tomorrow", limit=1)[0]["slot_id"]
+    _, _, staff = engine.candidates(slot_id)
+    try:
+        # what hold runs in the worker thread: the calendars and counters
+        # are left to the event loop
+        _, _, _, changes = reservations._hold("call", [slot_id] * len(staff), None, None)
+        assert len(changes) == len(staff) and reservations.held == 0
+        assert slot_id in {s["slot_id"] for s in engine.find_slots("plumb_000", "tomorrow")}
+        reservations._apply(changes)
+        assert slot_id not in {s["slot_id"] for s in engine.find_slots("plumb_000", "tomorrow")}
+    finally:
+        reservations.close()
+
+
+def test_sqlite_refresh_reads_only_new_changes(tmp_path):
+    path = str(tmp_path / "shared.sqlite3")
+    engines = [AvailabilityEngine.load(now=lambda: MONDAY) for _ in range(2)]
+    first, second = (SqliteReservations(path, engine=e) for e in engines)
+
+    async def main():
+        slot_ids = [s["slot_id"] for s in engines[0].find_slots("plumb_000", "this week")]
+        held = await first.hold("call", slot_ids[:3])
+        await first.commit(held[slot_ids[0]])
+        await second.refresh()
+        assert len(second._mirrored) == 3
+        await first.hold("short", slot_ids[3:4], ttl=0.2)
+        # one new entry since the last refresh, not every live claim
+        assert len(second._refresh()) == 1
+        await second.refresh()
+        assert len(second._mirrored) == 4
+        # the short hold expires without another entry
+        await asyncio.sleep(0.3)
+        await second.refresh()
+        return len(second._mirrored)
+
+    try:
+        assert asyncio.run(main()) == 3
+    finally:
+        first.close()
+        second.close()
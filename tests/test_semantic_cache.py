@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+from agent.data_model import SessionContext
+from agent.semantic_cache import HashingEmbedder, SemanticCache, cacheable
+
+WEEKENDS = ("Do you do weekend calls?", "Yes, we work Saturdays.")
+
+
+def lookup(cache: SemanticCache, question: str):
+    return asyncio.run(cache.lookup(question))
+
+
+def preloaded(**options) -> SemanticCache:
+    cache = SemanticCache(**options)
+    asyncio.run(cache.add_many([WEEKENDS, ("How much for cleaning a drain?", "From $120.")]))
+    return cache
+
+
+def test_embeddings_are_unit_rows():
+    vectors = HashingEmbedder(dim=64).embed(["weekend calls", "drain cleaning"])
+    assert vectors.shape == (2, 64)
+    assert abs(float((vectors ** 2).sum(axis=1)[0]) - 1) < 1e-5
+
+
+def test_paraphrase_hits_unrelated_misses():
+    cache = preloaded(threshold=0.6)
+    answer, score = lookup(cache, "do you do weekend call outs")
+    assert answer == WEEKENDS[1] and score >= 0.6
+    assert lookup(cache, "Can I pay by card?") is None
+    assert cache.stats()["hits"] == 1
+
+
+def test_negated_question_misses():
+    cache = preloaded(threshold=0.5)
+    assert lookup(cache, "Do you not do weekend calls?") is None
+    assert lookup(cache, "Don't you do weekend calls?") is None
+
+
+def test_capacity_overwrites_the_oldest():
+    cache = SemanticCache(capacity=2)
+    asyncio.run(cache.add_many([("a b c", "1"), ("d e f", "2"), ("g h i", "3")]))
+    assert len(cache) == 2
+    assert lookup(cache, "a b c") is None
+    assert lookup(cache, "g h i")[0] == "3"
+
+
+@pytest.mark.parametrize("question", [
+    "Is my booking at 12 Oak St confirmed?",
+    "Does Steven Manley have an appointment?",
+    "I'm Ann, do you do weekends?",
+    "Can you call 555-123-4567?",
+])
+def test_personal_questions_are_not_cacheable(question):
+    assert not cacheable(question)
+
+
+def test_generic_questions_are_cacheable():
+    assert cacheable("Do you do weekend calls?")
+    assert cacheable("How much for cleaning a drain? Do you take cards?")
+
+
+def test_generated_answers_are_only_kept_when_learning(make_agent):
+    async def ask(agent, question):
+        return await agent.handler.handoff_to_completion(SessionContext(), question)
+
+    curated = SemanticCache()
+    asyncio.run(ask(make_agent(faq_cache=curated), "Do you do weekend calls?"))
+    assert len(curated) == 0
+
+    learning = SemanticCache(learn=True)
+    agent = make_agent(faq_cache=learning)
+    asyncio.run(ask(agent, "Do you do weekend calls?"))
+    asyncio.run(ask(agent, "Is my booking at 12 Oak St confirmed?"))
+    assert len(learning) == 1
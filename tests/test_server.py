@@ -0,0 +1,73 @@
+import asyncio
+import os
+import struct
+
+import pytest
+
+from agent.server import WebSocket, WebSocketError, owner, worker_count
+
+
+def test_one_worker_by_default_without_shared_state():
+    assert worker_count(None, None, None) == 1
+    assert worker_count(None, "reservations.sqlite3", None) == 1
+
+
+def test_one_worker_per_core_with_shared_state():
+    assert worker_count(None, "r.sqlite3", "w.sqlite3") == (os.cpu_count() or 1)
+    assert worker_count(3, "r.sqlite3", "w.sqlite3") == 3
+
+
+@pytest.mark.parametrize("reservations, waitlist", [
+    (None, None), ("r.sqlite3", None), (None, "w.sqlite3")])
+def test_several_workers_refused_without_shared_state(reservations, waitlist):
+    with pytest.raises(ValueError, match="--reservations and --waitlist"):
+        worker_count(4, reservations, waitlist)
+    assert worker_count(1, reservations, waitlist) == 1
+
+
+def test_call_always_goes_to_the_same_worker():
+    workers = [owner(f"call-{i}", 4) for i in range(100)]
+    assert workers == [owner(f"call-{i}", 4) for i in range(100)]
+    assert set(workers) == {0, 1, 2, 3}
+
+
+class Sent:
+    """What a WebSocket writes back."""
+
+    def __init__(self):
+        self.data = b""
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+
+def client_frame(opcode: int, payload: bytes, fin: bool = True) -> bytes:
+    # masked with zeros, so the payload goes as it is
+    return struct.pack("!BB", (0x80 if fin else 0) | opcode, 0x80 | len(payload)) \
+        + b"\0" * 4 + payload
+
+
+def receive(*frames: bytes, max_size: int = 64):
+    async def main():
+        reader = asyncio.StreamReader()
+        reader.feed_data(b"".join(frames))
+        sent = Sent()
+        ws = WebSocket(reader, sent, max_size)
+        return await ws.receive(), sent.data
+    return asyncio.run(main())
+
+
+def test_websocket_joins_fragments_and_answers_pings():
+    text, sent = receive(client_frame(0x1, b"hel", fin=False), client_frame(0x9, b"hi"),
+                         client_frame(0x0, b"lo"))
+    assert text == "hello" and sent == bytes([0x8A, 2]) + b"hi"
+
+
+def test_websocket_limits_messages_not_pings():
+    assert receive(client_frame(0x9, b"x" * 40), client_frame(0x1, b"y" * 40))[0] == "y" * 40
+    with pytest.raises(WebSocketError) as e:
+        receive(client_frame(0x1, b"y" * 40, fin=False), client_frame(0x0, b"y" * 40))
+    assert e.value.code == 1009
@@ -0,0 +1,154 @@
+import asyncio
+
+from agent.backends import Latency
+from agent.data_model import StateName
+from agent.demo import HAPPY_PATH
+from agent.loadtest import SCENARIOS
+from agent.reservation import get_reservations
+
+
+async def speculate(agent, ctx, text):
+    assert agent.process_partial(text, ctx, stable=text)
+    await agent._speculations[ctx.call_id].task
+
+
+def test_matching_final_reuses_the_speculative_turn(make_agent, replay_llm):
+    agent, backend = make_agent(), replay_llm.backend
+
+    async def main():
+        ctx, _ = await agent.process("")
+        await speculate(agent, ctx, HAPPY_PATH[0])
+        # speculation commits nothing to the session
+        assert ctx.slots.customer_name is None and len(ctx.transcript) == 1
+        calls = backend.calls
+        final, reply = await agent.process(HAPPY_PATH[0], ctx)
+        return final, reply, backend.calls - calls
+
+    final, reply, calls = asyncio.run(main())
+    assert calls == 0
+    assert agent.handler.stats["speculation.reused"] == 1
+    assert final.slots.customer_name == "Steven Manley"
+    assert final.transcript[-2:] == [("user", HAPPY_PATH[0]), ("assistant", reply)]
+
+
+def test_reuse_ignores_case_and_punctuation(make_agent):
+    agent = make_agent()
+    spoken = HAPPY_PATH[0].lower().rstrip(".")
+
+    async def main():
+        ctx, _ = await agent.process("")
+        await speculate(agent, ctx, HAPPY_PATH[0])
+        return await agent.process(spoken, ctx)
+
+    final, _ = asyncio.run(main())
+    assert agent.handler.stats["speculation.reused"] == 1
+    # the transcript has what the caller finally said
+    assert final.transcript[1] == ("user", spoken)
+
+
+def test_different_final_discards_the_speculation(make_agent):
+    agent = make_agent()
+
+    async def main():
+        ctx, _ = await agent.process("")
+        await speculate(agent, ctx, "I need a plumber")
+        return await agent.process(HAPPY_PATH[0], ctx)
+
+    final, _ = asyncio.run(main())
+    assert agent.handler.stats["speculation.discarded"] == 1
+    assert "speculation.reused" not in agent.handler.stats
+    assert final.slots.customer_name == "Steven Manley"
+
+
+def test_speculation_on_a_stale_session_is_discarded(make_agent):
+    agent = make_agent()
+
+    async def main():
+        ctx, _ = await agent.process("")
+        later, _ = await agent.process(HAPPY_PATH[0], ctx)
+        # started from the session before the last turn
+        await speculate(agent, ctx, HAPPY_PATH[1])
+        return await agent.process(HAPPY_PATH[1], later)
+
+    final, _ = asyncio.run(main())
+    assert agent.handler.stats["speculation.discarded"] == 1
+    assert final.slots.contact_address == "123 Main Street, Springfield"
+    assert final.slots.customer_name == "Steven Manley"
+
+
+def test_speculation_stops_before_side_effects(make_agent):
+    agent = make_agent()
+    text = SCENARIOS["one_shot"][0]
+
+    async def main():
+        ctx, _ = await agent.process("")
+        await speculate(agent, ctx, text)
+        speculative, reply, _ = agent._speculations[ctx.call_id].task.result()
+        assert speculative.state == StateName.OFFER_SLOTS and reply == ""
+        assert len(get_reservations()) == 0
+        return await agent.process(text, ctx)
+
+    final, reply = asyncio.run(main())
+    assert agent.handler.stats["speculation.reused"] == 1
+    # the final turn made the holds and offered them
+    assert final.state == StateName.CONFIRM_SCHEDULE and "Option 1" in reply
+    assert len(get_reservations()) > 0
+
+
+def test_streamed_turn_reuses_the_speculation(make_agent):
+    agent = make_agent()
+
+    async def main():
+        ctx, _ = await agent.process("")
+        await speculate(agent, ctx, HAPPY_PATH[0])
+        stream = agent.process_stream(HAPPY_PATH[0], ctx)
+        return [chunk async for chunk in stream], stream
+
+    chunks, stream = asyncio.run(main())
+    assert agent.handler.stats["speculation.reused"] == 1
+    assert chunks == [stream.reply] and stream.reply
+
+
+def test_speculation_waits_for_the_whole_hypothesis(make_agent):
+    agent = make_agent()
+
+    async def main():
+        ctx, _ = await agent.process("")
+        started = [agent.process_partial(partial, ctx)
+                   for partial in ("I need", "I need a plumber", "I need a plumber")]
+        return ctx, started
+
+    ctx, started = asyncio.run(main())
+    # the first two are still changing; the third repeats the second
+    assert started == [False, False, True]
+    assert agent._speculations[ctx.call_id].text == "I need a plumber"
+
+
+def test_no_speculation_in_states_with_side_effects(make_agent):
+    agent = make_agent()
+
+    async def main():
+        ctx, _ = await agent.process("")
+        ctx.state = StateName.CONFIRM_SCHEDULE
+        return agent.process_partial("Option 1", ctx, stable="Option 1")
+
+    assert asyncio.run(main()) is False
+    assert "speculation.started" not in agent.handler.stats
+
+
+def test_discard_partial_cancels_the_turn(make_agent, replay_llm):
+    agent = make_agent()
+
+    async def main():
+        ctx, _ = await agent.process("")
+        replay_llm.backend.latency = Latency.fixed(10)
+        assert agent.process_partial(HAPPY_PATH[0], ctx, stable=HAPPY_PATH[0])
+        task = agent._speculations[ctx.call_id].task
+        await asyncio.sleep(0)
+        agent.discard_partial(ctx.call_id)
+        await asyncio.wait([task])
+        return ctx, task
+
+    ctx, task = asyncio.run(main())
+    assert task.cancelled()
+    assert ctx.call_id not in agent._speculations
@@ -0,0 +1,161 @@
+import asyncio
+
+from agent.codec import (
+    COMPRESS_THRESHOLD,
+    FORMAT_JSON,
+    FORMAT_ZLIB,
+    decode_delta,
+    decode_session,
+    encode_delta,
+    encode_session,
+)
+from agent.data_model import SessionContext, StateName
+from agent.demo import HAPPY_PATH
+from agent.store import MemorySessionStore, SqliteSessionStore
+
+
+def session(turns: int = 2) -> SessionContext:
+    ctx = SessionContext(state=StateName.COLLECT_INFO)
+    ctx.slots.customer_name = "Ann Lee"
+    ctx.slots.preferred_time = "PM"
+    for text in HAPPY_PATH[:turns]:
+        ctx.transcript.extend([("user", text), ("assistant", "ok")])
+    ctx.metadata["asked_slot"] = "contact_number"
+    ctx.summary, ctx.summary_upto = "so far", 2
+    return ctx
+
+
+def test_codec_round_trip():
+    ctx = session()
+    data = encode_session(ctx)
+    assert data[:1] == FORMAT_JSON
+    assert decode_session(data) == ctx
+
+
+def test_codec_compresses_long_sessions():
+    ctx = session(turns=len(HAPPY_PATH))
+    data = encode_session(ctx)
+    assert len(data) < COMPRESS_THRESHOLD or data[:1] == FORMAT_ZLIB
+    assert decode_session(data) == ctx
+
+
+def test_codec_delta_round_trip():
+    base = session()
+    ctx = base.fork()
+    ctx.state = StateName.GET_AVAILABILITY
+    ctx.slots.preferred_time = None
+    ctx.metadata.pop("asked_slot")
+    ctx.transcript.append(("user", "tomorrow"))
+    ctx.summary, ctx.summary_upto = "more", 4
+    delta = ctx.diff(base)
+    assert decode_delta(encode_delta(delta)) == delta
+    assert base.apply(decode_delta(encode_delta(delta))) == ctx
+
+
+def test_memory_store_evicts_least_recently_used():
+    store = MemorySessionStore(max_sessions=2)
+
+    async def main():
+        a, b, c = (SessionContext(call_id=i) for i in "abc")
+        await store.save(a)
+        await store.save(b)
+        await store.load("a")
+        await store.save(c)
+        return [await store.load(i) is not None for i in "abc"]
+
+    assert asyncio.run(main()) == [True, False, True]
+
+
+def test_memory_store_expires_sessions():
+    store = MemorySessionStore(ttl=-1)
+
+    async def main():
+        await store.save(SessionContext(call_id="a"))
+        return await store.load("a")
+
+    assert asyncio.run(main()) is None and len(store) == 0
+
+
+def test_sqlite_store_round_trip(tmp_path):
+    path = str(tmp_path / "sessions.sqlite3")
+
+    async def main():
+        store = SqliteSessionStore(path)
+        ctx = session()
+        await store.save(ctx)
+        store.close()
+        # another process opening the same file sees it
+        other = SqliteSessionStore(path)
+        loaded = await other.load(ctx.call_id)
+        await other.delete(ctx.call_id)
+        gone = await other.load(ctx.call_id)
+        other.close()
+        return ctx, loaded, gone
+
+    ctx, loaded, gone = asyncio.run(main())
+    assert loaded == ctx and gone is None
+
+
+def test_sqlite_store_purges_expired(tmp_path):
+    async def main():
+        store = SqliteSessionStore(str(tmp_path / "s.sqlite3"), ttl=-1)
+        await store.save(SessionContext(call_id="a"))
+        loaded = await store.load("a")
+        purged = await store.purge_expired()
+        store.close()
+        return loaded, purged
+
+    assert asyncio.run(main()) == (None, 1)
+
+
+def test_process_call_keeps_sessions_in_the_store(make_agent):
+    agent = make_agent()
+
+    async def main():
+        await agent.process_call("call-1", "")
+        ctx, _ = await agent.process_call("call-1", HAPPY_PATH[0])
+        return ctx, await agent.store.load("call-1")
+
+    ctx, stored = asyncio.run(main())
+    assert stored is ctx and ctx.slots.customer_name == "Steven Manley"
+
+
+def test_sqlite_store_saves_turns_as_deltas(tmp_path, make_agent):
+    path = str(tmp_path / "sessions.sqlite3")
+    store = SqliteSessionStore(path, compact_every=2)
+    agent = make_agent()
+    agent.store = store
+
+    async def main():
+        ctx = None
+        deltas = []
+        for text in ["", *HAPPY_PATH[:4]]:
+            ctx, _ = await agent.process_call("call-1", text)
+            (count,), = store._conn.execute("SELECT COUNT(*) FROM session_deltas").fetchall()
+            deltas.append(count)
+        store.close()
+        other = SqliteSessionStore(path)
+        loaded = await other.load("call-1")
+        other.close()
+        return ctx, deltas, loaded
+
+    ctx, deltas, loaded = asyncio.run(main())
+    # the first turn writes the session, then two deltas, then it is rewritten
+    assert deltas == [0, 1, 2, 0, 1]
+    assert loaded == ctx and ctx.slots.contact_number == "555-123-4567"
+
+
+def test_sqlite_store_delete_and_purge_drop_deltas(tmp_path):
+    async def main():
+        store = SqliteSessionStore(str(tmp_path / "s.sqlite3"), ttl=-1)
+        base = session()
+        await store.save(base)
+        ctx = base.fork()
+        ctx.transcript.append(("user", "more"))
+        await store.save(ctx, base)
+        purged = await store.purge_expired()
+        left = store._conn.execute("SELECT COUNT(*) FROM session_deltas").fetchall()
+        store.close()
+        return purged, left
+
+    assert asyncio.run(main()) == (1, [(0,)])
@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+from agent import core
+from agent.backends import ReplayBackend
+from agent.core import ROUTE
+from agent.llm import LlmClient
+from agent.structured import JsonStream, Schema, SchemaError, loads
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('{"intent": "book"}', {"intent": "book"}),
+    ('Sure! ```json\n{"intent": "book"}\n``` Anything else?', {"intent": "book"}),
+    ('{"intent": "book", // the intent\n /* none */ "slots": {}}', {"intent": "book", "slots": {}}),
+    ("{intent: 'book', slots: {name: 'Ann',},}", {"intent": "book", "slots": {"name": "Ann"}}),
+    ('{"a": 1 "b": 2}', {"a": 1, "b": 2}),
+    ('{"ok": True, "none": None, "more": ...}', {"ok": True, "none": None, "more": None}),
+    # closed at the end; a cut-off string may be a cut-off word, so it is dropped
+    ('{"intent": "book", "slots": {"customer_name": "Ann', {"intent": "book", "slots": {}}),
+    ('{"text": "say \\"hi\\"\\n\\u00e9"}', {"text": 'say "hi"\né'}),
+    ("no json here", None),
+])
+def test_tolerant_parsing(text, expected):
+    assert loads(text) == expected
+
+
+def test_values_are_reported_as_they_complete():
+    seen = []
+    stream = JsonStream(lambda path, value: seen.append(path))
+    for chunk in ['{"inte', 'nt": "bo', 'ok", "slots": {"customer_', 'name": "Ann"}', '}']:
+        stream.feed(chunk)
+        if chunk.endswith('ok", "slots": {"customer_'):
+            assert seen == [("intent",)]
+    assert stream.done
+    assert seen[:2] == [("intent",), ("slots", "customer_name")]
+    assert stream.finish() == {"intent": "book", "slots": {"customer_name": "Ann"}}
+
+
+def test_schema_normalizes_and_rejects():
+    assert ROUTE.validate({"intent": " BOOK ", "slots": {"contact_number": 5551234567}}) \
+        == {"intent": "book", "slots": {"contact_number": "5551234567"}}
+    with pytest.raises(SchemaError):
+        ROUTE.validate({"intent": "maybe"})
+    with pytest.raises(SchemaError):
+        ROUTE.validate({"slots": {}})
+    # an optional field that doesn't fit is dropped
+    schema = Schema("t", {"type": "object", "properties": {"n": {"type": "integer"}}})
+    assert schema.validate({"n": "x"}) == {}
+    assert schema.parse("nothing") is None
+
+
+def route_agent(make_agent, utterance: str, answer: dict):
+    llm = LlmClient(model_name="replay", backend=ReplayBackend(routes={utterance: answer}))
+    return make_agent(llm)
+
+
+def test_invalid_routing_answer_merges_no_slots(make_agent, monkeypatch):
+    looked_up = []
+    real = core.check_service
+
+    def check_service(name):
+        looked_up.append(name)
+        return real(name)
+
+    monkeypatch.setattr(core, "check_service", check_service)
+    utterance = "Hi there, plumbing in the morning?"
+    agent = route_agent(make_agent, utterance, {
+        "slots": {"customer_name": "Ann Lee", "service_requested": "plumb",
+                  "preferred_time": "AM"},
+        "intent": "maybe"})
+
+    async def main():
+        ctx, _ = await agent.process("")
+        ctx, _ = await agent.process(utterance, ctx)
+        return ctx
+
+    ctx = asyncio.run(main())
+    assert ctx.slots.customer_name is None and ctx.slots.service_requested is None
+    # the streamed values still served as prefetch hints
+    assert looked_up == ["plumb"]
+
+
+def test_valid_routing_answer_is_merged(make_agent):
+    utterance = "Hi there, plumbing in the morning?"
+    agent = route_agent(make_agent, utterance, {
+        "intent": "book",
+        "slots": {"customer_name": "Ann Lee", "service_requested": "plumb",
+                  "preferred_time": "AM"}})
+
+    async def main():
+        ctx, _ = await agent.process("")
+        return (await agent.process(utterance, ctx))[0]
+
+    ctx = asyncio.run(main())
+    assert (ctx.slots.customer_name, ctx.slots.preferred_time) == ("Ann Lee", "AM")
@@ -0,0 +1,78 @@
+import asyncio
+import sys
+import types
+
+from agent.backends import ReplayBackend
+from agent.llm import LlmClient
+from agent.tokens import TokenCounter, estimate_tokens
+from agent.tracing import HistogramAggregator, SpanExporter, Tracer, set_tracer
+
+
+class Spans(SpanExporter):
+    def __init__(self):
+        self.spans = []
+
+    def export(self, span):
+        self.spans.append(span)
+
+    def named(self, name: str):
+        return [s for s in self.spans if s.name == name]
+
+
+def broken_counter(text: str) -> int:
+    raise RuntimeError("tokenizer broke")
+
+
+def test_spans_nest_and_carry_token_counts():
+    spans = Spans()
+    tracer = Tracer(spans, counter=estimate_tokens)
+    llm = LlmClient(backend=ReplayBackend(), tracer=tracer)
+    with tracer.span("turn") as turn:
+        asyncio.run(llm.arun("Greet the caller"))
+    (call,) = spans.named("llm")
+    assert call.parent_id == turn.id
+    assert call.attributes["prompt_tokens"] > 0
+    assert call.attributes["completion_tokens"] > 0
+
+
+def test_token_count_failure_does_not_fail_the_call():
+    spans = Spans()
+    llm = LlmClient(backend=ReplayBackend(), tracer=Tracer(spans, counter=broken_counter))
+
+    async def main():
+        text = await llm.arun("hi")
+        streamed = [chunk async for chunk in llm.astream("hi")]
+        batch = await llm.abatch(["hi", "hello"])
+        return text, streamed, batch
+
+    text, streamed, batch = asyncio.run(main())
+    assert text and "".join(streamed) == text and len(batch) == 2
+    assert len(spans.spans) == 3
+    assert not any("prompt_tokens" in s.attributes for s in spans.spans)
+
+
+def test_tracer_counts_with_the_shared_token_counter(monkeypatch):
+    calls = []
+    offline = types.ModuleType("tiktoken")
+
+    def get_encoding(name):
+        calls.append(name)
+        raise ConnectionError("offline")
+
+    offline.get_encoding = get_encoding
+    monkeypatch.setitem(sys.modules, "tiktoken", offline)
+    tracer = Tracer()
+    assert isinstance(tracer._counter, TokenCounter)
+    asyncio.run(tracer.warmup())
+    # estimated, and the encoding isn't fetched again on every count
+    assert tracer.count_tokens("abcdefgh") == 2
+    assert calls == ["o200k_base"]
+
+
+def test_histograms_per_span_name(make_agent):
+    aggregator = HistogramAggregator()
+    set_tracer(Tracer(aggregator, counter=estimate_tokens))
+    asyncio.run(make_agent().process(""))
+    report = aggregator.report()
+    assert {"turn", "state.START"} <= report.keys()
+    assert report["turn"]["ms"]["count"] == 1
@@ -0,0 +1,65 @@
+import asyncio
+import dataclasses
+
+import pytest
+
+from agent.core import TRANSITIONS, Agent, StateHandler, Transition
+from agent.data_model import StateName
+from agent.demo import HAPPY_PATH
+
+S = StateName
+
+
+def test_every_handler_exists():
+    for spec in TRANSITIONS.values():
+        assert spec.terminal or callable(getattr(StateHandler, spec.handler))
+
+
+def test_every_state_is_reachable_from_start():
+    seen, todo = {S.START}, [S.START]
+    while todo:
+        for state in TRANSITIONS[todo.pop()].next - seen:
+            seen.add(state)
+            todo.append(state)
+    assert seen == TRANSITIONS.keys()
+
+
+def test_unknown_next_state_is_rejected(replay_llm):
+    table = {S.START: Transition("greeting", next=frozenset({S.LISTEN}))}
+    with pytest.raises(ValueError, match="LISTEN"):
+        Agent(replay_llm, transitions=table)
+
+
+def test_happy_path_ends_the_conversation(make_agent):
+    agent = make_agent(question_mode="template")
+
+    async def main():
+        ctx, _ = await agent.process("")
+        for text in HAPPY_PATH:
+            ctx, _ = await agent.process(text, ctx)
+        return ctx
+
+    ctx = asyncio.run(main())
+    assert ctx.state == S.END
+    assert ctx.metadata["appointment_id"]
+
+
+def test_transitions_outside_the_table_fail(make_agent, replay_llm):
+    table = dict(TRANSITIONS)
+    # greeting returns LISTEN, which this table doesn't allow
+    table[S.START] = dataclasses.replace(TRANSITIONS[S.START], next=frozenset({S.END}))
+    agent = Agent(replay_llm, handler=make_agent().handler, transitions=table)
+    with pytest.raises(RuntimeError, match="invalid transition"):
+        asyncio.run(agent.process(""))
+
+
+class Looping:
+    async def loop(self, ctx, user_text):
+        return S.START, ""
+
+
+def test_a_turn_is_bounded(replay_llm):
+    table = {S.START: Transition("loop", next=frozenset({S.START}))}
+    agent = Agent(replay_llm, handler=Looping(), transitions=table, max_steps=3)
+    with pytest.raises(RuntimeError, match="3 steps"):
+        asyncio.run(agent.process(""))
@@ -0,0 +1,134 @@
+import asyncio
+import datetime as dt
+import logging
+import time
+
+import pytest
+
+from agent.availability import get_engine
+from agent.data_model import SessionContext, Slots
+from agent.reservation import get_reservations
+from agent.tools import create_appointment
+from agent.waitlist import WaitlistMatcher, WaitlistStore, get_waitlist, parse_window
+
+MONDAY = dt.date(2030, 1, 7)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = WaitlistStore(str(tmp_path / "waitlist.sqlite3"))
+    yield store
+    store.close()
+
+
+def matcher(store: WaitlistStore, sent: list, **options) -> WaitlistMatcher:
+    async def notify(notification):
+        sent.append(notification)
+    return WaitlistMatcher(store, notify=notify, interval=0, **options)
+
+
+async def wait_for(store: WaitlistStore, name: str):
+    return await store.add("plumb_000", {"name": name}, parse_window("tomorrow", MONDAY))
+
+
+async def free_a_slot() -> str:
+    # a slot held by someone else and given back
+    slot_id = get_engine().find_slots("plumb_000", "tomorrow", limit=1)[0]["slot_id"]
+    held = await get_reservations().hold("someone", [slot_id])
+    await get_reservations().release(list(held.values()))
+    return slot_id
+
+
+def test_freed_slots_go_to_the_oldest_entry(store):
+    sent = []
+
+    async def main():
+        first, _ = await wait_for(store, "first"), await wait_for(store, "second")
+        m = matcher(store, sent)
+        m.start()
+        slot_id = await free_a_slot()
+        await m.stop()
+        return first, slot_id
+
+    first, slot_id = asyncio.run(main())
+    assert [(n.entry.entry_id, n.slot["slot_id"]) for n in sent] == [(first.entry_id, slot_id)]
+    entry = store.get(first.entry_id)
+    assert entry.status == "notified" and entry.hold_id == sent[0].hold_id
+    assert store.stats() == {"notified": 1, "waiting": 1}
+
+
+def test_no_matching_without_a_notifier(store, caplog):
+    async def main():
+        await wait_for(store, "first")
+        m = WaitlistMatcher(store)
+        with caplog.at_level(logging.WARNING):
+            m.start()
+            m.start()
+        assert m.freed not in get_reservations().listeners
+        m.freed(await free_a_slot())
+        return await m.run_once()
+
+    assert asyncio.run(main()) == []
+    assert store.stats() == {"waiting": 1}
+    assert len(caplog.records) == 1
+
+
+def test_lapsed_holds_requeue_the_customer(store):
+    sent = []
+
+    async def main():
+        first, second = await wait_for(store, "first"), await wait_for(store, "second")
+        m = matcher(store, sent, hold_ttl=0.01)
+        get_reservations().listeners.append(m.freed)
+        slot_id = await free_a_slot()
+        await m.run_once()
+        await asyncio.sleep(0.02)
+        # the hold lapses: the slot goes to the next customer, the first waits again
+        await m.run_once()
+        return first, second, slot_id
+
+    first, second, slot_id = asyncio.run(main())
+    assert [n.entry.entry_id for n in sent] == [first.entry_id, second.entry_id]
+    assert store.get(first.entry_id).status == "waiting"
+    assert store.get(second.entry_id).slot_id == slot_id
+
+
+def test_booked_entries_stay_booked(store, monkeypatch):
+    sent = []
+    monkeypatch.setattr("agent.tools.get_waitlist", lambda: store)
+
+    async def main():
+        entry = await wait_for(store, "first")
+        m = matcher(store, sent)
+        m.freed(await free_a_slot())
+        (notification,) = await m.run_once()
+        booked = await create_appointment(entry.customer, "plumb_000",
+                                          notification.slot["slot_id"],
+                                          hold_id=notification.hold_id)
+        assert booked["success"]
+        return entry
+
+    entry = asyncio.run(main())
+    assert store.requeue(time.time() + 1) == 0
+    assert store.get(entry.entry_id).status == "booked"
+
+
+def test_entries_survive_a_restart(store):
+    entry = asyncio.run(wait_for(store, "first"))
+    store.close()
+    reopened = WaitlistStore(store.path)
+    try:
+        assert reopened.get(entry.entry_id).customer == {"name": "first"}
+        assert len(reopened.waiting("plumb_000", entry.start, entry.end)) == 1
+    finally:
+        reopened.close()
+
+
+def test_waitlist_window_keeps_the_time_of_day(make_agent):
+    handler = make_agent().handler
+    ctx = SessionContext(slots=Slots(customer_name="Ann", contact_number="555-123-4567",
+                                     preferred_date="tomorrow", preferred_time="AM"))
+    ctx.metadata["service_id"] = "plumb_000"
+    asyncio.run(handler.waitlist_creation(ctx))
+    entry = get_waitlist().get(ctx.metadata["waitlist_id"])
+    assert (entry.start, entry.end, entry.day_start, entry.day_end) == parse_window("tomorrow", MONDAY)[:2] + (0, 720)